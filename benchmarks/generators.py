@@ -0,0 +1,108 @@
+"""
+Generators of parametrised xclingo programs used by the benchmarks. Each generator receives a size and returns the
+program (with its magic comments) as a str.
+"""
+import os
+
+_EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+
+def chain(length):
+    """
+    A long derivation chain: p(N) is derived from p(N-1), so the explanation of p(length) has depth length.
+    @param int length:
+    @return str:
+    """
+    return "\n".join([
+        "step(1..{}).".format(length),
+        '%!trace {"p(0) is a fact"} p(0).',
+        "p(0).",
+        '%!trace_rule {"p(%) follows p(%)",N,N-1}',
+        "p(N) :- p(N-1), step(N).",
+        "%!show_trace p({}).".format(length),
+    ]) + "\n"
+
+
+def diamond(levels):
+    """
+    A lattice of diamonds: each node can be reached through a left or a right node from the previous one, so the last
+    node has 2^levels explanations that share all their sub-explanations.
+    @param int levels:
+    @return str:
+    """
+    return "\n".join([
+        "level(1..{}).".format(levels),
+        '%!trace {"the first node"} node(0).',
+        "node(0).",
+        '%!trace_rule {"left at %",I}',
+        "left(I) :- node(I-1), level(I).",
+        '%!trace_rule {"right at %",I}',
+        "right(I) :- node(I-1), level(I).",
+        '%!trace_rule {"node % through the left",I}',
+        "node(I) :- left(I).",
+        '%!trace_rule {"node % through the right",I}',
+        "node(I) :- right(I).",
+        "%!show_trace node({}).".format(levels),
+    ]) + "\n"
+
+
+def fan_in(width):
+    """
+    A rule whose body has width atoms, each of them a traced fact.
+    @param int width:
+    @return str:
+    """
+    facts = ["in({}).".format(i) for i in range(1, width + 1)]
+    body = ", ".join("in({})".format(i) for i in range(1, width + 1))
+    return "\n".join(facts + [
+        '%!trace {"input %",I} in(I).',
+        '%!trace_rule {"all the inputs"}',
+        "goal :- {}.".format(body),
+        "%!show_trace goal.",
+    ]) + "\n"
+
+
+def facts(size):
+    """
+    A large fact base (a path of size edges) with a single non recursive rule over it.
+    @param int size:
+    @return str:
+    """
+    edges = ["edge({},{}).".format(i, i + 1) for i in range(size)]
+    return "\n".join(edges + [
+        '%!trace {"edge from % to %",X,Y} edge(X,Y).',
+        '%!trace_rule {"% has a successor",X}',
+        "source(X) :- edge(X,Y).",
+        "%!show_trace source(X).",
+    ]) + "\n"
+
+
+def relay(length):
+    """
+    The relay circuit of examples/diag_example with a story of the given length where s1 is toggled every three steps.
+    @param int length:
+    @return str:
+    """
+    with open(os.path.join(_EXAMPLES, "diag_example", "relay.lp")) as relay_file:
+        program = relay_file.read()
+
+    story = [
+        "plength({}).".format(length),
+        "h(light, off, 0).",
+        "h(protect, on, 0).",
+        "h(relayline, off, 0).",
+        "h(s1, open, 0).",
+        "h(s2, open, 0).",
+    ]
+    story.extend("o(toggle(s1), {}).".format(t) for t in range(2, length + 1, 3))
+    return program + "\n" + "\n".join(story) + "\n"
+
+
+# Workloads: name -> (generator, default sizes)
+WORKLOADS = {
+    "chain": (chain, [100, 1000]),
+    "diamond": (diamond, [8, 14]),
+    "fan_in": (fan_in, [100, 1000]),
+    "facts": (facts, [1000, 10000]),
+    "relay": (relay, [10, 40]),
+}
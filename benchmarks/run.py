@@ -0,0 +1,251 @@
+"""
+Stage-level benchmarks of xclingo.
+
+    python benchmarks/run.py run [--workload NAME] [--size N] [--repeat R] [--output FILE]
+    python benchmarks/run.py compare OLD NEW [--threshold T] [--min-delta SECONDS]
+
+'run' generates the workloads (see generators.py), times each stage of xclingo on them and writes the results as JSON.
+'compare' compares two result files and flags the stages that became slower (exit status 1 if there is any).
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from contextlib import contextmanager, redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import clingo
+
+import translation
+import xclingo
+from clingo_utilities import partition_model
+from explanation import ExplanationEngine
+from generators import WORKLOADS
+from magic_comments import translate_magic_comments
+from rendering import AsciiTreeRenderer
+
+# Must change whenever the layout of the result files changes
+RESULTS_FORMAT = 2
+
+# Stages in the order they run
+STAGES = ["magic_comments", "prepare", "ground", "labels", "solve", "fired", "causes", "explanations", "render"]
+# The magic comments are also translated (and timed) inside "prepare", so they are not added to the total
+TOTAL_STAGES = [stage for stage in STAGES if stage != "magic_comments"]
+
+
+class StageTimer:
+    """
+    Accumulates the time spent in each stage (a stage can be entered many times, for example once per model).
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+
+def run_once(program, models, max_atom_explanations):
+    """
+    Explains a program once, timing each stage.
+    @param str program: the program, with its magic comments.
+    @param int models: maximum number of answer sets (0 = all).
+    @param int max_atom_explanations: maximum number of explanations of each atom (0 = all).
+    @return (Dict, Dict): the seconds spent in each stage and the counts of models, causes and explanations.
+    """
+    timer = StageTimer()
+    counts = {"models": 0, "causes": 0, "explanations": 0}
+    limit = max_atom_explanations if max_atom_explanations > 0 else None
+
+    # Also done by prepare_xclingo_program, but timed here on its own
+    with timer.stage("magic_comments"):
+        translate_magic_comments([("<benchmark>", program.splitlines(True))], io.StringIO())
+
+    # The translation prints an empty line
+    with timer.stage("prepare"), redirect_stdout(io.StringIO()):
+        control = translation.prepare_xclingo_program(["-n {}".format(models), "--project"], program, "none")
+
+    with timer.stage("ground"):
+        control.ground([("base", [])])
+
+    with timer.stage("labels"):
+        labels_dict = xclingo.build_labels_dict(control)
+
+    renderer = AsciiTreeRenderer()
+    with control.solve(yield_=True) as handle:
+        models_iterator = iter(handle)
+        while True:
+            with timer.stage("solve"):
+                m = next(models_iterator, None)
+            if m is None:
+                break
+            counts["models"] += 1
+
+            with timer.stage("fired"):
+                fired_values, show_all, _ = partition_model(m.symbols(shown=True), control.fired_names)
+
+            targets = set(show_all) if control.have_explain else None
+            with timer.stage("causes"):
+                causes = xclingo.build_causes(m, control.binding_plans, fired_values, labels_dict, "none", targets)
+            counts["causes"] += len(causes)
+
+            with timer.stage("explanations"):
+                engine = ExplanationEngine(causes)
+                atoms = [a for a in map(causes.symbol, causes.heads()) if targets is None or a in targets]
+                explanations = [xclingo.build_explanations(a, causes, engine, limit) for a in atoms]
+            counts["explanations"] += sum(len(e) for e in explanations)
+
+            with timer.stage("render"):
+                out = io.StringIO()
+                for atom_explanations in explanations:
+                    for explanation in atom_explanations:
+                        renderer.write(explanation, out)
+
+    return timer.seconds, counts
+
+
+def run(workloads, sizes, repeat, models, max_atom_explanations, log=sys.stderr):
+    """
+    @param List[str] workloads: the names of the workloads (see generators.WORKLOADS).
+    @param List[int] sizes: the sizes of the workloads (if empty, the default sizes of each workload).
+    @param int repeat: number of times each benchmark is run.
+    @param int models: maximum number of answer sets (0 = all).
+    @param int max_atom_explanations: maximum number of explanations of each atom (0 = all).
+    @param log: file object where the progress is written.
+    @return Dict: the results (see main).
+    """
+    benchmarks = {}
+    for name in workloads:
+        generator, default_sizes = WORKLOADS[name]
+        for size in sizes or default_sizes:
+            key = "{}/{}".format(name, size)
+            program = generator(size)
+            runs = []
+            for _ in range(repeat):
+                seconds, counts = run_once(program, models, max_atom_explanations)
+                runs.append(seconds)
+            stages = {
+                stage: {"min": min(r[stage] for r in runs), "median": statistics.median(r[stage] for r in runs)}
+                for stage in STAGES
+            }
+            totals = [sum(r[stage] for stage in TOTAL_STAGES) for r in runs]
+            stages["total"] = {"min": min(totals), "median": statistics.median(totals)}
+            benchmarks[key] = {"workload": name, "size": size, "counts": counts, "stages": stages}
+            print("{:<20} {:10.2f} ms".format(key, stages["total"]["median"] * 1000), file=log)
+
+    return {
+        "format": RESULTS_FORMAT,
+        "clingo": clingo.__version__,
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "models": models,
+        "max_atom_explanations": max_atom_explanations,
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(old, new, threshold, min_delta, out=sys.stdout):
+    """
+    Compares the median times of the stages of the benchmarks that are in both results.
+    @param Dict old: the results of the reference run.
+    @param Dict new: the results of the new run.
+    @param float threshold: relative slowdown (0.1 = 10%) from which a stage is flagged as a regression.
+    @param float min_delta: minimum slowdown (in seconds) to flag a regression, so tiny stages do not add noise.
+    @param out: file object where the comparison is written.
+    @return List[(str, str)]: the (benchmark, stage) pairs flagged as regressions.
+    """
+    regressions = []
+    out.write("{:<20} {:<14} {:>12} {:>12} {:>9}\n".format("benchmark", "stage", "old [ms]", "new [ms]", "change"))
+    for key in sorted(set(old["benchmarks"]) & set(new["benchmarks"])):
+        old_stages = old["benchmarks"][key]["stages"]
+        new_stages = new["benchmarks"][key]["stages"]
+        for stage in STAGES + ["total"]:
+            if stage not in old_stages or stage not in new_stages:
+                continue
+            old_seconds = old_stages[stage]["median"]
+            new_seconds = new_stages[stage]["median"]
+            change = (new_seconds - old_seconds) / old_seconds if old_seconds > 0 else 0.0
+
+            flag = ""
+            if change > threshold and new_seconds - old_seconds > min_delta:
+                flag = "REGRESSION"
+                regressions.append((key, stage))
+            elif change < -threshold and old_seconds - new_seconds > min_delta:
+                flag = "improved"
+            out.write("{:<20} {:<14} {:12.2f} {:12.2f} {:+8.1f}% {}\n".format(
+                key, stage, old_seconds * 1000, new_seconds * 1000, change * 100, flag).rstrip() + "\n")
+
+    for key in sorted(set(old["benchmarks"]) ^ set(new["benchmarks"])):
+        out.write("{:<20} only in the {} results\n".format(key, "old" if key in old["benchmarks"] else "new"))
+
+    return regressions
+
+
+def _load_results(path):
+    with open(path) as results_file:
+        results = json.load(results_file)
+    if results.get("format") != RESULTS_FORMAT:
+        raise ValueError("{}: unsupported results format {}".format(path, results.get("format")))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stage-level benchmarks of xclingo.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help="Runs the benchmarks and writes their results.")
+    run_parser.add_argument('--workload', action='append', choices=sorted(WORKLOADS), default=[],
+                            help="Workload to run (can be repeated). Default: all of them.")
+    run_parser.add_argument('--size', action='append', type=int, default=[],
+                            help="Size of the workloads (can be repeated). Default: the sizes of each workload.")
+    run_parser.add_argument('--repeat', type=int, default=5,
+                            help="Number of runs of each benchmark (the median is compared). Default: 5.")
+    run_parser.add_argument('--models', type=int, default=1,
+                            help="Maximum number of answer sets explained (0 = all). Default: 1.")
+    run_parser.add_argument('--max-atom-explanations', type=int, default=1000,
+                            help="Maximum number of explanations of each atom (0 = all). Default: 1000.")
+    run_parser.add_argument('--output', type=str, default=None,
+                            help="JSON file where the results are written. Default: stdout.")
+
+    compare_parser = commands.add_parser('compare', help="Compares two result files and flags the regressions.")
+    compare_parser.add_argument('old', type=str, help="Results of the reference run.")
+    compare_parser.add_argument('new', type=str, help="Results of the new run.")
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="Relative slowdown flagged as a regression. Default: 0.1 (10%%).")
+    compare_parser.add_argument('--min-delta', type=float, default=0.001,
+                                help="Minimum slowdown (in seconds) flagged as a regression. Default: 0.001.")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run(args.workload or sorted(WORKLOADS), args.size, max(1, args.repeat), args.models,
+                      args.max_atom_explanations)
+        if args.output is None:
+            json.dump(results, sys.stdout, indent=2, sort_keys=True)
+            sys.stdout.write("\n")
+        else:
+            with open(args.output, "w") as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+                output.write("\n")
+        return
+
+    try:
+        old, new = _load_results(args.old), _load_results(args.new)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    if compare(old, new, args.threshold, args.min_delta):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
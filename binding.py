@@ -0,0 +1,254 @@
+import operator
+
+import clingo
+from clingo import ast
+
+
+def _division(a, b):
+    # Integer division truncated towards zero (as clingo does)
+    q = abs(a) // abs(b)
+    return q if (a >= 0) == (b >= 0) else -q
+
+
+def _modulo(a, b):
+    return a - b * _division(a, b)
+
+
+_BINARY_OPERATIONS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': _division,
+    '\\': _modulo,
+    '**': operator.pow,
+}
+
+
+def _binary_operator_name(op):
+    """
+    @param ast.BinaryOperator op:
+    @return str: the name of the operator in _BINARY_OPERATIONS, or None if it is not supported.
+    """
+    if op == ast.BinaryOperator.Plus:
+        return '+'
+    if op == ast.BinaryOperator.Minus:
+        return '-'
+    if op == ast.BinaryOperator.Multiplication:
+        return '*'
+    if op == ast.BinaryOperator.Division:
+        return '/'
+    if op == ast.BinaryOperator.Modulo:
+        return '\\'
+    if op == ast.BinaryOperator.Power:
+        return '**'
+    return None
+
+
+def _term_spec(term, arguments):
+    """
+    Translates a term of a traced rule into a plain, picklable specification:
+        - ('var', i): the i-th fired value.
+        - ('num', n), ('sym', text): a constant.
+        - ('fun', name, [specs]): a function term.
+        - ('bin', operator, left, right), ('neg', spec), ('abs', spec): arithmetic.
+    @param ast.AST term:
+    @param Dict arguments: the position of each fired argument (indexed by its str version).
+    @return tuple: the specification or None if the term is not supported.
+    """
+    if term.type == ast.ASTType.Variable:
+        index = arguments.get(str(term))
+        return None if index is None else ('var', index)
+
+    if term.type == ast.ASTType.Symbol:
+        if term['symbol'].type == clingo.SymbolType.Number:
+            return 'num', term['symbol'].number
+        return 'sym', str(term['symbol'])
+
+    if term.type == ast.ASTType.Function:
+        args = [_term_spec(a, arguments) for a in term['arguments']]
+        if None in args:
+            return None
+        return 'fun', term['name'], args
+
+    if term.type == ast.ASTType.BinaryOperation:
+        name = _binary_operator_name(term['operator'])
+        left = _term_spec(term['left'], arguments)
+        right = _term_spec(term['right'], arguments)
+        if name is None or left is None or right is None:
+            return None
+        return 'bin', name, left, right
+
+    if term.type == ast.ASTType.UnaryOperation:
+        argument = _term_spec(term['argument'], arguments)
+        if argument is None:
+            return None
+        if term['operator'] == ast.UnaryOperator.Minus:
+            return 'neg', argument
+        if term['operator'] == ast.UnaryOperator.Absolute:
+            return 'abs', argument
+
+    return None
+
+
+def _negate(symbol):
+    if symbol.type == clingo.SymbolType.Number:
+        return clingo.Number(-symbol.number)
+    return clingo.Function(symbol.name, symbol.arguments, not symbol.positive)
+
+
+def _compile_term(spec):
+    """
+    @param tuple spec: a term specification (see _term_spec).
+    @return (bool, object): (True, symbol) if the term is constant or (False, evaluator) where the evaluator is a function
+    that computes the term from the fired values.
+    """
+    kind = spec[0]
+
+    if kind == 'var':
+        return False, operator.itemgetter(spec[1])
+
+    if kind == 'num':
+        return True, clingo.Number(spec[1])
+
+    if kind == 'sym':
+        return True, clingo.parse_term(spec[1])
+
+    if kind == 'fun':
+        name = spec[1]
+        args = [_compile_term(a) for a in spec[2]]
+        if all(constant for constant, _ in args):
+            return True, clingo.Function(name, [value for _, value in args])
+        evaluators = [_as_evaluator(a) for a in args]
+        return False, lambda values: clingo.Function(name, [e(values) for e in evaluators])
+
+    if kind == 'bin':
+        function = _BINARY_OPERATIONS[spec[1]]
+        left = _compile_term(spec[2])
+        right = _compile_term(spec[3])
+        if left[0] and right[0]:
+            return True, clingo.Number(function(left[1].number, right[1].number))
+        left, right = _as_evaluator(left), _as_evaluator(right)
+        return False, lambda values: clingo.Number(function(left(values).number, right(values).number))
+
+    if kind == 'neg':
+        argument = _compile_term(spec[1])
+        if argument[0]:
+            return True, _negate(argument[1])
+        argument = argument[1]
+        return False, lambda values: _negate(argument(values))
+
+    if kind == 'abs':
+        argument = _compile_term(spec[1])
+        if argument[0]:
+            return True, clingo.Number(abs(argument[1].number))
+        argument = argument[1]
+        return False, lambda values: clingo.Number(abs(argument(values).number))
+
+    raise ValueError("Unknown term specification: {}".format(spec))
+
+
+def _as_evaluator(compiled_term):
+    constant, value = compiled_term
+    if constant:
+        return lambda values: value
+    return value
+
+
+def _compile_atom(spec):
+    """
+    @param tuple spec: (positive, name, [term specs]) specification of an atom.
+    @return function: a function that builds the atom (clingo.Symbol) from the fired values.
+    """
+    positive, name, term_specs = spec
+    # Unsupported terms are left out of the atom
+    terms = [_compile_term(t) for t in term_specs if t is not None]
+
+    if all(constant for constant, _ in terms):
+        atom = clingo.Function(name, [value for _, value in terms], positive)
+        return lambda values: atom
+
+    if all(t[0] == 'var' for t in term_specs if t is not None):
+        indexes = [t[1] for t in term_specs if t is not None]
+        if len(indexes) == 1:
+            index = indexes[0]
+            return lambda values: clingo.Function(name, [values[index]], positive)
+        getter = operator.itemgetter(*indexes)
+        return lambda values: clingo.Function(name, list(getter(values)), positive)
+
+    evaluators = [_as_evaluator(t) for t in terms]
+    return lambda values: clingo.Function(name, [e(values) for e in evaluators], positive)
+
+
+class BindingPlan:
+    """
+    Precompiled version of a trace entry. It builds the head and the body of a fired rule instance directly from the
+    fired values: variables are resolved to argument positions, constants are built once and arithmetic is resolved into
+    small evaluators.
+
+    Plans are built from a plain specification that can be pickled (the compiled evaluators are rebuilt on unpickling).
+    """
+    __slots__ = ('spec', '_head', '_body')
+
+    def __init__(self, spec):
+        """
+        @param tuple spec: (head atom spec, [body atom specs]).
+        """
+        self.spec = spec
+        head_spec, body_specs = spec
+        self._head = _compile_atom(head_spec)
+        self._body = [_compile_atom(b) for b in body_specs]
+
+    @classmethod
+    def from_trace(cls, trace):
+        """
+        @param Dict trace: an entry of XClingoProgramControl.traces.
+        @return BindingPlan:
+        """
+        # Same binding as the variable names to fired values dict (the last position wins for repeated names)
+        arguments = {name: i for i, name in enumerate(trace['arguments'])}
+
+        positive, name, variables = trace['head']
+        head_spec = (positive, name, [('var', arguments[str(v)]) for v in variables])
+        body_specs = [(positive, name, [_term_spec(v, arguments) for v in variables])
+                      for positive, name, variables in trace['body']]
+
+        return cls((head_spec, body_specs))
+
+    def bind(self, values):
+        """
+        @param List[clingo.Symbol] values: the fired values of a rule instance.
+        @return (clingo.Symbol, List[clingo.Symbol]): the head and the body of the rule instance.
+        """
+        return self._head(values), [b(values) for b in self._body]
+
+    def bind_head(self, values):
+        """
+        @param List[clingo.Symbol] values: the fired values of a rule instance.
+        @return clingo.Symbol: the head of the rule instance.
+        """
+        return self._head(values)
+
+    def bind_body(self, values):
+        """
+        @param List[clingo.Symbol] values: the fired values of a rule instance.
+        @return List[clingo.Symbol]: the body of the rule instance.
+        """
+        return [b(values) for b in self._body]
+
+    def head_signature(self):
+        """
+        @return (str, int, bool): the name, arity and sign of the atoms built as head.
+        """
+        positive, name, term_specs = self.spec[0]
+        return name, sum(1 for t in term_specs if t is not None), positive
+
+    def __reduce__(self):
+        return BindingPlan, (self.spec,)
+
+
+def compile_traces(traces):
+    """
+    @param Dict traces: a dictionary (indexed by fired id) containing the head and the body of the original rules.
+    @return Dict: a dictionary with the BindingPlan of each trace, indexed by fired id.
+    """
+    return {fired_id: BindingPlan.from_trace(trace) for fired_id, trace in traces.items()}
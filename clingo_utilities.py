@@ -1,30 +1,108 @@
 import clingo
 
 
-def find_by_prefix(model, prefix):
+def partition_model(symbols, fired_names):
     """
-    @param clingo.Model model:
-    @param string prefix:
-    @return List: a list containing all the atoms in the given model that start with the given prefix.
+    Sorts the atoms of a model in a single pass, looking only at their names.
+    @param Iterable[clingo.Symbol] symbols: the atoms of the model.
+    @param Dict fired_names: the id of each rule indexed by the name of its 'fired' atoms.
+    @return (Dict, List, List): the fired values of each rule (indexed by its id), the show_all atoms (without the prefix,
+    classically negated for nshow_all atoms) and the rest of atoms.
     """
+    fired_values = {}
+    show_all = []
+    others = []
+
+    for sym in symbols:
+        name = sym.name
+        fired_id = fired_names.get(name)
+        if fired_id is not None:
+            if fired_id in fired_values:
+                fired_values[fired_id].append(sym.arguments)
+            else:
+                fired_values[fired_id] = [sym.arguments]
+        elif name.startswith("show_all_"):
+            show_all.append(clingo.Function(name[len("show_all_"):], sym.arguments, sym.positive))
+        elif name.startswith("nshow_all_"):
+            show_all.append(clingo.Function(name[len("nshow_all_"):], sym.arguments, False))
+        else:
+            others.append(sym)
+
+    return fired_values, show_all, others
+
+
+# Types of AST that are functions themselves
+_FUNCTION_TYPES = frozenset([clingo.ast.ASTType.Function, clingo.ast.ASTType.TheoryFunction])
+# Field that leads to the function of each type of AST that contains a unique function
+_FUNCTION_FIELD = {
+    clingo.ast.ASTType.SymbolicAtom: 'term',
+    clingo.ast.ASTType.UnaryOperation: 'argument',
+    clingo.ast.ASTType.Literal: 'atom',
+}
+# Types of AST that do not have a unique function (some types as Comparison can have multiple functions)
+_NO_FUNCTION_TYPES = frozenset([clingo.ast.ASTType.Comparison, clingo.ast.ASTType.BooleanConstant])
+
+
+def get_function(node):
+    """
+    If the AST has a unique function inside of it then it will return it.
+    @param clingo.ast.AST node:
+    @return clingo.ast.AST: the function inside of the ast (None if it has no unique function).
+    """
+    while True:
+        node_type = node.type
+        if node_type in _FUNCTION_TYPES:
+            return node
+
+        field = _FUNCTION_FIELD.get(node_type)
+        if field is None:
+            if node_type in _NO_FUNCTION_TYPES:
+                return None
+            raise RuntimeError(str(node_type) + "  do not have Function.")
+        node = node[field]
+
+
+def add_prefix(prefix, node):
+    """
+    Adds a prefix to the function inside of the given AST. If the AST is Rule type, then the prefix will be added only
+    to the atoms in the body if it has a body, or only to the atom in the head in the other case.
+    @param str prefix:
+    @param clingo.ast.AST node:
+    @return None:
+    """
+    if node.type == clingo.ast.ASTType.Rule:
+        body = node['body']
+        for b_ast in (body if body else [node['head']]):
+            add_prefix(prefix, b_ast)
+        return
 
-    return [sym for sym in model.symbols(atoms=True) if str.startswith(str(sym), prefix)]
+    function = get_function(node)
+    if function is not None:
+        function['name'] = prefix + function['name']
 
 
-def find_and_remove_by_prefix(model, prefix):
+def classify_rule(rule):
     """
-    @param clingo.Model model:
-    @param string prefix:
-    @return List: a list containing all the atoms in the given model that start with the given prefix.
+    @param clingo.ast.AST rule: an AST of type Rule.
+    @return str: "constraint", "trace_all" or "show_all" for these xclingo rules, "normal" otherwise.
     """
-    hits = []
+    head = rule['head']
+    head_type = head.type
 
-    for sym in model.symbols(atoms=True):
-        if str.startswith(str(sym), prefix):
-            hits.append(sym)
-            del sym
+    if head_type == clingo.ast.ASTType.TheoryAtom:
+        return "trace_all" if head['term']['name'] == "trace_all" else "normal"
 
-    return hits
+    if head_type == clingo.ast.ASTType.Literal:
+        atom = head['atom']
+        if atom.type == clingo.ast.ASTType.BooleanConstant:
+            return "constraint" if not atom['value'] else "normal"
+
+        if atom.type == clingo.ast.ASTType.SymbolicAtom and head['sign'] == clingo.ast.Sign.NoSign:
+            term = atom['term']
+            if term.type == clingo.ast.ASTType.Function and term['name'].startswith(("show_all_", "nshow_all_")):
+                return "show_all"
+
+    return "normal"
 
 
 def body_variables(body_asts):
@@ -54,21 +132,3 @@ def body_variables(body_asts):
 
     return vars
 
-
-def remove_prefix(prefix, ast):
-    """
-    @param string prefix:
-    @param clingo.ast ast: (should be a clingo.Symbol or a clingo.rule_ast with type Literal or SymbolicAtom.
-    @return: the rule_ast (whatever type it has) without the given prefix.
-    """
-    if type(ast) == clingo.Symbol:
-        ast = clingo.Function(ast.name.replace(prefix, ""), ast.arguments, ast.positive)
-    else:
-        if ast.type == clingo.ast.ASTType.Literal:
-            term = ast['atom']['term']
-        elif ast.type == clingo.ast.ASTType.SymbolicAtom:
-            term = ast['term']
-
-        term['name'] = term['name'].replace(prefix, "")
-
-    return ast
@@ -0,0 +1,271 @@
+from array import array
+from hashlib import blake2b
+
+
+class DerivationGraph:
+    """
+    Compact representation of the causes of a model.
+
+    Every atom is interned to a consecutive integer id and every fired rule instance (a cause) gets a rule index. Heads
+    are linked to their alternative rules and rules to their bodies through CSR-style offset arrays:
+        - the rules that derive the head h are head_rules[head_offsets[h]:head_offsets[h + 1]].
+        - the body of the rule r is body_ids[body_offsets[r]:body_offsets[r + 1]].
+    """
+
+    def __init__(self):
+        self.symbols = []  # atom id -> clingo.Symbol
+        self._ids = {}  # clingo.Symbol -> atom id
+        self._heads = []  # head ids in order of first derivation
+        self._is_head = set()
+
+        self.rule_fired_id = array('l')
+        self.rule_head = array('l')
+        self.rule_labels = []
+        self.rule_weights = []
+        self.body_offsets = array('l', [0])
+        self.body_ids = array('l')
+
+        self.head_offsets = None
+        self.head_rules = None
+        self._scc = None
+
+    def intern(self, symbol):
+        """
+        @param clingo.Symbol symbol: the atom to be interned.
+        @return int: the id of the atom.
+        """
+        atom_id = self._ids.get(symbol)
+        if atom_id is None:
+            atom_id = len(self.symbols)
+            self._ids[symbol] = atom_id
+            self.symbols.append(symbol)
+        return atom_id
+
+    def id_of(self, symbol):
+        """
+        @param clingo.Symbol symbol:
+        @return int: the id of the given atom or None if the atom is not in the graph.
+        """
+        return self._ids.get(symbol)
+
+    def symbol(self, atom_id):
+        return self.symbols[atom_id]
+
+    def add_cause(self, fired_id, head, labels, fired_body, weight=None):
+        """
+        Adds a fired rule instance to the graph.
+        @param int fired_id: the id of the original rule.
+        @param clingo.Symbol head: the derived atom.
+        @param List[str] labels: the labels of this instance.
+        @param List[clingo.Symbol] fired_body: the atoms in the (positive) body of this instance.
+        @param int weight: the weight of the labels of this instance (None if it was not given).
+        @return int: the index of the new rule.
+        """
+        head_id = self.intern(head)
+        if head_id not in self._is_head:
+            self._is_head.add(head_id)
+            self._heads.append(head_id)
+
+        self.rule_fired_id.append(fired_id)
+        self.rule_head.append(head_id)
+        self.rule_labels.append(labels)
+        self.rule_weights.append(weight)
+        self.body_ids.extend([self.intern(b) for b in fired_body])
+        self.body_offsets.append(len(self.body_ids))
+
+        # The head index and the components must be rebuilt
+        self.head_offsets = None
+        self._scc = None
+        return len(self.rule_head) - 1
+
+    def _build_head_index(self):
+        """
+        Builds head_offsets and head_rules by counting sort over rule_head. Rules keep their insertion order inside each
+        head.
+        """
+        n_atoms = len(self.symbols)
+        offsets = array('l', [0]) * (n_atoms + 1)
+        for h in self.rule_head:
+            offsets[h + 1] += 1
+        for i in range(n_atoms):
+            offsets[i + 1] += offsets[i]
+
+        rules = array('l', [0]) * len(self.rule_head)
+        fill = array('l', offsets[:-1])
+        for r, h in enumerate(self.rule_head):
+            rules[fill[h]] = r
+            fill[h] += 1
+
+        self.head_rules = rules
+        self.head_offsets = offsets
+
+    def rules(self, atom_id):
+        """
+        @param int atom_id:
+        @return array: the indexes of the alternative rules that derive the given atom.
+        """
+        if self.head_offsets is None:
+            self._build_head_index()
+        return self.head_rules[self.head_offsets[atom_id]:self.head_offsets[atom_id + 1]]
+
+    def body(self, rule):
+        """
+        @param int rule:
+        @return array: the ids of the atoms in the body of the given rule.
+        """
+        return self.body_ids[self.body_offsets[rule]:self.body_offsets[rule + 1]]
+
+    def successors(self, atom_id):
+        """
+        @param int atom_id:
+        @return List[int]: the ids of the atoms in the bodies of all the rules that derive the given atom.
+        """
+        successors = []
+        for rule in self.rules(atom_id):
+            successors.extend(self.body(rule))
+        return successors
+
+    def strongly_connected_components(self):
+        """
+        Computes the strongly connected components of the dependency graph between heads and body atoms (iterative
+        Tarjan's algorithm, so the depth of the graph is not limited by the interpreter stack).
+        @return (array, List[bool]): the component of each atom and, for each component, whether it is cyclic (it has
+        more than one atom or an atom that depends on itself).
+        """
+        if self._scc is not None:
+            return self._scc
+
+        n_atoms = len(self.symbols)
+        index = [-1] * n_atoms
+        low = [0] * n_atoms
+        on_stack = [False] * n_atoms
+        component = array('l', [-1]) * n_atoms
+        cyclic = []
+        stack = []
+        counter = 0
+
+        for root in range(n_atoms):
+            if index[root] != -1:
+                continue
+
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, iter(self.successors(root)))]
+
+            while work:
+                v, successors = work[-1]
+                for w in successors:
+                    if index[w] == -1:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = True
+                        work.append((w, iter(self.successors(w))))
+                        break
+                    elif on_stack[w]:
+                        low[v] = min(low[v], index[w])
+                else:
+                    work.pop()
+                    if work:
+                        u = work[-1][0]
+                        low[u] = min(low[u], low[v])
+
+                    if low[v] == index[v]:
+                        c = len(cyclic)
+                        size = 0
+                        while True:
+                            w = stack.pop()
+                            on_stack[w] = False
+                            component[w] = c
+                            size += 1
+                            if w == v:
+                                break
+                        cyclic.append(size > 1 or v in self.successors(v))
+
+        self._scc = (component, cyclic)
+        return self._scc
+
+    def _hash_rules(self, digest, atom_id, body_key):
+        """
+        Adds the rules of an atom (in order) to a digest.
+        @param digest: a hashlib object.
+        @param int atom_id:
+        @param function body_key: function that returns the bytes that identify a body atom (given its id).
+        """
+        for rule in self.rules(atom_id):
+            digest.update("\0rule {} {!r} {}\0".format(
+                self.rule_fired_id[rule], self.rule_labels[rule], self.rule_weights[rule]).encode())
+            for b in self.body(rule):
+                digest.update(body_key(b))
+
+    def cone_hashes(self):
+        """
+        Computes, for each atom, a hash of its derivation cone: the atom, its rules (fired id, labels, weight and body
+        atoms, in order) and, recursively, the cones of its body atoms. Two atoms with the same hash (in the same or in
+        different graphs) have the same explanations. The hashes are computed bottom-up over the strongly connected
+        components; the atoms of a cyclic component share the hash of the whole component.
+        @return List[bytes]: the hash of each atom (indexed by atom id).
+        """
+        component, cyclic = self.strongly_connected_components()
+        members = [[] for _ in cyclic]
+        for atom_id, c in enumerate(component):
+            members[c].append(atom_id)
+
+        hashes = [None] * len(self.symbols)
+        # Components are numbered in reverse topological order, so the components of the body atoms come first
+        for c, atoms in enumerate(members):
+            if not cyclic[c]:
+                atom_id = atoms[0]
+                digest = blake2b(str(self.symbols[atom_id]).encode(), digest_size=16)
+                self._hash_rules(digest, atom_id, hashes.__getitem__)
+                hashes[atom_id] = digest.digest()
+                continue
+
+            # Inside the component the atoms are identified by their symbols (ids depend on the order of the graph)
+            def body_key(b, c=c):
+                if component[b] == c:
+                    return "\0atom {}\0".format(self.symbols[b]).encode()
+                return hashes[b]
+
+            names = sorted((str(self.symbols[a]), a) for a in atoms)
+            component_digest = blake2b(b"component", digest_size=16)
+            for name, atom_id in names:
+                component_digest.update("\0head {}\0".format(name).encode())
+                self._hash_rules(component_digest, atom_id, body_key)
+            component_hash = component_digest.digest()
+            for name, atom_id in names:
+                hashes[atom_id] = blake2b(component_hash + name.encode(), digest_size=16).digest()
+
+        return hashes
+
+    def labels(self, rule):
+        return self.rule_labels[rule]
+
+    def weight(self, rule):
+        return self.rule_weights[rule]
+
+    def heads(self):
+        """
+        @return List[int]: the ids of all the derived atoms, in order of first derivation.
+        """
+        return list(self._heads)
+
+    def __len__(self):
+        return len(self.rule_head)
+
+    def to_dataframe(self):
+        """
+        Exports the graph as the causes table (one row per fired rule instance). It requires pandas.
+        @return DataFrame:
+        """
+        from pandas import DataFrame
+
+        return DataFrame([
+            {'fired_id': self.rule_fired_id[r],
+             'fired_head': self.symbols[self.rule_head[r]],
+             'labels': self.rule_labels[r],
+             'fired_body': [self.symbols[b] for b in self.body(r)]}
+            for r in range(len(self.rule_head))
+        ])
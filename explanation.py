@@ -0,0 +1,772 @@
+from collections import namedtuple
+from heapq import heappop, heappush
+from itertools import islice, product
+from weakref import WeakValueDictionary
+
+# Enumeration phases of an _ExplanationStream
+_START, _RESOLVE, _EMIT, _NEXT = range(4)
+
+_interned_nodes = WeakValueDictionary()  # (label, children) -> ExplanationNode
+_canonical_forms = WeakValueDictionary()  # (label, canonical forms of the children) -> _CanonicalForm
+
+
+class _CanonicalForm:
+    """
+    Identity of the explanation trees that only differ in the order of their children.
+    """
+    __slots__ = ('__weakref__',)
+
+
+class ExplanationNode:
+    """
+    Immutable explanation tree. An explanation is a node without label whose children are the labelled nodes at its
+    first level (the empty explanation is the node without label and children).
+
+    Nodes are hash-consed through explanation_node: equal trees (with their children in the same order) are the same
+    object, so they are stored once and they can be compared and hashed by identity. As with dict explanations, the
+    order of the children does not matter for the explanation itself: trees that only differ in that order have the
+    same 'canonical' form, which is what the enumeration uses to tell explanations apart.
+    """
+    __slots__ = ('label', 'children', 'canonical', '__weakref__')
+
+    def __init__(self, label, children, canonical):
+        self.label = label
+        self.children = children
+        self.canonical = canonical
+
+    def items(self):
+        """
+        @return Iterator[(str, ExplanationNode)]: the label of each child together with the child itself (whose
+        children are the explanation of that label), in the same way as the items of a dict explanation.
+        """
+        return ((child.label, child) for child in self.children)
+
+    def __iter__(self):
+        return (child.label for child in self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+    def __reduce__(self):
+        # As a flat table, so deep trees do not exhaust the interpreter stack of pickle
+        return _decode_explanation, encode_explanations([self])
+
+    def __repr__(self):
+        return "{" + ", ".join("{!r}: {!r}".format(label, child) for label, child in self.items()) + "}"
+
+
+def explanation_node(label=None, children=()):
+    """
+    @param str label: the label of the node (None for the root of an explanation).
+    @param tuple children: the child nodes (already interned), with different labels.
+    @return ExplanationNode: the unique node with the given label and children.
+    """
+    children = tuple(children)
+    key = (label, children)
+    node = _interned_nodes.get(key)
+    if node is None:
+        canonical_key = (label, frozenset(child.canonical for child in children))
+        canonical = _canonical_forms.get(canonical_key)
+        if canonical is None:
+            canonical = _canonical_forms.setdefault(canonical_key, _CanonicalForm())
+        node = _interned_nodes.setdefault(key, ExplanationNode(label, children, canonical))
+    return node
+
+
+def encode_explanations(explanations):
+    """
+    Encodes explanations as a flat table of their distinct nodes (without recursion, so the depth of the trees is not
+    limited).
+    @param Iterable[ExplanationNode] explanations:
+    @return (List[(str, tuple)], List[int]): the nodes as pairs (label, indexes of the children), with the children
+    before their parents, and the index of each explanation in the table.
+    """
+    index = {}
+    table = []
+    roots = []
+    for explanation in explanations:
+        stack = [(explanation, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if node in index:
+                continue
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.children) if child not in index)
+            else:
+                index[node] = len(table)
+                table.append((node.label, tuple(index[child] for child in node.children)))
+        roots.append(index[explanation])
+    return table, roots
+
+
+def decode_explanations(table, roots):
+    """
+    @param List[(str, tuple)] table: the nodes (see encode_explanations).
+    @param List[int] roots: the index of each explanation in the table.
+    @return List[ExplanationNode]: the explanations.
+    """
+    nodes = []
+    for label, children in table:
+        nodes.append(explanation_node(label, tuple(nodes[i] for i in children)))
+    return [nodes[i] for i in roots]
+
+
+def _decode_explanation(table, roots):
+    return decode_explanations(table, roots)[0]
+
+
+class _ExplanationStream:
+    """
+    Explanations of a key, enumerated on demand. The explanations produced so far are kept in 'items' so every stream
+    that contains this one can read them again without recomputing them.
+    """
+    __slots__ = ('key', 'items', 'seen', 'done',
+                 'rules', 'rule', 'phase', 'children', 'next_child', 'labels', 'label_i',
+                 'factors', 'positions', 'firsts', 'carry')
+
+    def __init__(self, key, rules):
+        self.key = key
+        self.items = []  # unique explanations, in order of enumeration
+        self.seen = set()  # canonical forms of the items
+        self.done = False
+
+        self.rules = rules
+        self.rule = 0
+        self.phase = _START
+
+
+class ExplanationEngine:
+    """
+    Enumerates the explanations of the atoms of a model from its DerivationGraph.
+
+    Explanations are produced lazily and in a deterministic order: alternative rules in the order they were fired, and
+    for each rule, the combinations of the explanations of its body atoms with the last atom varying fastest. The work
+    done is bounded by the number of explanations that are actually requested.
+
+    The explanations of each atom are computed once and shared by every explanation that contains them. Recursive rules
+    are handled through the strongly connected components of the graph: an atom of a cyclic component is explained
+    without passing again through the atoms of its component that are already in the current derivation. Atoms outside
+    the component can never appear again in the derivation, so the explanations of an atom entered from another component
+    do not depend on the path that leads to it and can be shared.
+
+    Enumeration is iterative, so the depth of the derivations is not limited by the interpreter stack.
+    """
+
+    def __init__(self, causes):
+        """
+        @param DerivationGraph causes: the causes of the model.
+        """
+        self.causes = causes
+        self.component, self.cyclic = causes.strongly_connected_components()
+        # (atom id, atoms of its cyclic component in the current derivation or None) -> _ExplanationStream
+        self._streams = {}
+        self.cycle_cutoffs = 0  # Times that an atom was not explained again because it was in the current derivation
+
+    def _entry_key(self, atom_id):
+        if self.cyclic[self.component[atom_id]]:
+            return atom_id, frozenset([atom_id])
+        return atom_id, None
+
+    def _child_key(self, key, body_atom):
+        """
+        @param tuple key: the key of the atom that is being explained.
+        @param int body_atom: an atom in the body of one of its rules.
+        @return tuple: the key of body_atom, or None if body_atom is already in the current derivation.
+        """
+        atom_id, visited = key
+        if visited is not None and self.component[body_atom] == self.component[atom_id]:
+            if body_atom in visited:
+                self.cycle_cutoffs += 1
+                return None
+            return body_atom, visited | {body_atom}
+        return self._entry_key(body_atom)
+
+    def _stream(self, key):
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = _ExplanationStream(key, self.causes.rules(key[0]))
+            self._streams[key] = stream
+        return stream
+
+    @staticmethod
+    def _scan(stream, position):
+        """
+        @param _ExplanationStream stream:
+        @param int position:
+        @return int: the position of the first not empty explanation of the stream from the given position, -1 if there
+        is not any, or None if the stream must be enumerated further to know it.
+        """
+        items = stream.items
+        while position < len(items):
+            if items[position]:
+                return position
+            position += 1
+        return -1 if stream.done else None
+
+    @staticmethod
+    def _add(stream, explanation):
+        if explanation.canonical not in stream.seen:
+            stream.seen.add(explanation.canonical)
+            stream.items.append(explanation)
+
+    def _advance(self, stream):
+        """
+        Moves the enumeration of the stream one step forward.
+        @param _ExplanationStream stream:
+        @return _ExplanationStream: None if the stream made progress, or the stream that must be enumerated further
+        before this one can continue.
+        """
+        while True:
+            if stream.phase == _START:
+                if stream.rule == len(stream.rules):
+                    stream.done = True
+                    return None
+
+                rule = stream.rules[stream.rule]
+                fired_body = self.causes.body(rule)
+                children = [self._child_key(stream.key, a) for a in fired_body]
+                stream.children = [self._stream(c) for c in children if c is not None]
+                # Every atom in the body is already in the current derivation
+                if fired_body and not stream.children:
+                    stream.rule += 1
+                    continue
+
+                stream.labels = self.causes.labels(rule) or [None]
+                stream.next_child = 0
+                stream.factors = []
+                stream.positions = []
+                stream.phase = _RESOLVE
+
+            if stream.phase == _RESOLVE:
+                # Body atoms with only the empty explanation (facts) do not take part in the combinations.
+                while stream.next_child < len(stream.children):
+                    child = stream.children[stream.next_child]
+                    position = self._scan(child, 0)
+                    if position is None:
+                        return child
+                    if position >= 0:
+                        stream.factors.append(child)
+                        stream.positions.append(position)
+                    stream.next_child += 1
+
+                stream.firsts = list(stream.positions)
+                stream.label_i = 0
+                stream.phase = _EMIT
+
+            if stream.phase == _EMIT:
+                # The explanations of the body atoms are merged into a single one (a later label replaces an equal
+                # one in its position).
+                if len(stream.factors) == 1:
+                    children = stream.factors[0].items[stream.positions[0]].children
+                else:
+                    merged = {}
+                    for child, position in zip(stream.factors, stream.positions):
+                        for node in child.items[position].children:
+                            merged[node.label] = node
+                    children = tuple(merged.values())
+
+                label = stream.labels[stream.label_i]
+                if label is not None:
+                    children = (explanation_node(label, children),)
+
+                self._add(stream, explanation_node(None, children))
+                stream.carry = len(stream.factors) - 1
+                stream.phase = _NEXT
+                return None
+
+            if stream.phase == _NEXT:
+                # Next combination (odometer order)
+                while stream.carry >= 0:
+                    k = stream.carry
+                    position = self._scan(stream.factors[k], stream.positions[k] + 1)
+                    if position is None:
+                        return stream.factors[k]
+                    if position >= 0:
+                        stream.positions[k] = position
+                        stream.phase = _EMIT
+                        break
+                    stream.positions[k] = stream.firsts[k]
+                    stream.carry -= 1
+                else:
+                    stream.label_i += 1
+                    if stream.label_i < len(stream.labels):
+                        stream.positions = list(stream.firsts)
+                        stream.phase = _EMIT
+                    else:
+                        stream.rule += 1
+                        stream.phase = _START
+
+    def _fill(self, stream, length):
+        """
+        Enumerates the stream until it has the given number of explanations or it is exhausted.
+        @param _ExplanationStream stream:
+        @param int length:
+        """
+        pending = [(stream, length)]
+        while pending:
+            current, wanted = pending[-1]
+            if current.done or len(current.items) >= wanted:
+                pending.pop()
+                continue
+
+            needed = self._advance(current)
+            if needed is not None:
+                pending.append((needed, len(needed.items) + 1))
+
+    def iter_explanations(self, atom_id):
+        """
+        @param int atom_id: the id (inside causes) of the atom to be explained.
+        @return Iterator[ExplanationNode]: generator of the explanations of the atom, computed one by one.
+        """
+        stream = self._stream(self._entry_key(atom_id))
+        i = 0
+        while True:
+            if i == len(stream.items):
+                self._fill(stream, i + 1)
+                if i == len(stream.items):
+                    return
+            yield stream.items[i]
+            i += 1
+
+    def explain(self, atom_id, limit=None):
+        """
+        @param int atom_id: the id (inside causes) of the atom to be explained.
+        @param int limit: maximum number of explanations. If None, all of them are computed.
+        @return List[ExplanationNode]: the explanations of the atom.
+        """
+        return list(islice(self.iter_explanations(atom_id), limit))
+
+
+# Counting information of a key: number of non empty explanations, whether the empty explanation is one of them, labels
+# at the first level of some of them (possible), labels at the first level of all of them (always) and, for the labels
+# whose node is the same in every explanation that has it, the canonical form of that node (fixed)
+_CountInfo = namedtuple('_CountInfo', ['count', 'empty', 'possible', 'always', 'fixed'])
+
+# An alternative (rule and label) of a key: its explanations are the ones of its first level (top) and, if it is
+# labelled, the explanations below its label are the merges of its factors (inner)
+_Alternative = namedtuple('_Alternative', ['label', 'count', 'top', 'inner', 'factors'])
+
+
+class ExplanationCounter:
+    """
+    Counts the explanations of the atoms of a model without enumerating them, by dynamic programming over the keys of
+    an ExplanationEngine (atoms, plus the atoms of their cyclic component in the current derivation): the explanations
+    given by a rule are the combinations of the non empty explanations of its body atoms, once for each label of the
+    rule, and the explanations of an atom are the union of the ones given by its rules.
+
+    Sums and products only count distinct explanations if different combinations can not build the same tree. For each
+    key, the counter keeps which labels may appear at the first level of its explanations, which ones appear in all of
+    them and which ones always have the same node. With them:
+        - two body atoms of a rule can not make different combinations equal if the labels that both may produce are
+          always produced by both, with the same node (for example, a labelled fact used all along a derivation).
+        - two alternatives of an atom can not give the same explanation if one of them always has a label that the
+          other one can not have, or a label with a different node.
+    Only the body atoms (or the alternatives) for which that can not be proved are enumerated, on their own, so counts
+    are always exact. They are the only case where counting can take exponential time.
+    """
+
+    def __init__(self, engine):
+        """
+        @param ExplanationEngine engine: the engine of the model (it is used for the keys that must be enumerated).
+        """
+        self.engine = engine
+        self._info = {}  # key -> _CountInfo
+
+    def count(self, atom_id):
+        """
+        @param int atom_id: the id (inside causes) of the atom.
+        @return int: the number of explanations of the atom.
+        """
+        key = self.engine._entry_key(atom_id)
+        info = self._info
+        stack = [key]
+        while stack:
+            current = stack[-1]
+            if current in info:
+                stack.pop()
+                continue
+            # Child keys always have larger sets of visited atoms, so there are no cycles between keys
+            pending = [c for c in self._child_keys(current) if c not in info]
+            if pending:
+                stack.extend(pending)
+            else:
+                stack.pop()
+                info[current] = self._compute(current)
+
+        key_info = info[key]
+        return key_info.count + 1 if key_info.empty else key_info.count
+
+    def _rule_children(self, key, rule):
+        """
+        @return List[tuple]: the keys of the body atoms of the rule (without the ones already in the derivation), or None
+        if the rule can not be used.
+        """
+        fired_body = self.engine.causes.body(rule)
+        children = [self.engine._child_key(key, a) for a in fired_body]
+        children = [c for c in children if c is not None]
+        if fired_body and not children:
+            return None
+        return children
+
+    def _child_keys(self, key):
+        keys = []
+        for rule in self.engine.causes.rules(key[0]):
+            children = self._rule_children(key, rule)
+            if children:
+                keys.extend(children)
+        return keys
+
+    @staticmethod
+    def _merge(infos):
+        """
+        @param List[_CountInfo] infos: the information of sets of explanations that are merged (or joined).
+        @return (frozenset, frozenset, Dict): the labels that the merged explanations may have, the ones that they
+        always have and their fixed nodes.
+        """
+        possible = frozenset().union(*(i.possible for i in infos))
+        always = frozenset().union(*(i.always for i in infos))
+        fixed = {}
+        for label in possible:
+            nodes = [i.fixed.get(label) for i in infos if label in i.possible]
+            if nodes[0] is not None and all(node is nodes[0] for node in nodes):
+                fixed[label] = nodes[0]
+        return possible, always, fixed
+
+    @staticmethod
+    def _disjoint(a, b):
+        """
+        @param _CountInfo a:
+        @param _CountInfo b:
+        @return bool: True if the two sets of (non empty) explanations can not have any explanation in common.
+        """
+        if not a.always <= b.possible or not b.always <= a.possible:
+            return True
+        return any(a.fixed.get(label) is not b.fixed.get(label) and label in a.fixed and label in b.fixed
+                   for label in a.always & b.always)
+
+    @staticmethod
+    def _independent(a, b):
+        """
+        @return bool: True if merging the explanations of two body atoms never makes different combinations equal.
+        """
+        shared = a.possible & b.possible
+        return all(label in a.always and label in b.always and label in a.fixed and a.fixed[label] is b.fixed.get(label)
+                   for label in shared)
+
+    @staticmethod
+    def _groups(items, related):
+        """
+        @param List items:
+        @param function related: function that tells if two items must be in the same group.
+        @return List[List]: the connected components of the relation, in order of their first item.
+        """
+        group_of = list(range(len(items)))
+
+        def find(i):
+            while group_of[i] != i:
+                group_of[i] = group_of[group_of[i]]
+                i = group_of[i]
+            return i
+
+        for i in range(len(items)):
+            for j in range(i + 1, len(items)):
+                if find(i) != find(j) and related(items[i], items[j]):
+                    group_of[find(j)] = find(i)
+
+        groups = {}
+        for i, item in enumerate(items):
+            groups.setdefault(find(i), []).append(item)
+        return list(groups.values())
+
+    def _non_empty(self, key):
+        """
+        @return List[ExplanationNode]: the non empty explanations of a key (enumerated by the engine).
+        """
+        engine = self.engine
+        stream = engine._stream(key)
+        engine._fill(stream, float("inf"))
+        return [e for e in stream.items if e]
+
+    def _first_non_empty(self, key):
+        engine = self.engine
+        stream = engine._stream(key)
+        i = 0
+        while True:
+            engine._fill(stream, i + 1)
+            if stream.items[i]:
+                return stream.items[i]
+            i += 1
+
+    @staticmethod
+    def _merged_children(explanations):
+        # As in ExplanationEngine, a later label replaces an equal one
+        merged = {}
+        for explanation in explanations:
+            for node in explanation.children:
+                merged[node.label] = node
+        return tuple(merged.values())
+
+    def _count_merges(self, factors):
+        """
+        @param List[tuple] factors: keys of body atoms of a rule.
+        @return int: the number of distinct merges of the non empty explanations of the factors (enumerated).
+        """
+        forms = set()
+        for combination in product(*[self._non_empty(f) for f in factors]):
+            forms.add(explanation_node(None, self._merged_children(combination)).canonical)
+        return len(forms)
+
+    def _count_union(self, alternatives):
+        """
+        @param List[_Alternative] alternatives: alternatives of a key.
+        @return int: the number of distinct explanations given by the alternatives (enumerated).
+        """
+        forms = set()
+        for alternative in alternatives:
+            for combination in product(*[self._non_empty(f) for f in alternative.factors]):
+                children = self._merged_children(combination)
+                if alternative.label is not None:
+                    children = (explanation_node(alternative.label, children),)
+                forms.add(explanation_node(None, children).canonical)
+        return len(forms)
+
+    def _compute(self, key):
+        causes = self.engine.causes
+        info = self._info
+        alternatives = []
+        empty = False
+
+        for rule in causes.rules(key[0]):
+            children = self._rule_children(key, rule)
+            if children is None:
+                continue
+
+            # Body atoms with only the empty explanation (or none) do not take part in the combinations
+            factors = [c for c in children if info[c].count > 0]
+            count = 1
+            for group in self._groups(factors, lambda a, b: not self._independent(info[a], info[b])):
+                count *= info[group[0]].count if len(group) == 1 else self._count_merges(group)
+            inner = _CountInfo(count, False, *self._merge([info[f] for f in factors]))
+
+            for label in causes.labels(rule) or [None]:
+                if label is not None:
+                    fixed = {}
+                    if count == 1:
+                        children = self._merged_children([self._first_non_empty(f) for f in factors])
+                        fixed[label] = explanation_node(label, children).canonical
+                    top = _CountInfo(count, False, frozenset([label]), frozenset([label]), fixed)
+                    alternatives.append(_Alternative(label, count, top, inner, factors))
+                elif factors:  # Unlabelled rules pass the explanations of their body through
+                    alternatives.append(_Alternative(None, count, inner, inner, factors))
+                else:
+                    empty = True
+
+        def overlap(a, b):
+            if self._disjoint(a.top, b.top):
+                return False
+            if a.label is not None and a.label == b.label:
+                # Below the same label: a rule without factors only gives the label itself
+                if bool(a.factors) != bool(b.factors):
+                    return False
+                return not a.factors or not self._disjoint(a.inner, b.inner)
+            return True
+
+        total = 0
+        for group in self._groups(alternatives, overlap):
+            total += group[0].count if len(group) == 1 else self._count_union(group)
+
+        tops = [a.top for a in alternatives]
+        possible, _, fixed = self._merge(tops)
+        always = frozenset.intersection(*(t.always for t in tops)) if tops else frozenset()
+        return _CountInfo(total, empty, possible, always, fixed)
+
+
+class _RankedStream:
+    """
+    Explanations of a key in order of cost, enumerated on demand (see RankedExplanations).
+    """
+    __slots__ = ('key', 'items', 'non_empty', 'seen', 'done',
+                 'rules', 'rule', 'children', 'next_child', 'factors', 'edges', 'heap', 'candidates',
+                 'popped', 'next_neighbor')
+
+    def __init__(self, key, rules):
+        self.key = key
+        self.items = []  # (cost, explanation) of the unique explanations, in order of cost
+        self.non_empty = []  # the items whose explanation is not empty
+        self.seen = set()  # canonical forms of the items
+        self.done = False
+
+        self.rules = rules
+        self.rule = 0
+        self.children = None
+        self.edges = []  # (factors, label, weight) of each alternative (rule and label)
+        self.heap = []  # (cost, edge, positions) of the next combinations
+        self.candidates = set()  # (edge, positions) already pushed to the heap
+        self.popped = None  # (edge, positions) of the last combination whose neighbors are not all pushed yet
+
+
+class RankedExplanations:
+    """
+    Enumerates the explanations of the atoms of a model in order of cost, so the k best ones are found without
+    enumerating the rest (lazy k-best search over the keys of an ExplanationEngine).
+
+    The cost of an explanation is the cost of its cheapest derivation:
+        - size: the number of labelled rule instances in the derivation.
+        - depth: the largest number of labelled rule instances in a path of the derivation.
+        - weight: the sum of the weights of the labelled rule instances (given in the trace_rule sentences with @W,
+          1 by default).
+    As in the engine, the explanation of a rule is the merge of one explanation of each body atom (only the non empty
+    ones take part in the combinations). The costs only grow with the costs of the body atoms, so each key keeps a heap
+    of the next combinations of its alternatives, starting from the best explanation of every body atom: when a
+    combination is taken, the combinations that advance one of its positions are pushed.
+    """
+
+    COSTS = ("size", "depth", "weight")
+
+    def __init__(self, engine, rank_by="size"):
+        """
+        @param ExplanationEngine engine: the engine of the model (its keys are shared).
+        @param str rank_by: "size", "depth" or "weight".
+        """
+        if rank_by not in self.COSTS:
+            raise ValueError("unknown cost: {}".format(rank_by))
+        self.engine = engine
+        self.rank_by = rank_by
+        self._streams = {}  # key -> _RankedStream
+
+    def _stream(self, key):
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = _RankedStream(key, self.engine.causes.rules(key[0]))
+            self._streams[key] = stream
+        return stream
+
+    def _cost(self, edge, positions):
+        factors, label, weight = edge
+        costs = [factor.non_empty[p][0] for factor, p in zip(factors, positions)]
+        if self.rank_by == "depth":
+            cost = max(costs) if costs else 0
+        else:
+            cost = sum(costs)
+        if label is None:
+            return cost
+        if self.rank_by == "weight" and weight is not None:
+            return cost + weight
+        return cost + 1
+
+    def _push(self, stream, edge, positions):
+        if (edge, positions) not in stream.candidates:
+            stream.candidates.add((edge, positions))
+            heappush(stream.heap, (self._cost(stream.edges[edge], positions), edge, positions))
+
+    def _advance(self, stream):
+        """
+        Moves the enumeration of the stream one step forward.
+        @param _RankedStream stream:
+        @return (_RankedStream, int): None if the stream made progress, or a stream and the number of non empty
+        explanations that it must have (unless it is exhausted) before this one can continue.
+        """
+        causes = self.engine.causes
+        # The alternatives are built once the best explanation of every body atom is known
+        while stream.rule < len(stream.rules):
+            rule = stream.rules[stream.rule]
+            if stream.children is None:
+                fired_body = causes.body(rule)
+                children = [self.engine._child_key(stream.key, a) for a in fired_body]
+                stream.children = [self._stream(c) for c in children if c is not None]
+                # Every atom in the body is already in the current derivation
+                if fired_body and not stream.children:
+                    stream.rule += 1
+                    stream.children = None
+                    continue
+                stream.next_child = 0
+                stream.factors = []
+
+            while stream.next_child < len(stream.children):
+                child = stream.children[stream.next_child]
+                if not child.non_empty and not child.done:
+                    return child, 1
+                if child.non_empty:
+                    stream.factors.append(child)
+                stream.next_child += 1
+
+            factors = tuple(stream.factors)
+            for label in causes.labels(rule) or [None]:
+                stream.edges.append((factors, label, causes.weight(rule)))
+                self._push(stream, len(stream.edges) - 1, (0,) * len(factors))
+            stream.rule += 1
+            stream.children = None
+
+        if stream.popped is not None:
+            edge, positions = stream.popped
+            factors = stream.edges[edge][0]
+            while stream.next_neighbor < len(factors):
+                i = stream.next_neighbor
+                factor = factors[i]
+                if positions[i] + 1 >= len(factor.non_empty) and not factor.done:
+                    return factor, positions[i] + 2
+                if positions[i] + 1 < len(factor.non_empty):
+                    self._push(stream, edge, positions[:i] + (positions[i] + 1,) + positions[i + 1:])
+                stream.next_neighbor += 1
+            stream.popped = None
+            return None
+
+        if not stream.heap:
+            stream.done = True
+            return None
+
+        cost, edge, positions = heappop(stream.heap)
+        factors, label, _ = stream.edges[edge]
+        # The explanations of the body atoms are merged as in ExplanationEngine
+        if len(factors) == 1:
+            children = factors[0].non_empty[positions[0]][1].children
+        else:
+            merged = {}
+            for factor, position in zip(factors, positions):
+                for node in factor.non_empty[position][1].children:
+                    merged[node.label] = node
+            children = tuple(merged.values())
+        if label is not None:
+            children = (explanation_node(label, children),)
+        explanation = explanation_node(None, children)
+
+        # Only the cheapest derivation of each explanation is kept
+        if explanation.canonical not in stream.seen:
+            stream.seen.add(explanation.canonical)
+            stream.items.append((cost, explanation))
+            if explanation:
+                stream.non_empty.append((cost, explanation))
+        stream.popped = (edge, positions)
+        stream.next_neighbor = 0
+        return None
+
+    def _fill(self, stream, length):
+        """
+        Enumerates the stream until it has the given number of explanations or it is exhausted.
+        @param _RankedStream stream:
+        @param int length:
+        """
+        # (stream, wanted items, wanted non empty items)
+        pending = [(stream, length, float("inf"))]
+        while pending:
+            current, items, non_empty = pending[-1]
+            if current.done or len(current.items) >= items or len(current.non_empty) >= non_empty:
+                pending.pop()
+                continue
+
+            needed = self._advance(current)
+            if needed is not None:
+                child, wanted = needed
+                pending.append((child, float("inf"), wanted))
+
+    def best(self, atom_id, k):
+        """
+        @param int atom_id: the id (inside causes) of the atom to be explained.
+        @param int k: number of explanations.
+        @return List[(int, ExplanationNode)]: the k explanations of the atom with the lowest costs (fewer if it does
+        not have so many), in order of cost, together with their costs.
+        """
+        stream = self._stream(self.engine._entry_key(atom_id))
+        self._fill(stream, k)
+        return stream.items[:k]
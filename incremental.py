@@ -0,0 +1,271 @@
+from collections import OrderedDict
+
+from instrumentation import stats
+import translation
+
+
+def add_batch(control, name, program):
+    """
+    Adds a batch of facts (or rules) to a grounded xclingo program and grounds only the new part.
+
+    The rules that were already grounded only fire for the atoms that were grounded with them, so the facts of the
+    batch over atoms declared with #external in the program are assigned (see translation.assign_external) instead of
+    grounded; they stay true for the next batches. The rest of the batch is grounded as the program part 'name': its
+    rules can use the atoms of the program, but it can not derive other atoms that appear in the bodies of the rules of
+    the program (see translation.translate_part).
+    @param XClingoProgramControl control: a control prepared by translation.prepare_xclingo_program and grounded.
+    @param str name: the name of the new program part (it must be different for each batch).
+    @param program: the batch as a str or as a list of file objects.
+    @return List[clingo.Symbol]: the external atoms that were made true by the batch.
+    @raise ValueError: if the batch can not be grounded on its own.
+    """
+    external_facts = translation.translate_part(control, name, program, grounded=True)
+    try:
+        control.ground([(name, [])])
+    except RuntimeError as error:
+        raise ValueError("the batch '{}' can not be grounded on its own: {}".format(name, error))
+    for atom in external_facts:
+        translation.assign_external(control, atom, True)
+    return external_facts
+
+
+class ExplanationReuse:
+    """
+    Keeps the explanations of the atoms explained in the previous models, so that the explanations of a new model are
+    only recomputed for the atoms whose derivations changed. The explanations of an atom depend on its cone (the atom
+    and the atoms in the bodies of its rules, recursively), so they are forgotten when a rule instance that derives an
+    atom of the cone is added or removed, or when the labels of an atom of the cone change.
+
+    The changes are found by comparing the fired rule instances of the models (see begin), so the causes of the atoms
+    whose explanations are reused do not need to be built.
+    """
+    # The causes of the atoms whose explanations are reused are not needed (see xclingo.write_model)
+    partial_causes = True
+
+    def __init__(self):
+        self._instances = {}  # fired id -> fired values (as tuples) in the last model, in order
+        self._true_literals = frozenset()  # literals of the labels that were true in the last model
+        self._explanations = {}  # atom (clingo.Symbol) -> explanations of the atom
+        self._rendered = {}  # atom (clingo.Symbol) -> rendered explanations of the atom
+        self._cones = {}  # atom (clingo.Symbol) -> atoms of its cone when it was explained
+        self._dependents = {}  # atom (clingo.Symbol) -> explained atoms that have it in their cones
+        self._fresh = set()  # atoms whose explanations were computed for the current model
+        self._causes = None  # causes of the current model
+
+    def begin(self, fired_values, binding_plans, labels_dict, model_labels):
+        """
+        Compares the fired rule instances and the true labels of a new model with the ones of the last model and
+        forgets the explanations of the atoms whose cones changed. Must be called for each model before building its
+        causes.
+        @param Dict fired_values: a dictionary (indexed by fired id) that contains the fired values in the new model.
+        @param Dict binding_plans: a dictionary (indexed by fired id) containing the BindingPlan of the rules.
+        @param LabelIndex labels_dict: the processed labels of the program.
+        @param ModelLabels model_labels: the labels of the new model (see LabelIndex.resolve).
+        """
+        old_instances = self._instances
+        instances = {fired_id: [tuple(values) for values in values_list]
+                     for fired_id, values_list in fired_values.items()}
+        self._instances = instances
+        old_literals = self._true_literals
+        self._true_literals = model_labels.true_literals
+        self._fresh = set()
+        if not self._explanations:
+            return
+
+        # The order of the rule instances is the order of the explanations, so it must be the same
+        common = [fired_id for fired_id in instances if fired_id in old_instances]
+        if common != [fired_id for fired_id in old_instances if fired_id in instances]:
+            self._forget(list(self._explanations))
+            return
+
+        changed = set()
+        for fired_id in set(instances).union(old_instances):
+            old = old_instances.get(fired_id, [])
+            new = instances.get(fired_id, [])
+            if old == new:
+                continue
+            old_set = set(old)
+            new_set = set(new)
+            if [values for values in old if values in new_set] == [values for values in new if values in old_set]:
+                updated = old_set.symmetric_difference(new_set)
+            else:
+                updated = old_set.union(new_set)
+            bind_head = binding_plans[fired_id].bind_head
+            changed.update(bind_head(values) for values in updated)
+        changed.update(labels_dict.labelled_atoms(old_literals.symmetric_difference(self._true_literals)))
+
+        dependents = self._dependents
+        self._forget({atom for head in changed for atom in dependents.get(head, ())})
+
+    def _forget(self, atoms):
+        for atom in atoms:
+            self._explanations.pop(atom, None)
+            self._rendered.pop(atom, None)
+            for cone_atom in self._cones.pop(atom, ()):
+                dependents = self._dependents.get(cone_atom)
+                if dependents is not None:
+                    dependents.discard(atom)
+                    if not dependents:
+                        del self._dependents[cone_atom]
+
+    def update(self, causes):
+        """
+        Must be called for each model, after begin, with the causes of the atoms whose explanations are computed again.
+        @param DerivationGraph causes: the causes of the model.
+        """
+        self._causes = causes
+
+    def missing(self, atoms):
+        """
+        @param Iterable[clingo.Symbol] atoms:
+        @return List[clingo.Symbol]: the given atoms whose explanations can not be reused.
+        """
+        return [atom for atom in atoms if atom not in self._explanations]
+
+    def get(self, atom):
+        """
+        @param clingo.Symbol atom:
+        @return List: the explanations of the atom if they can be reused, None otherwise.
+        """
+        return self._explanations.get(atom)
+
+    def put(self, atom, explanations):
+        """
+        @param clingo.Symbol atom: an atom of the causes of the current model (see update).
+        @param List explanations: the explanations of the atom.
+        """
+        causes = self._causes
+        cone = set()
+        pending = [causes.id_of(atom)]
+        while pending:
+            atom_id = pending.pop()
+            symbol = causes.symbol(atom_id)
+            if symbol not in cone:
+                cone.add(symbol)
+                pending.extend(causes.successors(atom_id))
+
+        self._forget([atom])
+        self._explanations[atom] = explanations
+        self._cones[atom] = cone
+        for cone_atom in cone:
+            self._dependents.setdefault(cone_atom, set()).add(atom)
+        self._fresh.add(atom)
+
+    def reused(self, atom):
+        """
+        @param clingo.Symbol atom:
+        @return bool: True if the explanations of the atom in the current model were taken from a previous model.
+        """
+        return atom in self._explanations and atom not in self._fresh
+
+    def get_rendered(self, atom):
+        """
+        @param clingo.Symbol atom:
+        @return List[str]: the rendered explanations of the atom (see put_rendered), or None.
+        """
+        return self._rendered.get(atom)
+
+    def put_rendered(self, atom, rendered):
+        """
+        @param clingo.Symbol atom:
+        @param List[str] rendered: the rendered explanations of the atom, in the same order as its explanations.
+        """
+        self._rendered[atom] = rendered
+
+
+class ExplanationCache:
+    """
+    Keeps the explanations (and rendered explanations) of the atoms of any previous model, indexed by the hash of their
+    derivation cones (see DerivationGraph.cone_hashes), so an atom whose derivations are the same as in an earlier
+    model (not only the last one) reuses its explanations. At most max_entries cones are kept; the least recently used
+    ones are forgotten first.
+
+    It has the same interface as ExplanationReuse, but the cone hashes need the causes of every atom that is explained.
+    """
+    partial_causes = False
+
+    def __init__(self, max_entries):
+        """
+        @param int max_entries: maximum number of cached atoms.
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # cone hash -> [explanations, rendered explanations]
+        self._keys = {}  # atom (clingo.Symbol) -> cone hash, in the current model
+        self._fresh = set()  # atoms whose explanations were computed for the current model
+
+    def begin(self, fired_values, binding_plans, labels_dict, model_labels):
+        """
+        Nothing is compared before the causes of a model are built (see update).
+        """
+
+    def update(self, causes):
+        """
+        Computes the cone hashes of the atoms of a new model. Must be called for each model before get.
+        @param DerivationGraph causes: the causes of the new model.
+        """
+        hashes = causes.cone_hashes()
+        self._keys = {causes.symbol(atom_id): cone for atom_id, cone in enumerate(hashes)}
+        self._fresh = set()
+
+    def _entry(self, atom):
+        key = self._keys.get(atom)
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def missing(self, atoms):
+        """
+        @param Iterable[clingo.Symbol] atoms:
+        @return List[clingo.Symbol]: the given atoms whose explanations can not be reused.
+        """
+        return [atom for atom in atoms if self._keys.get(atom) not in self._entries]
+
+    def get(self, atom):
+        """
+        @param clingo.Symbol atom:
+        @return List: the explanations of the atom if they can be reused, None otherwise.
+        """
+        entry = self._entry(atom)
+        if entry is None:
+            stats.count("explanation cache misses")
+            return None
+        if atom not in self._fresh:
+            stats.count("explanation cache hits")
+        return entry[0]
+
+    def put(self, atom, explanations):
+        key = self._keys.get(atom)
+        if key is None:
+            return
+        self._entries[key] = [explanations, None]
+        self._entries.move_to_end(key)
+        self._fresh.add(atom)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def reused(self, atom):
+        """
+        @param clingo.Symbol atom:
+        @return bool: True if the explanations of the atom in the current model were taken from a previous model.
+        """
+        return atom not in self._fresh and self._keys.get(atom) in self._entries
+
+    def get_rendered(self, atom):
+        """
+        @param clingo.Symbol atom:
+        @return List[str]: the rendered explanations of the atom (see put_rendered), or None.
+        """
+        entry = self._entry(atom)
+        return None if entry is None else entry[1]
+
+    def put_rendered(self, atom, rendered):
+        """
+        @param clingo.Symbol atom:
+        @param List[str] rendered: the rendered explanations of the atom, in the same order as its explanations.
+        """
+        entry = self._entry(atom)
+        if entry is not None:
+            entry[1] = rendered
@@ -0,0 +1,274 @@
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Only the first models are recorded one by one (the totals include every model)
+MAX_MODEL_RECORDS = 1000
+
+
+def _peak_rss_kb():
+    """
+    @return int: the peak resident memory of the process until now in KiB, or None if it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _vm_hwm_kb():
+    """
+    @return int: the peak resident memory of the process since it was last reset (see _reset_peak_rss) in KiB, or None
+    if it is not available.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """
+    Resets the peak resident memory of the process to its current resident memory (only on Linux).
+    @return bool: False if it can not be reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+    return _vm_hwm_kb() is not None
+
+
+class Stats:
+    """
+    Records where the time and the memory of a run go: wall and CPU time of each phase and of each model, with the
+    peak memory reached during them and the peak memory of the whole process when they end, plus counters (rules
+    translated, fired atoms per rule, causes, explanations per atom, cycle cut-offs...) and the statistics of clingo.
+
+    The peak of a phase (or model) is measured by resetting the peak of the process when it starts, which is only
+    possible on Linux (elsewhere it is None). The peaks of the phases that contain it, and of the process, are kept
+    before resetting it.
+
+    It does nothing until enable is called and the hooks only take a few clock and /proc reads, so they can be left in
+    place.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}  # name -> [calls, wall seconds, cpu seconds, process peak rss KiB at the end, peak rss KiB]
+        self.counters = {}  # name -> int
+        self.fired = {}  # fired id -> number of fired atoms (all the models)
+        self.models = []  # one record per model (the first MAX_MODEL_RECORDS)
+        self.models_seen = 0
+        self.clingo = None
+        self._model = None  # record of the model that is being explained
+        self._peaks = None  # peak rss KiB of each open phase and model, innermost last (None if it can not be reset)
+        self._process_peak = 0  # peak rss KiB of the process before the last reset
+
+    def enable(self):
+        self.enabled = True
+        self._process_peak = _peak_rss_kb() or 0
+        self._peaks = [] if _reset_peak_rss() else None
+
+    def _process_peak_kb(self):
+        """
+        @return int: the peak memory (KiB) of the whole process until now, or None if it is not available.
+        """
+        if self._peaks is None:
+            return _peak_rss_kb()
+        return max(self._process_peak, _vm_hwm_kb() or 0)
+
+    def _start_peak(self):
+        """
+        Starts measuring the peak memory of a phase or model.
+        """
+        peaks = self._peaks
+        if peaks is None:
+            return
+        # The peak until now belongs to the open ones
+        current = _vm_hwm_kb() or 0
+        for i in range(len(peaks)):
+            peaks[i] = max(peaks[i], current)
+        self._process_peak = max(self._process_peak, current)
+        _reset_peak_rss()
+        peaks.append(0)
+
+    def _end_peak(self):
+        """
+        @return int: the peak memory (KiB) of the phase or model that ends (see _start_peak), or None.
+        """
+        peaks = self._peaks
+        if peaks is None:
+            return None
+        return max(peaks.pop(), _vm_hwm_kb() or 0)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager that records the time spent in a phase (a phase can be entered many times).
+        @param str name:
+        """
+        if not self.enabled:
+            yield
+            return
+
+        self._start_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            peak = self._end_peak()
+            record = self.phases.get(name)
+            if record is None:
+                record = self.phases[name] = [0, 0.0, 0.0, None, None]
+            record[0] += 1
+            record[1] += wall
+            record[2] += cpu
+            record[3] = self._process_peak_kb()
+            if peak is not None:
+                record[4] = peak if record[4] is None else max(record[4], peak)
+
+    @contextmanager
+    def model(self, number):
+        """
+        Context manager that records the time spent explaining a model. The counters of the model (see count_model) are
+        added to its record.
+        @param int number: the number of the answer set.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        self.models_seen += 1
+        record = {"model": number, "causes": 0, "explanations": {}}
+        self._model = record
+        self._start_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.process_time() - cpu
+            record["peak_rss_kb"] = self._end_peak()
+            record["process_peak_rss_kb"] = self._process_peak_kb()
+            self._model = None
+            if len(self.models) < MAX_MODEL_RECORDS:
+                self.models.append(record)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def count_fired(self, fired_values):
+        """
+        @param Dict fired_values: the fired values of a model, indexed by fired id.
+        """
+        if not self.enabled:
+            return
+        fired = self.fired
+        for fired_id, values in fired_values.items():
+            fired[fired_id] = fired.get(fired_id, 0) + len(values)
+
+    def count_model(self, causes=None, atom=None, explanations=None):
+        """
+        Adds counters to the model that is being explained.
+        @param int causes: the number of causes (fired rule instances) of the model.
+        @param clingo.Symbol atom: an explained atom.
+        @param int explanations: the number of explanations of the atom.
+        """
+        if not self.enabled:
+            return
+        if causes is not None:
+            self.count("causes", causes)
+            if self._model is not None:
+                self._model["causes"] += causes
+        if atom is not None:
+            self.count("explanations", explanations)
+            if self._model is not None:
+                self._model["explanations"][str(atom)] = explanations
+
+    def merge_clingo(self, statistics):
+        """
+        @param Dict statistics: the statistics of clingo (clingo.Control.statistics).
+        """
+        if self.enabled:
+            self.clingo = statistics
+
+    def as_dict(self):
+        return {
+            "phases": {name: {"calls": calls, "wall": wall, "cpu": cpu, "peak_rss_kb": peak, "process_peak_rss_kb": rss}
+                       for name, (calls, wall, cpu, rss, peak) in self.phases.items()},
+            "counters": dict(self.counters),
+            "fired": {str(fired_id): n for fired_id, n in sorted(self.fired.items())},
+            "models": self.models,
+            "models_seen": self.models_seen,
+            "process_peak_rss_kb": self._process_peak_kb(),
+            "clingo": self.clingo,
+        }
+
+    def report(self, out=sys.stderr, output_format="text"):
+        """
+        Writes the report.
+        @param out: file object where the report is written.
+        @param str output_format: "text" or "json".
+        """
+        if not self.enabled:
+            return
+
+        if output_format == "json":
+            json.dump(self.as_dict(), out, default=str)
+            out.write("\n")
+            out.flush()
+            return
+
+        out.write("Statistics\n")
+        out.write("  {:>10} | {:>10} | {:>10} | {:>18} | {:>6} | phase\n".format(
+            "wall [ms]", "cpu [ms]", "peak [KiB]", "process peak [KiB]", "calls"))
+        for name, (calls, wall, cpu, rss, peak) in self.phases.items():
+            out.write("  {:10.2f} | {:10.2f} | {:>10} | {:>18} | {:6} | {}\n".format(
+                wall * 1000, cpu * 1000, "-" if peak is None else peak, "-" if rss is None else rss, calls, name))
+
+        for name, n in self.counters.items():
+            out.write("  {:<24} {}\n".format(name + ":", n))
+        out.write("  {:<24} {}\n".format("models:", self.models_seen))
+        if self.fired:
+            out.write("  fired atoms per rule:    {}\n".format(
+                ", ".join("{}={}".format(fired_id, n) for fired_id, n in sorted(self.fired.items()))))
+
+        for record in self.models:
+            explanations = record["explanations"]
+            out.write("  model {}: {:.2f} ms wall, {:.2f} ms cpu, {} KiB peak, {} causes, {} explanations of {} atoms\n"
+                      .format(record["model"], record["wall"] * 1000, record["cpu"] * 1000,
+                              "-" if record["peak_rss_kb"] is None else record["peak_rss_kb"], record["causes"],
+                              sum(explanations.values()), len(explanations)))
+        if self.models_seen > len(self.models):
+            out.write("  ({} more models not listed)\n".format(self.models_seen - len(self.models)))
+
+        summary = (self.clingo or {}).get("summary")
+        if summary:
+            times = summary.get("times", {})
+            out.write("  clingo: {} models, {:.2f} ms solving, {:.2f} ms total\n".format(
+                int(summary.get("models", {}).get("enumerated", 0)),
+                times.get("solve", 0.0) * 1000, times.get("total", 0.0) * 1000))
+            solvers = (self.clingo.get("solving") or {}).get("solvers") or {}
+            if solvers:
+                out.write("  clingo: {} choices, {} conflicts\n".format(
+                    int(solvers.get("choices", 0)), int(solvers.get("conflicts", 0))))
+        out.flush()
+
+
+# The instrumentation of the running process
+stats = Stats()
@@ -0,0 +1,233 @@
+import clingo
+
+
+class LabelTemplate:
+    """
+    Label text precompiled at its '%' placeholders, which are replaced in order by the values of the label.
+    """
+    __slots__ = ('parts',)
+
+    def __init__(self, text):
+        self.parts = text.split("%")
+
+    def fill(self, values):
+        """
+        @param List[str] values: the values of the placeholders (the placeholders without value are left as '%').
+        @return str: the label.
+        """
+        parts = self.parts
+        label = [parts[0]]
+        for i in range(1, len(parts)):
+            label.append(values[i - 1] if i <= len(values) else "%")
+            label.append(parts[i])
+        return "".join(label)
+
+
+def _theory_value(value):
+    """
+    @param clingo.TheoryTerm value:
+    @return str: the value, with the binary + and - operations between numbers resolved.
+    """
+    if value.type == clingo.TheoryTermType.Function and len(value.arguments) == 2:
+        if value.name == "+":
+            return str(value.arguments[0].number + value.arguments[1].number)
+        if value.name == "-":
+            return str(value.arguments[0].number - value.arguments[1].number)
+    return str(value)
+
+
+def _head_from_theory_term(theory_term):
+    """
+    @param clingo.TheoryTerm theory_term: the atom of a label, as a theory term.
+    @return clingo.Symbol: the atom, or None if it is not a valid atom.
+    """
+    is_classic_negation = theory_term.name == "-" and len(theory_term.arguments) == 1
+
+    if is_classic_negation:
+        theory_term = theory_term.arguments[0]
+
+    arguments = [_theory_value(arg) for arg in theory_term.arguments]
+    fired_head = "{sign}{name}{arguments}".format(
+        sign="-" if is_classic_negation else "",
+        name=theory_term.name,
+        arguments="({})".format(",".join(arguments)) if arguments else ""
+    )
+
+    try:
+        return clingo.parse_term(fired_head)
+    except RuntimeError:
+        return None
+
+
+class ModelLabels:
+    """
+    The labels of a program whose literals are true in a model.
+    """
+    __slots__ = ('atom_labels', 'rule_labels', 'rule_weights', 'true_literals')
+
+    def __init__(self, atom_labels, rule_labels, rule_weights, true_literals=frozenset()):
+        self.atom_labels = atom_labels  # atom -> labels of 'trace_all' sentences
+        self.rule_labels = rule_labels  # (fired id, atom) -> label of a 'trace_rule' sentence
+        self.rule_weights = rule_weights  # (fired id, atom) -> weight of a 'trace_rule' sentence
+        self.true_literals = true_literals  # the literals of the labels that are true in the model
+
+    def labels(self, fired_id, head):
+        """
+        @param int fired_id: the id of the rule.
+        @param clingo.Symbol head: the head of the fired rule instance.
+        @return List[str]: the labels of the rule instance.
+        """
+        labels = list(self.atom_labels.get(head, ()))
+        label = self.rule_labels.get((fired_id, head))
+        if label is not None:
+            labels.append(label)
+        return labels
+
+    def weight(self, fired_id, head):
+        """
+        @param int fired_id: the id of the rule.
+        @param clingo.Symbol head: the head of the fired rule instance.
+        @return int: the weight of the labels of the rule instance, or None if it has no weight.
+        """
+        return self.rule_weights.get((fired_id, head))
+
+
+# Tables of a LabelIndex, as they are recorded for each literal
+_ATOM_LABEL, _RULE_LABEL, _RULE_WEIGHT = range(3)
+
+
+class LabelIndex:
+    """
+    The processed labels of a program, indexed by atom ('trace_all' sentences) and by rule id and atom ('trace_rule'
+    sentences), and the weights of the 'trace_rule' sentences. Each label (or weight) is guarded by the program literal
+    of its theory atom.
+    """
+
+    def __init__(self, atom_labels=None, rule_labels=None, rule_weights=None):
+        self.atom_labels = {} if atom_labels is None else atom_labels  # atom -> [(literal, label)]
+        self.rule_labels = {} if rule_labels is None else rule_labels  # (fired id, atom) -> (literal, label)
+        self.rule_weights = {} if rule_weights is None else rule_weights  # (fired id, atom) -> (literal, weight)
+
+        # What each literal guards, so resolve only checks each literal once and only walks the true ones
+        self._by_literal = {}  # literal -> [(table, key, value)]
+        for atom, labels in self.atom_labels.items():
+            for position, (lit, label) in enumerate(labels):
+                # With its position, since the labels of an atom keep their order
+                self._by_literal.setdefault(lit, []).append((_ATOM_LABEL, atom, (position, label)))
+        for key, (lit, label) in self.rule_labels.items():
+            self._by_literal.setdefault(lit, []).append((_RULE_LABEL, key, label))
+        for key, (lit, weight) in self.rule_weights.items():
+            self._by_literal.setdefault(lit, []).append((_RULE_WEIGHT, key, weight))
+
+    @classmethod
+    def from_theory_atoms(cls, theory_atoms):
+        """
+        @param Iterable[clingo.TheoryAtom] theory_atoms: the theory atoms of a grounded program.
+        @return LabelIndex:
+        """
+        atom_labels = {}
+        rule_labels = {}
+        rule_weights = {}
+        templates = {}
+        for atom in theory_atoms:
+            name = atom.term.name
+            if name == "trace_all":
+                terms = atom.elements[0].terms
+                head, text, values = terms[0], terms[1], terms[2:]
+            elif name == "trace":
+                terms = atom.elements[0].terms
+                head, text, values = terms[1], terms[2], terms[3:]
+            elif name == "trace_weight":
+                terms = atom.elements[0].terms
+                head = _head_from_theory_term(terms[1])
+                try:
+                    weight = int(_theory_value(terms[2]))
+                except (ValueError, IndexError):  # Only non negative integer weights are used
+                    continue
+                if head is not None and weight >= 0:
+                    rule_weights[(int(str(terms[0])), head)] = (atom.literal, weight)
+                continue
+            else:
+                continue
+
+            head = _head_from_theory_term(head)
+            if head is None:  # It can not be the head of any rule
+                continue
+
+            text = str(text)
+            template = templates.get(text)
+            if template is None:
+                template = templates[text] = LabelTemplate(text)
+            label = template.fill([_theory_value(v) for v in values])
+
+            if name == "trace_all":
+                atom_labels.setdefault(head, []).append((atom.literal, label))
+            else:
+                rule_labels[(int(str(terms[0])), head)] = (atom.literal, label)
+
+        return cls(atom_labels, rule_labels, rule_weights)
+
+    def literals(self):
+        """
+        @return Set[int]: the program literals of all the labels.
+        """
+        return set(self._by_literal)
+
+    def resolve(self, model):
+        """
+        Checks the truth of the literals of the labels once for a model.
+        @param clingo.Model model: the model (or any object with the is_true method of clingo.Model).
+        @return ModelLabels: the labels whose literals are true in the model.
+        """
+        is_true = model.is_true
+        tables = ({}, {}, {})
+        atom_labels, rule_labels, rule_weights = tables
+        true_literals = []
+        for lit, guarded in self._by_literal.items():
+            if is_true(lit):
+                true_literals.append(lit)
+                for table, key, value in guarded:
+                    if table == _ATOM_LABEL:
+                        atom_labels.setdefault(key, []).append(value)
+                    else:
+                        tables[table][key] = value
+
+        for atom, labels in atom_labels.items():
+            if len(labels) > 1:
+                labels.sort()
+            atom_labels[atom] = [label for _, label in labels]
+
+        return ModelLabels(atom_labels, rule_labels, rule_weights, frozenset(true_literals))
+
+    def labelled_atoms(self, literals):
+        """
+        @param Iterable[int] literals: program literals of labels.
+        @return Set[clingo.Symbol]: the atoms whose labels (or weights) are guarded by the given literals.
+        """
+        atoms = set()
+        for lit in literals:
+            for table, key, _ in self._by_literal.get(lit, ()):
+                atoms.add(key if table == _ATOM_LABEL else key[1])
+        return atoms
+
+    def __reduce__(self):
+        # clingo symbols are sent as strings
+        return _label_index_from_strings, (
+            {str(atom): labels for atom, labels in self.atom_labels.items()},
+            {(fired_id, str(atom)): label for (fired_id, atom), label in self.rule_labels.items()},
+            {(fired_id, str(atom)): weight for (fired_id, atom), weight in self.rule_weights.items()}
+        )
+
+    def __repr__(self):
+        labels = {str(atom): labels for atom, labels in self.atom_labels.items()}
+        for (fired_id, atom), label in self.rule_labels.items():
+            labels.setdefault(fired_id, {})[str(atom)] = label
+        return repr(labels)
+
+
+def _label_index_from_strings(atom_labels, rule_labels, rule_weights):
+    return LabelIndex(
+        {clingo.parse_term(atom): labels for atom, labels in atom_labels.items()},
+        {(fired_id, clingo.parse_term(atom)): label for (fired_id, atom), label in rule_labels.items()},
+        {(fired_id, clingo.parse_term(atom)): weight for (fired_id, atom), weight in rule_weights.items()}
+    )
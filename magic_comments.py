@@ -0,0 +1,334 @@
+import re
+import sys
+
+# Atoms accepted as the head of a traced rule or as the atom of a %!trace or %!show_trace annotation
+_ATOM = re.compile(r"-?_*[a-z][a-zA-Z0-9_']*(?:\(.*\))?", re.S)
+
+
+def _skip_spaces(text, i):
+    while i < len(text) and text[i] in " \t\r\n":
+        i += 1
+    return i
+
+
+def _string_end(text, i):
+    """
+    @param str text:
+    @param int i: position of the opening quote of a string.
+    @return int: the position after the closing quote (len(text) if the string is not closed).
+    """
+    i += 1
+    while i < len(text):
+        c = text[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == '"':
+            return i + 1
+        i += 1
+    return len(text)
+
+
+def _comment_start(line):
+    """
+    @param str line:
+    @return int: the position of the '%' that starts the comment of the line (outside strings), or -1.
+    """
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if c == '"':
+            i = _string_end(line, i)
+        elif c == "%":
+            return i
+        else:
+            i += 1
+    return -1
+
+
+def _braced(text, i):
+    """
+    @param str text:
+    @param int i: position of an opening brace.
+    @return (str, int): the text between the braces and the position after the closing brace, or None if it is not
+    closed.
+    """
+    depth = 0
+    start = i
+    while i < len(text):
+        c = text[i]
+        if c == '"':
+            i = _string_end(text, i)
+            continue
+        if c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start + 1:i], i + 1
+        i += 1
+    return None
+
+
+def _scan_statement(text, i=0, depth=0, in_string=False):
+    """
+    Looks for the end of a statement that may continue in the text that follows (see _statement_end), so the scan can
+    be resumed there without scanning the text again.
+    @param str text:
+    @param int i: where the scan starts.
+    @param int depth: the nesting depth (of parentheses, braces and brackets) at i.
+    @param bool in_string: True if i is inside a string.
+    @return (int, int, bool): the position of the period that ends the statement (or -1 if it does not end in the
+    text), and the depth and whether the scan is inside a string at the end of the text.
+    """
+    while i < len(text):
+        c = text[i]
+        if in_string:
+            if c == "\\":
+                i += 2
+                continue
+            if c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == "%":
+            newline = text.find("\n", i)
+            if newline == -1:
+                break
+            i = newline
+        elif c in "({[":
+            depth += 1
+        elif c in ")}]":
+            depth -= 1
+        elif c == "." and depth <= 0:
+            if text.startswith("..", i):
+                i += 2
+                continue
+            return i, depth, in_string
+        i += 1
+    return -1, depth, in_string
+
+
+def _statement_end(text, i=0):
+    """
+    @param str text:
+    @param int i: where the statement starts.
+    @return int: the position of the period that ends the statement (outside strings, parentheses and comments, and
+    not part of an interval '..'), or -1 if the statement does not end in the text.
+    """
+    return _scan_statement(text, i)[0]
+
+
+def _split_top_level(text, separator):
+    """
+    Splits the text at the first occurrence of separator outside strings and parentheses.
+    @return (str, str): the stripped parts (the second one is None if there is no separator).
+    """
+    depth = 0
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == '"':
+            i = _string_end(text, i)
+            continue
+        if c in "({[":
+            depth += 1
+        elif c in ")}]":
+            depth -= 1
+        elif depth == 0 and text.startswith(separator, i) and (separator != ":" or not text.startswith(":-", i)):
+            return text[:i].strip(), text[i + len(separator):].strip()
+        i += 1
+    return text.strip(), None
+
+
+def _as_comment(rest):
+    """
+    @param str rest: what follows an annotation in its (comment) line.
+    @return str: the text, commented out again if it is not blank.
+    """
+    if rest.strip() and not rest.lstrip().startswith("%"):
+        return "%" + rest
+    return rest
+
+
+class MagicCommentScanner:
+    """
+    Rewrites the xclingo magic comments of a program in a single pass over its lines:
+
+        %!trace_rule {"label",X}      is attached (as a &trace theory atom) to the rule that follows it.
+        %!trace_rule {"label",X} @W   also attaches the weight W (as a &trace_weight theory atom).
+        %!trace {"label",X} a(X) : b. becomes a &trace_all rule.
+        %!show_trace a(X) : b.        becomes a show_all_ (or nshow_all_ for -a(X)) rule.
+
+    The rewritten program is written as the lines are fed. Malformed annotations are reported (with their line number)
+    and left unchanged.
+    """
+
+    def __init__(self, out, warnings=sys.stderr):
+        """
+        @param out: file object where the rewritten program is written.
+        @param warnings: file object where the malformed annotations are reported.
+        """
+        self.out = out
+        self.warnings = warnings
+        self.have_explain = False  # True if some %!show_trace annotation was found
+        self._pending = None  # (source, line number, labels, weight, text) of a %!trace_rule waiting for its rule
+        self._rule = []  # lines of the rule that follows the pending %!trace_rule
+        self._rule_scan = (0, False)  # (depth, inside a string) where the lines of the rule end (see _scan_statement)
+
+    def _warn(self, source, lineno, kind):
+        print("Warning: {}:{}: malformed {} annotation, left unchanged.".format(source, lineno, kind),
+              file=self.warnings)
+
+    def feed(self, lines, source="<string>"):
+        """
+        Rewrites the given lines.
+        @param Iterable[str] lines: lines of a program (for example, a file object), with their line endings.
+        @param str source: the name of the program used in the warnings.
+        """
+        write = self.out.write
+        for lineno, line in enumerate(lines, 1):
+            if self._pending is not None:
+                if not line.lstrip().startswith("%!"):
+                    self._feed_rule(line)
+                    continue
+                # Another annotation before the end of the rule
+                self.close()
+
+            if "%!" not in line:
+                write(line)
+                continue
+            start = _comment_start(line)
+            if start == -1 or not line.startswith("%!", start):
+                write(line)
+                continue
+
+            write(line[:start])
+            comment = line[start:]
+            if comment.startswith("%!trace_rule"):
+                self._trace_rule(comment, source, lineno)
+            elif comment.startswith("%!trace") and comment[len("%!trace"):len("%!trace") + 1] in (" ", "{"):
+                self._trace(comment, source, lineno)
+            elif comment.startswith("%!show_trace"):
+                self._show_trace(comment, source, lineno)
+            else:
+                write(comment)
+
+    def close(self):
+        """
+        Ends the program: a %!trace_rule that is still waiting for its rule is left unchanged.
+        """
+        if self._pending is not None:
+            source, lineno, _, _, text = self._pending
+            self._warn(source, lineno, "%!trace_rule")
+            self.out.write(text + "".join(self._rule))
+            self._pending = None
+            self._rule = []
+            self._rule_scan = (0, False)
+
+    def _trace_rule(self, comment, source, lineno):
+        i = _skip_spaces(comment, len("%!trace_rule"))
+        braced = _braced(comment, i) if comment.startswith("{", i) else None
+        if braced is None:
+            self._warn(source, lineno, "%!trace_rule")
+            self.out.write(comment)
+            return
+
+        labels, i = braced
+        weight = None
+        j = _skip_spaces(comment, i)
+        if comment.startswith("@", j):
+            end = _skip_spaces(comment, j + 1)
+            while end < len(comment) and comment[end] not in " \t\r\n%":
+                end += 1
+            weight = comment[j + 1:end].strip()
+            if not weight:
+                self._warn(source, lineno, "%!trace_rule")
+                self.out.write(comment)
+                return
+            i = end
+        self._pending = (source, lineno, labels, weight, comment[:i])
+        self._rule = []
+        self._rule_scan = (0, False)
+        # The rule may start in the same line
+        self._feed_rule(comment[i:])
+
+    def _feed_rule(self, line):
+        # Only the new line is scanned, from the state in which the previous lines of the rule ended
+        end, depth, in_string = _scan_statement(line, 0, *self._rule_scan)
+        self._rule.append(line)
+        if end == -1:
+            self._rule_scan = (depth, in_string)
+            return
+
+        rule = "".join(self._rule)
+        end += len(rule) - len(line)
+        source, lineno, labels, weight, text = self._pending
+        self._pending = None
+        self._rule = []
+        self._rule_scan = (0, False)
+
+        head, body = _split_top_level(rule[:end], ":-")
+        if not _ATOM.fullmatch(head):
+            self._warn(source, lineno, "%!trace_rule")
+            self.out.write(text + rule)
+            return
+
+        self.out.write("{head} :- {body} &trace{{{labels}}}{weight}.\n".format(
+            head=head, labels=labels, body=body + "," if body else "",
+            weight=", &trace_weight{{{}}}".format(weight) if weight is not None else ""))
+        self.out.write(rule[end + 1:])
+
+    def _trace(self, comment, source, lineno):
+        i = _skip_spaces(comment, len("%!trace"))
+        braced = _braced(comment, i) if comment.startswith("{", i) else None
+        end = _statement_end(comment, braced[1]) if braced is not None else -1
+        if end == -1:
+            self._warn(source, lineno, "%!trace")
+            self.out.write(comment)
+            return
+
+        labels, i = braced
+        head, body = _split_top_level(comment[i:end], ":")
+        if not _ATOM.fullmatch(head) or body == "":
+            self._warn(source, lineno, "%!trace")
+            self.out.write(comment)
+            return
+
+        self.out.write("&trace_all{{{head},{parameters} : }} :- {head}{rest_body}.\n".format(
+            head=head, parameters=labels, rest_body="," + body if body else ""))
+        self.out.write(_as_comment(comment[end + 1:]))
+
+    def _show_trace(self, comment, source, lineno):
+        i = len("%!show_trace")
+        end = _statement_end(comment, i) if comment.startswith(" ", i) else -1
+        head, body = _split_top_level(comment[i:end], ":") if end != -1 else (None, None)
+        if head is None or not _ATOM.fullmatch(head) or body == "":
+            self._warn(source, lineno, "%!show_trace")
+            self.out.write(comment)
+            return
+
+        negative = head.startswith("-")
+        self.out.write("{sign}{prefix}{head}:-{classic_negation}{head}{body}.".format(
+            sign="n" if negative else "",
+            prefix="show_all_",
+            head=head[1:] if negative else head,
+            classic_negation="-" if negative else "",
+            body="," + body if body else ""))
+        self.out.write(_as_comment(comment[end + 1:]))
+        self.have_explain = True
+
+
+def translate_magic_comments(sources, out, warnings=sys.stderr):
+    """
+    Rewrites the magic comments of the given programs (see MagicCommentScanner).
+    @param Iterable sources: the programs, as pairs (name, lines) where lines can be a file object.
+    @param out: file object where the rewritten program is written.
+    @param warnings: file object where the malformed annotations are reported.
+    @return bool: True if some %!show_trace annotation was found.
+    """
+    scanner = MagicCommentScanner(out, warnings)
+    for name, lines in sources:
+        scanner.feed(lines, name)
+    scanner.close()
+    return scanner.have_explain
@@ -0,0 +1,148 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import clingo
+
+from clingo_utilities import partition_model
+from explanation import decode_explanations, encode_explanations
+
+# State of a worker process: (explain function, binding plans, labels dict, have_explain, options)
+_worker_state = None
+# State shared (through fork) with the workers of explain_atoms: (explanation engine, limit, render function)
+_shared_atoms_state = None
+
+
+def _encode_tuple(symbols):
+    if len(symbols) == 1:
+        return "({},)".format(symbols[0])
+    return "({})".format(",".join(map(str, symbols)))
+
+
+class ModelSnapshot:
+    """
+    Compact and picklable copy of the parts of a clingo.Model that are needed to explain it: the fired values (as one
+    tuple string per fired instance), the show_all atoms and the truth of the label literals.
+    """
+    __slots__ = ('number', 'fired', 'show_all', 'true_literals')
+
+    def __init__(self, number, fired, show_all, true_literals):
+        self.number = number
+        self.fired = fired
+        self.show_all = show_all
+        self.true_literals = true_literals
+
+    @classmethod
+    def from_model(cls, number, model, fired_names, literals):
+        """
+        @param int number: the number of the answer set.
+        @param clingo.Model model:
+        @param Dict fired_names: the id of each rule indexed by the name of its 'fired' atoms.
+        @param Set[int] literals: the literals whose truth is needed (see LabelIndex.literals).
+        @return ModelSnapshot:
+        """
+        fired_values, show_all, _ = partition_model(model.symbols(shown=True), fired_names)
+        return cls(
+            number,
+            {fired_id: [_encode_tuple(values) for values in values_list]
+             for fired_id, values_list in fired_values.items()},
+            [str(s) for s in show_all],
+            frozenset(lit for lit in literals if model.is_true(lit))
+        )
+
+    def is_true(self, literal):
+        return literal in self.true_literals
+
+    def fired_values(self):
+        """
+        @return Dict: the fired values of the model (indexed by fired id) as clingo symbols.
+        """
+        return {fired_id: [clingo.parse_term(values).arguments for values in values_list]
+                for fired_id, values_list in self.fired.items()}
+
+    def show_all_atoms(self):
+        return [clingo.parse_term(s) for s in self.show_all]
+
+
+def _init_worker(*state):
+    global _worker_state
+    _worker_state = state
+
+
+def _explain_snapshot(snapshot):
+    explain, binding_plans, labels_dict, have_explain, options = _worker_state
+    return explain(snapshot.number, snapshot, snapshot.fired_values(), snapshot.show_all_atoms(), binding_plans,
+                   labels_dict, have_explain, options)
+
+
+def solve_and_explain(control, labels_dict, options, jobs, explain, write):
+    """
+    Solves in the current process while a pool of worker processes explains the answer sets. The output is written in
+    the order of the answer sets.
+    @param XClingoProgramControl control: the grounded control.
+    @param LabelIndex labels_dict: the processed labels of the program (see xclingo.build_labels_dict).
+    @param xclingo.ExplainOptions options:
+    @param int jobs: number of worker processes.
+    @param function explain: the function that builds the output of a model (xclingo.explain_model).
+    @param function write: the function that receives the output of each model.
+    """
+    literals = labels_dict.literals()
+    # Bounds the models waiting in the pool if the solver is faster than the workers
+    max_pending = 4 * jobs
+
+    # A worker that dies makes the pending results fail (BrokenProcessPool) instead of waiting for them forever
+    with ProcessPoolExecutor(jobs, initializer=_init_worker,
+                             initargs=(explain, control.binding_plans, labels_dict, control.have_explain,
+                                       options)) as pool:
+        pending = deque()
+        with control.solve(yield_=True) as it:
+            sol_n = 0
+            for m in it:
+                sol_n += 1
+                snapshot = ModelSnapshot.from_model(sol_n, m, control.fired_names, literals)
+                pending.append(pool.submit(_explain_snapshot, snapshot))
+
+                while pending and (pending[0].done() or len(pending) >= max_pending):
+                    write(pending.popleft().result())
+
+        while pending:
+            write(pending.popleft().result())
+
+
+def _explain_shared_atom(atom_id):
+    engine, limit, render = _shared_atoms_state
+    if render is None:
+        # Sent back as a flat table, since deep trees can not be pickled recursively
+        return encode_explanations(engine.explain(atom_id, limit))
+    return [render(e) for e in engine.explain(atom_id, limit)]
+
+
+def explain_atoms(engine, atom_ids, limit, jobs, render):
+    """
+    Explains the given atoms of a model in a pool of forked worker processes. The workers inherit the (read-only)
+    causes graph and its components instead of receiving a copy per task.
+    @param ExplanationEngine engine: the engine of the model.
+    @param List[int] atom_ids: the atoms to be explained.
+    @param int limit: maximum number of explanations per atom (None for all of them).
+    @param int jobs: number of worker processes.
+    @param function render: the function that renders each explanation as a str (None to get the explanations).
+    @return Iterator[List]: the (rendered) explanations of each atom, in the order of atom_ids. If a worker fails, the
+    error is raised (concurrent.futures.process.BrokenProcessPool if the worker died).
+    """
+    global _shared_atoms_state
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        # Without fork the graph would be pickled for every worker, so it is not worth it
+        for atom_id in atom_ids:
+            explanations = engine.explain(atom_id, limit)
+            yield explanations if render is None else [render(e) for e in explanations]
+        return
+
+    _shared_atoms_state = (engine, limit, render)
+    try:
+        with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("fork")) as pool:
+            chunksize = max(1, len(atom_ids) // (4 * jobs))
+            for trees in pool.map(_explain_shared_atom, atom_ids, chunksize=chunksize):
+                yield trees if render is not None else decode_explanations(*trees)
+    finally:
+        _shared_atoms_state = None
@@ -0,0 +1,200 @@
+import io
+import json
+
+
+class AsciiTreeRenderer:
+    """
+    Renders explanations as ascii trees:
+
+          *
+          |__label
+          |  |__label of a child
+          ...
+
+    The trees are walked iteratively (so their depth is not limited by the interpreter stack) and written directly into
+    a file object. The rendering of small subtrees is cached by (node, level), so subtrees shared by several
+    explanations are formatted only once.
+    """
+
+    def __init__(self, max_cached_nodes=256):
+        """
+        @param int max_cached_nodes: only subtrees with at most this number of nodes are cached.
+        """
+        self.max_cached_nodes = max_cached_nodes
+        self._branches = []
+        self._cache = {}  # (node, level) -> str
+        self._sizes = {}  # node -> number of nodes of its subtree (up to max_cached_nodes + 1)
+
+    def _branch(self, level):
+        while len(self._branches) <= level:
+            self._branches.append("  |" * (len(self._branches) + 1) + "__")
+        return self._branches[level]
+
+    def _size(self, node):
+        """
+        @param ExplanationNode node:
+        @return int: the number of nodes of the subtree of the node, saturated at max_cached_nodes + 1.
+        """
+        sizes = self._sizes
+        limit = self.max_cached_nodes + 1
+        if node in sizes:
+            return sizes[node]
+
+        stack = [(node, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if current in sizes:
+                continue
+            if not expanded:
+                stack.append((current, True))
+                stack.extend((c, False) for c in current.children if c not in sizes)
+            else:
+                sizes[current] = min(limit, 1 + sum(sizes[c] for c in current.children))
+
+        return sizes[node]
+
+    def _render_subtree(self, node, level):
+        """
+        @return str: the rendering of a (small) labelled node and its descendants at the given level.
+        """
+        parts = []
+        stack = [(node, level)]
+        while stack:
+            current, current_level = stack.pop()
+            cached = self._cache.get((current, current_level))
+            if cached is not None:
+                parts.append(cached)
+                continue
+            parts.append("{}{}\n".format(self._branch(current_level), current.label))
+            stack.extend((c, current_level + 1) for c in reversed(current.children))
+        return "".join(parts)
+
+    def write(self, explanation, out):
+        """
+        Writes the ascii tree of an explanation.
+        @param ExplanationNode explanation: an explanation.
+        @param out: file object where the tree is written.
+        """
+        if not explanation:
+            out.write("\t1\n")
+            return
+
+        out.write("  *\n")
+        cache = self._cache
+        stack = [(c, 0) for c in reversed(explanation.children)]
+        while stack:
+            node, level = stack.pop()
+            key = (node, level)
+            cached = cache.get(key)
+            if cached is not None:
+                out.write(cached)
+            elif self._size(node) <= self.max_cached_nodes:
+                cached = cache[key] = self._render_subtree(node, level)
+                out.write(cached)
+            else:
+                out.write("{}{}\n".format(self._branch(level), node.label))
+                stack.extend((c, level + 1) for c in reversed(node.children))
+
+    def render(self, explanation):
+        """
+        @param ExplanationNode explanation: an explanation.
+        @return str: the ascii tree of the explanation.
+        """
+        out = io.StringIO()
+        self.write(explanation, out)
+        return out.getvalue()
+
+
+class JsonLinesWriter:
+    """
+    Writes the explanations of a model as JSON Lines (one JSON object per line):
+
+        {"type":"model","answer":1}
+        {"type":"node","id":0,"label":"q","children":[]}
+        {"type":"node","id":1,"label":null,"children":[0]}
+        {"type":"atom","answer":1,"atom":"p","explanations":[1]}
+
+    Explanations are written as a table of nodes plus references. Every distinct node is written once (before the
+    first record that refers to it) and the rest of records refer to it by id, so sub-explanations shared by several
+    explanations or atoms are serialized only once. The root of an explanation has a null label. Node ids are local to
+    the model record that precedes them.
+    """
+
+    def __init__(self, out):
+        """
+        @param out: file object where the records are written.
+        """
+        self.out = out
+        self._ids = {}  # ExplanationNode -> id
+        self._number = None
+        self._encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+    def _write(self, record):
+        self.out.write(self._encode(record))
+        self.out.write("\n")
+
+    def write_model(self, number, **fields):
+        """
+        Starts the records of a new model.
+        @param int number: the number of the answer set.
+        @param fields: extra fields of the model record.
+        """
+        self._ids.clear()
+        record = {"type": "model", "answer": number}
+        record.update(fields)
+        self._write(record)
+        self._number = number
+
+    def write_batch(self, index, name):
+        """
+        Writes the record that separates the models of a batch of facts (see incremental.add_batch).
+        @param int index:
+        @param str name:
+        """
+        self._write({"type": "batch", "index": index, "name": name})
+
+    def _node_id(self, node):
+        """
+        Writes the records of the nodes of the subtree of node that have not been written yet (children first).
+        @param ExplanationNode node:
+        @return int: the id of the node.
+        """
+        ids = self._ids
+        if node in ids:
+            return ids[node]
+
+        stack = [(node, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if current in ids:
+                continue
+            if not expanded:
+                stack.append((current, True))
+                stack.extend((c, False) for c in current.children if c not in ids)
+            else:
+                ids[current] = node_id = len(ids)
+                self._write({"type": "node", "id": node_id,
+                             "label": None if current.label is None else str(current.label),
+                             "children": [ids[c] for c in current.children]})
+
+        return ids[node]
+
+    def write_atom(self, atom, explanations, **fields):
+        """
+        Writes the record of an explained atom (and the records of its nodes that have not been written yet).
+        @param clingo.Symbol atom:
+        @param Iterable[ExplanationNode] explanations: the explanations of the atom.
+        @param fields: extra fields of the atom record.
+        """
+        roots = [self._node_id(e) for e in explanations]
+        record = {"type": "atom", "answer": self._number, "atom": str(atom), "explanations": roots}
+        record.update(fields)
+        self._write(record)
+
+    def write_count(self, atom, count):
+        """
+        Writes the record of an atom whose explanations were only counted.
+        @param clingo.Symbol atom:
+        @param int count: the number of explanations of the atom.
+        """
+        self._write({"type": "atom", "answer": self._number, "atom": str(atom), "count": count})
@@ -0,0 +1,252 @@
+import argparse
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import clingo
+
+import translation
+import xclingo
+
+# State of a worker process: (translated programs indexed by id, default ExplainOptions)
+_worker_state = None
+
+
+def _record(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+
+
+def _error(request_id, message):
+    return _record({"type": "error", "id": request_id, "message": message})
+
+
+def _init_worker(*state):
+    global _worker_state
+    _worker_state = state
+
+
+def _serve_request(request):
+    """
+    Explains an instance of one of the programs of the server (in a worker process).
+    @param Dict request: {"id": ..., "program": id of the program, "facts": the facts of the instance (optional),
+    "atoms": the atoms to explain (optional, by default the ones selected by the program), "models": maximum number of
+    answer sets (optional, 0 = all), "max_atom_explanations", "max_explanations", "count_only", "rank_by" and "top_k"
+    (optional)}.
+    @return str: the response, as the JSON Lines of xclingo.write_model followed by a "done" record (or a single "error"
+    record).
+    """
+    programs, options = _worker_state
+    request_id = request.get("id")
+    if request.get("program") not in programs:
+        return _error(request_id, "unknown program: {}".format(request.get("program")))
+
+    out = io.StringIO()
+    try:
+        control = translation.load_translated_program(["-n {}".format(int(request.get("models", 0))), "--project"],
+                                                      programs[request["program"]])
+        parts = [("base", [])]
+        if request.get("facts"):
+            translation.translate_part(control, "instance", request["facts"])
+            parts.append(("instance", []))
+        control.ground(parts)
+
+        atoms = request.get("atoms")
+        request_options = options._replace(
+            atoms=None if atoms is None else frozenset(clingo.parse_term(a) for a in atoms),
+            max_atom_explanations=int(request.get("max_atom_explanations", options.max_atom_explanations)),
+            max_explanations=int(request.get("max_explanations", options.max_explanations)),
+            count_only=bool(request.get("count_only", False)),
+            # As in the command line, top_k alone ranks by size
+            rank_by=request.get("rank_by", "size" if "top_k" in request else None),
+            top_k=int(request.get("top_k", 1))
+        )
+        if request_options.rank_by is not None and request_options.count_only:
+            raise ValueError("count_only cannot be used with rank_by or top_k")
+        if request_options.top_k < 1:
+            raise ValueError("top_k must be at least 1")
+        xclingo.explain_answer_sets(control, xclingo.build_labels_dict(control), request_options, out)
+    except (RuntimeError, ValueError, TypeError) as error:
+        return _error(request_id, str(error))
+
+    out.write(_record({"type": "done", "id": request_id}))
+    return out.getvalue()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads requests (one JSON object, or a list of them, per line) and writes their responses in the same order.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                payload = json.loads(line.decode())
+            except ValueError as error:
+                self.wfile.write(_error(None, "invalid request: {}".format(error)).encode())
+                continue
+
+            # All the requests of a batch are submitted before waiting for the first response
+            requests = payload if isinstance(payload, list) else [payload]
+            pending = [(request, self.server.submit(request)) for request in requests]
+            for request, response in pending:
+                if not isinstance(response, str):
+                    try:
+                        response = response.result()
+                    except Exception as error:  # The worker failed (or died), but the server must keep serving
+                        response = _error(request.get("id"), "internal error: {}".format(error))
+                self.wfile.write(response.encode())
+            self.wfile.flush()
+
+
+class _ExplanationServerMixin:
+    """
+    Dispatches the requests to a pool of worker processes, with at most workers + queue_size requests at once. If a
+    worker dies, its requests (and the ones waiting with them) fail and a new pool serves the next ones.
+    """
+    daemon_threads = True
+
+    def setup_pool(self, programs, options, workers, queue_size):
+        self._pool_arguments = (programs, options, workers)
+        self._pool_lock = threading.Lock()
+        self.pool = self._new_pool()
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def _new_pool(self):
+        programs, options, workers = self._pool_arguments
+        return ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(programs, options))
+
+    def _replace_pool(self, broken):
+        """
+        Replaces the pool, unless it was already replaced (by another request of the broken pool).
+        @param ProcessPoolExecutor broken: the pool that can not run more requests.
+        """
+        with self._pool_lock:
+            if self.pool is broken:
+                self.pool = self._new_pool()
+                broken.shutdown(wait=False)
+
+    def submit(self, request):
+        """
+        @param Dict request: see _serve_request.
+        @return: the Future of the request, or the error response (str) if it can not be accepted.
+        """
+        if not isinstance(request, dict):
+            return _error(None, "invalid request: it must be a JSON object")
+        if not self.slots.acquire(blocking=False):
+            return _error(request.get("id"), "server busy: the request queue is full")
+
+        pool = self.pool
+        try:
+            try:
+                future = pool.submit(_serve_request, request)
+            except BrokenProcessPool:  # A worker died after the last request of the pool
+                self._replace_pool(pool)
+                pool = self.pool
+                future = pool.submit(_serve_request, request)
+        except Exception:
+            self.slots.release()
+            raise
+
+        def finished(future):
+            # The slot is released whatever the outcome, so a dead worker does not reduce the capacity of the server
+            self.slots.release()
+            if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                self._replace_pool(pool)
+
+        future.add_done_callback(finished)
+        return future
+
+
+class UnixExplanationServer(_ExplanationServerMixin, socketserver.ThreadingUnixStreamServer):
+    pass
+
+
+class TCPExplanationServer(_ExplanationServerMixin, socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+
+
+def load_programs(specs):
+    """
+    Translates the programs served by the server.
+    @param List[str] specs: the programs as 'id=file[,file...]'.
+    @return Dict: the translation of each program indexed by its id (see translation.translated_program_entry).
+    """
+    programs = {}
+    for spec in specs:
+        program_id, _, files = spec.partition("=")
+        if not program_id or not files:
+            raise ValueError("invalid program (expected id=file[,file...]): {}".format(spec))
+
+        sources = [open(path) for path in files.split(",")]
+        try:
+            control = translation.prepare_xclingo_program([], sources, "none", keep_translation=True)
+        finally:
+            for source in sources:
+                source.close()
+        programs[program_id] = translation.translated_program_entry(control)
+
+    return programs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Long-running xclingo server. It keeps the translation of its programs '
+                                                 'and explains their instances (JSON Lines over a local socket).')
+    parser.add_argument('--program', action='append', required=True, metavar='ID=FILE[,FILE...]',
+                        help="Program served under the given id (can be repeated).")
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument('--socket', type=str, help="Path of the Unix socket where the server listens.")
+    address.add_argument('--port', type=int, help="TCP port where the server listens.")
+    parser.add_argument('--host', type=str, default="127.0.0.1",
+                        help="Address where the server listens when --port is given. Default: 127.0.0.1.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes that explain the requests. Default: number of CPUs.")
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help="Maximum number of requests waiting for a worker (the rest are rejected). Default: 64.")
+    parser.add_argument('--auto-tracing', type=str, choices=["none", "facts", "all"], default="none",
+                        help="Automatically creates traces for the rules of the program. Default: none.")
+    parser.add_argument('--max-atom-explanations', type=int, default=0,
+                        help="Default maximum number of explanations for each atom (0 = all). Default: 0.")
+    parser.add_argument('--max-explanations', type=int, default=0,
+                        help="Default maximum number of explanations for each answer set (0 = all). Default: 0.")
+    args = parser.parse_args()
+
+    try:
+        programs = load_programs(args.program)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    options = xclingo.ExplainOptions(args.auto_tracing, "none", args.max_atom_explanations, args.max_explanations, 1,
+                                     "ndjson", None, False, False, None, 1)
+
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = UnixExplanationServer(args.socket, _RequestHandler)
+    else:
+        server = TCPExplanationServer((args.host, args.port), _RequestHandler)
+
+    server.setup_pool(programs, options, max(1, args.workers), max(0, args.queue_size))
+    print("Serving {} on {}".format(", ".join(sorted(programs)), args.socket or "{}:{}".format(args.host, args.port)),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown(wait=False)
+        if args.socket is not None and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
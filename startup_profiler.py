@@ -0,0 +1,101 @@
+import builtins
+import sys
+import time
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    """
+    Measures the startup cost of xclingo: the time spent importing (and so initialising) each module for the first time
+    and the time spent in each initialisation step (argument parsing, translation, grounding...).
+
+    It does nothing until install is called, so it can be left in place at no cost.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        # CPU time consumed before xclingo started to run (interpreter startup)
+        self.interpreter_cpu = time.process_time()
+        self.start = time.perf_counter()
+        self.imports = []  # [depth, name, inclusive seconds, self seconds], in import order
+        self.steps = []  # (name, seconds)
+        self._depth = 0
+        self._original_import = None
+
+    def install(self):
+        """
+        Starts recording the imports done from now on.
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self.enabled:
+            builtins.__import__ = self._original_import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Only the first absolute import of a module actually executes it
+        if level != 0 or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        record = [self._depth, name, 0.0, 0.0]
+        self.imports.append(record)
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            self._depth -= 1
+            record[2] = time.perf_counter() - start
+
+    @contextmanager
+    def step(self, name):
+        """
+        Context manager that records the time spent in an initialisation step.
+        @param str name:
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - start))
+
+    def _compute_self_times(self):
+        # The self time of an import is its time minus the time of the imports done directly inside it
+        for i, record in enumerate(self.imports):
+            depth = record[0]
+            children = 0.0
+            for other in self.imports[i + 1:]:
+                if other[0] <= depth:
+                    break
+                if other[0] == depth + 1:
+                    children += other[2]
+            record[3] = record[2] - children
+
+    def report(self, out=sys.stderr):
+        """
+        Writes the startup report.
+        @param out: file object where the report is written.
+        """
+        if not self.enabled:
+            return
+        self._compute_self_times()
+
+        out.write("Startup profile\n")
+        out.write("  interpreter startup (cpu): {:10.1f} ms\n".format(self.interpreter_cpu * 1000))
+        out.write("  {:>10} | {:>10} | module\n".format("self [ms]", "total [ms]"))
+        for depth, name, inclusive, own in self.imports:
+            out.write("  {:10.2f} | {:10.2f} | {}{}\n".format(own * 1000, inclusive * 1000, "  " * depth, name))
+
+        out.write("  {:>10} | step\n".format("[ms]"))
+        for name, seconds in self.steps:
+            out.write("  {:10.2f} | {}\n".format(seconds * 1000, name))
+        out.write("  {:10.2f} | total until now\n".format((time.perf_counter() - self.start) * 1000))
+        out.flush()
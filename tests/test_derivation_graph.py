@@ -0,0 +1,117 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from derivation_graph import DerivationGraph
+from explanation import ExplanationEngine
+
+
+def _graph(rules):
+    """
+    @param List[tuple] rules: (fired id, head, labels, body) of each rule, with the atoms as strings.
+    @return DerivationGraph:
+    """
+    graph = DerivationGraph()
+    for fired_id, head, labels, body in rules:
+        graph.add_cause(fired_id, head, labels, body)
+    return graph
+
+
+def _hashes(rules):
+    """
+    @return Dict[str, bytes]: the cone hash of each atom of the graph of the given rules.
+    """
+    graph = _graph(rules)
+    return {graph.symbol(atom_id): cone for atom_id, cone in enumerate(graph.cone_hashes())}
+
+
+CHAIN = [
+    (1, "d", ["d"], []),
+    (2, "c", ["c"], ["d"]),
+    (3, "b", [], ["c"]),
+    (4, "a", ["a"], ["b"]),
+]
+
+# a and b derive each other, and c is derived from both of them
+CYCLE = [
+    (1, "f", ["f"], []),
+    (2, "a", ["a"], ["f"]),
+    (3, "a", ["a again"], ["b"]),
+    (4, "b", ["b"], ["a"]),
+    (5, "c", ["c"], ["a", "b"]),
+]
+
+
+class ConeHashTest(unittest.TestCase):
+
+    def test_equal_cones_in_different_graphs(self):
+        hashes = _hashes(CHAIN)
+        # Other atoms, and another order of the rules of different atoms
+        other = _hashes([(7, "x", ["x"], ["c"]), CHAIN[2], (8, "y", [], [])] + CHAIN[:2] + [CHAIN[3]])
+        for atom in "abcd":
+            self.assertEqual(hashes[atom], other[atom])
+        self.assertEqual(len(set(hashes.values())), 4)
+
+    def test_change_deep_in_the_cone(self):
+        hashes = _hashes(CHAIN)
+        changes = [
+            [(1, "d", ["changed"], [])] + CHAIN[1:],  # labels
+            [(9, "d", ["d"], [])] + CHAIN[1:],  # rule
+            CHAIN + [(5, "d", ["d"], [])],  # another rule
+            [CHAIN[0], (2, "c", ["c"], ["d", "e"]), (6, "e", [], [])] + CHAIN[2:],  # body
+        ]
+        for rules in changes:
+            changed = _hashes(rules)
+            for atom in "abc":
+                self.assertNotEqual(hashes[atom], changed[atom])
+
+    def test_order_of_the_rules_of_an_atom(self):
+        # It is the order of the explanations
+        rules = CHAIN + [(5, "b", ["b"], ["d"])]
+        swapped = CHAIN[:2] + [rules[4], CHAIN[2], CHAIN[3]]
+        self.assertNotEqual(_hashes(rules)["a"], _hashes(swapped)["a"])
+
+    def test_cyclic_component(self):
+        hashes = _hashes(CYCLE)
+        self.assertNotEqual(hashes["a"], hashes["b"])
+        # The atoms of the component get the same hashes whatever the order in which they were added
+        reordered = _hashes([CYCLE[4], CYCLE[3], CYCLE[0], CYCLE[1], CYCLE[2]])
+        self.assertEqual(hashes, reordered)
+
+        # A change in any atom of the component changes the hashes of all of them (and of the atoms above)
+        changed = _hashes(CYCLE[:3] + [(4, "b", ["changed"], ["a"]), CYCLE[4]])
+        for atom in "abc":
+            self.assertNotEqual(hashes[atom], changed[atom])
+        self.assertEqual(hashes["f"], changed["f"])
+
+    def test_equal_hashes_have_equal_explanations(self):
+        rnd = random.Random(0)
+
+        def random_rules(heads, n):
+            return [(rnd.randint(1, 3), rnd.choice(heads), rnd.sample(["x", "y"], rnd.randint(0, 2)),
+                     rnd.sample("abcdef", rnd.randint(0, 2))) for _ in range(n)]
+
+        equal = 0
+        for _ in range(300):
+            rules = random_rules("abcde", rnd.randint(1, 8))
+            # Another graph where only the cones that reach f change, with the atoms in another order (the rules of
+            # each atom keep theirs)
+            other = sorted(rules + random_rules("f", rnd.randint(1, 2)), key=lambda rule: rule[1], reverse=True)
+
+            explanations = []
+            for graph in (_graph(rules), _graph(other)):
+                engine = ExplanationEngine(graph)
+                explanations.append({graph.symbol(atom_id): (cone, [e.canonical for e in engine.explain(atom_id)])
+                                     for atom_id, cone in enumerate(graph.cone_hashes())})
+            for atom, (cone, explained) in explanations[0].items():
+                if atom in explanations[1] and explanations[1][atom][0] == cone:
+                    equal += 1
+                    self.assertEqual(explanations[1][atom][1], explained)
+        self.assertGreater(equal, 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
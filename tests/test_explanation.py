@@ -0,0 +1,202 @@
+import os
+import random
+import sys
+import unittest
+from itertools import product
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from derivation_graph import DerivationGraph
+from explanation import ExplanationCounter, ExplanationEngine, RankedExplanations, explanation_node
+
+ATOMS = "abcdef"
+
+
+def _graph(rules):
+    """
+    @param List[tuple] rules: (head, labels, body) or (head, labels, body, weight) of each rule, with the atoms as
+    strings.
+    @return DerivationGraph:
+    """
+    graph = DerivationGraph()
+    for fired_id, rule in enumerate(rules):
+        graph.add_cause(fired_id, *rule)
+    return graph
+
+
+def _random_rules(rnd, n_rules, labels="xyz"):
+    """
+    Rules over ATOMS, with cycles and with the same labels in different rules.
+    """
+    rules = []
+    for _ in range(n_rules):
+        body = rnd.sample(ATOMS, rnd.choice([0, 1, 1, 2, 2, 3]))
+        rules.append((rnd.choice(ATOMS), rnd.sample(labels, min(len(labels), rnd.choice([0, 1, 1, 2]))), body,
+                      rnd.choice([None, 0, 1, 2, 3])))
+    return rules
+
+
+class ExplanationCounterTest(unittest.TestCase):
+
+    def _check(self, rules):
+        graph = _graph(rules)
+        engine = ExplanationEngine(graph)
+        counter = ExplanationCounter(ExplanationEngine(graph))
+        for atom_id in range(len(graph.symbols)):
+            self.assertEqual(counter.count(atom_id), len(engine.explain(atom_id)), (graph.symbol(atom_id), rules))
+
+    def test_label_collisions(self):
+        # Two derivations of b build the same explanation, and so do the combinations of the bodies of a
+        self._check([
+            ("f", ["x"], []),
+            ("g", ["x"], []),
+            ("b", [], ["f"]),
+            ("b", [], ["g"]),
+            ("b", ["y"], ["f", "g"]),
+            ("a", ["z"], ["b", "f"]),
+            ("a", ["z"], ["g", "b"]),
+        ])
+
+    def test_cycle(self):
+        self._check([
+            ("f", ["f"], []),
+            ("a", ["a"], ["f"]),
+            ("a", ["a"], ["b"]),
+            ("b", ["b"], ["a"]),
+            ("b", ["f"], ["c"]),
+            ("c", [], ["a", "b"]),
+            ("d", ["d"], ["c", "a"]),
+        ])
+
+    def test_random_graphs(self):
+        rnd = random.Random(0)
+        for _ in range(1000):
+            self._check(_random_rules(rnd, rnd.randint(1, 8)))
+
+    def test_random_graphs_with_one_label(self):
+        # Most of the explanations collide
+        rnd = random.Random(1)
+        for _ in range(500):
+            self._check(_random_rules(rnd, rnd.randint(1, 10), "x"))
+
+
+def _all_costs(graph, rank_by):
+    """
+    Exhaustive version of RankedExplanations: every combination of every rule is built.
+    @return function: function that returns, for an atom id, a dict with the lowest cost of each explanation of the
+    atom (by canonical form), together with the explanation.
+    """
+    component, cyclic = graph.strongly_connected_components()
+    results = {}
+
+    def child_key(key, body_atom):
+        atom_id, visited = key
+        if visited is not None and component[body_atom] == component[atom_id]:
+            return None if body_atom in visited else (body_atom, visited | {body_atom})
+        return body_atom, frozenset([body_atom]) if cyclic[component[body_atom]] else None
+
+    def costs(key):
+        if key in results:
+            return results[key]
+        result = {}
+        for rule in graph.rules(key[0]):
+            body = graph.body(rule)
+            children = [c for c in (child_key(key, a) for a in body) if c is not None]
+            if body and not children:
+                continue
+            # Only the non empty explanations of the body atoms take part in the combinations
+            factors = [[item for item in costs(c).values() if item[1]] for c in children]
+            factors = [f for f in factors if f]
+            for label in graph.labels(rule) or [None]:
+                for combination in product(*factors):
+                    merged = {}
+                    for _, explanation in combination:
+                        for node in explanation.children:
+                            merged[node.label] = node
+                    children_nodes = tuple(merged.values())
+                    combination_costs = [cost for cost, _ in combination]
+                    if rank_by == "depth":
+                        cost = max(combination_costs, default=0)
+                    else:
+                        cost = sum(combination_costs)
+                    if label is not None:
+                        children_nodes = (explanation_node(label, children_nodes),)
+                        weight = graph.weight(rule)
+                        cost += weight if rank_by == "weight" and weight is not None else 1
+                    explanation = explanation_node(None, children_nodes)
+                    known = result.get(explanation.canonical)
+                    if known is None or cost < known[0]:
+                        result[explanation.canonical] = (cost, explanation)
+        results[key] = result
+        return result
+
+    return lambda atom_id: costs((atom_id, frozenset([atom_id]) if cyclic[component[atom_id]] else None))
+
+
+class RankedExplanationsTest(unittest.TestCase):
+
+    def _check(self, rules, rank_by):
+        graph = _graph(rules)
+        all_costs = _all_costs(graph, rank_by)
+        engine = ExplanationEngine(graph)
+        ranked = RankedExplanations(ExplanationEngine(graph), rank_by)
+        for atom_id in range(len(graph.symbols)):
+            expected = all_costs(atom_id)
+            # The same explanations as the engine
+            self.assertEqual(set(expected), {e.canonical for e in engine.explain(atom_id)})
+
+            for k in range(1, len(expected) + 2):
+                best = ranked.best(atom_id, k)
+                # Equal costs can come in any order, but each explanation with its lowest cost
+                self.assertEqual([cost for cost, _ in best], sorted(cost for cost, _ in expected.values())[:k])
+                self.assertEqual(len({e.canonical for _, e in best}), len(best))
+                for cost, explanation in best:
+                    self.assertEqual(expected[explanation.canonical][0], cost, rules)
+
+    def test_ties(self):
+        rules = [
+            ("f", ["x"], []),
+            ("g", ["y"], []),
+            ("a", ["a"], ["f"]),
+            ("a", ["a"], ["g"]),
+            ("a", ["b"], ["f", "g"], 0),
+        ]
+        for rank_by in RankedExplanations.COSTS:
+            self._check(rules, rank_by)
+        ranked = RankedExplanations(ExplanationEngine(_graph(rules)), "size")
+        self.assertEqual([cost for cost, _ in ranked.best(_graph(rules).id_of("a"), 3)], [2, 2, 3])
+
+    def test_cheapest_derivation_of_an_explanation(self):
+        # The explanation {a: {x}} has a derivation of weight 5 and another one of weight 1
+        rules = [
+            ("f", ["x"], [], 0),
+            ("g", [], ["f"]),
+            ("a", ["a"], ["f"], 5),
+            ("a", ["a"], ["g"], 1),
+        ]
+        graph = _graph(rules)
+        best = RankedExplanations(ExplanationEngine(graph), "weight").best(graph.id_of("a"), 2)
+        self.assertEqual([cost for cost, _ in best], [1])
+
+    def test_cycle(self):
+        rules = [
+            ("f", ["f"], []),
+            ("a", ["a"], ["f"]),
+            ("a", ["a"], ["b"], 3),
+            ("b", ["b"], ["a"], 0),
+            ("b", ["g"], ["c"]),
+            ("c", [], ["a", "b"]),
+        ]
+        for rank_by in RankedExplanations.COSTS:
+            self._check(rules, rank_by)
+
+    def test_random_graphs(self):
+        rnd = random.Random(2)
+        for _ in range(300):
+            rules = _random_rules(rnd, rnd.randint(1, 8))
+            for rank_by in RankedExplanations.COSTS:
+                self._check(rules, rank_by)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+import io
+import os
+import sys
+import unittest
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import clingo
+except ImportError:
+    clingo = None
+
+# The translation uses the AST API of clingo 5.4 (clingo.parse_program was removed in 5.5)
+CLINGO_5_4 = clingo is not None and clingo.__version__.startswith("5.4.")
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples", "diag_example")
+
+# The actions are the input of the program, so the batches can add new ones
+EXTERNAL = "#external o(toggle(s1), T) : time(T).\n"
+
+# Toggles s1 again, so the rules of relay.lp must fire for the new fact
+BATCH = "o(toggle(s1), 7).\n"
+
+# Rules that use the atoms of the program, without deriving any atom used by it
+RULES_BATCH = """
+%!trace_rule {"s1 was toggled late, at %",T}
+late(T) :- o(toggle(s1), T), T > 4.
+%!show_trace late(T).
+"""
+
+
+def _read(name):
+    with open(os.path.join(EXAMPLES, name)) as example:
+        return example.read()
+
+
+@unittest.skipUnless(CLINGO_5_4, "clingo 5.4 is not installed")
+class BatchTest(unittest.TestCase):
+
+    def _options(self):
+        import xclingo
+        return xclingo.ExplainOptions("none", "none", 0, 0, 1, "ascii", None, False, False, None, 1)
+
+    def _prepare(self, program):
+        import translation
+        with redirect_stdout(io.StringIO()):
+            control = translation.prepare_xclingo_program(["-n 0", "--project"], program, "none")
+        control.ground([("base", [])])
+        return control
+
+    def _explain(self, control, reuse=None):
+        import xclingo
+        out = io.StringIO()
+        xclingo.explain_answer_sets(control, xclingo.build_labels_dict(control), self._options(), out, reuse)
+        return out.getvalue()
+
+    def _check_batch(self, batch):
+        import incremental
+
+        program = _read("relay.lp") + _read("story1.lp") + EXTERNAL
+        control = self._prepare(program)
+        reuse = incremental.ExplanationReuse()
+        before = self._explain(control, reuse)
+
+        incremental.add_batch(control, "batch", batch)
+        after = self._explain(control, reuse)
+
+        self.assertEqual(after, self._explain(self._prepare(program + batch)))
+        self.assertNotEqual(after, before)
+        return after
+
+    def test_external_facts_are_explained_as_the_whole_program(self):
+        self.assertIn("The agent toggled s1 at 7", self._check_batch(BATCH))
+
+    def test_rules_over_the_atoms_of_the_program(self):
+        self.assertIn("s1 was toggled late, at 5", self._check_batch(RULES_BATCH))
+
+    def test_batch_that_feeds_the_grounded_rules(self):
+        import incremental
+
+        control = self._prepare(_read("relay.lp") + _read("story1.lp"))
+        # o/2 is not declared with #external, so the grounded rules would not fire for it
+        with self.assertRaises(ValueError):
+            incremental.add_batch(control, "batch", BATCH)
+        with self.assertRaises(ValueError):
+            incremental.add_batch(control, "batch", "h(s1, closed, 7) :- o(toggle(s1), 5).\n")
+
+
+# One answer set explains a and b, the other one only a (with the same derivation)
+CHOICE = """
+%!trace_rule {"a"}
+a.
+{c}.
+%!trace_rule {"b"}
+b :- c.
+%!show_trace a.
+%!show_trace b.
+"""
+
+
+@unittest.skipUnless(CLINGO_5_4, "clingo 5.4 is not installed")
+class ReuseTest(unittest.TestCase):
+
+    def _explain(self, reuse, atom_jobs):
+        import translation
+        import xclingo
+
+        with redirect_stdout(io.StringIO()):
+            control = translation.prepare_xclingo_program(["-n 0", "--project"], CHOICE, "none")
+        control.ground([("base", [])])
+        options = xclingo.ExplainOptions("none", "none", 0, 0, atom_jobs, "ascii", None, False, False, None, 1)
+        out = io.StringIO()
+        xclingo.explain_answer_sets(control, xclingo.build_labels_dict(control), options, out, reuse)
+        return out.getvalue()
+
+    def test_atoms_explained_by_workers_are_reused_serially(self):
+        import incremental
+
+        expected = self._explain(None, 1)
+        self.assertIn(">> b", expected)
+        for reuse in (incremental.ExplanationReuse(), incremental.ExplanationCache(10)):
+            # The serial path must not receive trees rendered by the workers, nor the other way round
+            self.assertEqual(self._explain(reuse, 2), expected)
+
+
+def _graph(rules):
+    from derivation_graph import DerivationGraph
+    graph = DerivationGraph()
+    for fired_id, head, labels, body in rules:
+        graph.add_cause(fired_id, head, labels, body)
+    return graph
+
+
+@unittest.skipUnless(CLINGO_5_4, "clingo 5.4 is not installed")
+class ExplanationReuseTest(unittest.TestCase):
+
+    # d does not depend on the other atoms, and c depends on a through b
+    RULES = [(1, "a", ["a"], []), (2, "b", ["b"], ["a"]), (3, "c", ["c"], ["b"]), (4, "d", ["d"], [])]
+
+    def _model(self, reuse, rules):
+        from labels import LabelIndex, ModelLabels
+
+        # The fired values of a rule instance are its head and its body
+        fired_values = {fired_id: [(head,) + tuple(body)] for fired_id, head, _, body in rules}
+        plans = {fired_id: SimpleNamespace(bind_head=lambda values: values[0]) for fired_id in fired_values}
+        reuse.begin(fired_values, plans, LabelIndex(), ModelLabels({}, {}, {}))
+        reuse.update(_graph(rules))
+
+    def test_atoms_whose_derivations_did_not_change_are_reused(self):
+        import incremental
+
+        reuse = incremental.ExplanationReuse()
+        self._model(reuse, self.RULES)
+        self.assertEqual(reuse.missing(["a", "b", "c", "d"]), ["a", "b", "c", "d"])
+        for atom in "abcd":
+            reuse.put(atom, [atom])
+
+        # b is derived from d instead of a, so b and c are explained again
+        self._model(reuse, self.RULES[:1] + [(2, "b", ["b"], ["d"])] + self.RULES[2:])
+        self.assertEqual(reuse.missing(["a", "b", "c", "d"]), ["b", "c"])
+        self.assertEqual(reuse.get("a"), ["a"])
+        self.assertEqual(reuse.get("d"), ["d"])
+        self.assertIsNone(reuse.get("c"))
+
+
+@unittest.skipUnless(CLINGO_5_4, "clingo 5.4 is not installed")
+class ExplanationCacheTest(unittest.TestCase):
+
+    RULES = [(1, "a", ["a"], []), (2, "b", ["b"], ["a"]), (3, "c", ["c"], ["b"])]
+
+    def test_equal_cones_are_reused(self):
+        import incremental
+
+        cache = incremental.ExplanationCache(10)
+        cache.update(_graph(self.RULES))
+        self.assertEqual(cache.missing(["a", "b", "c"]), ["a", "b", "c"])
+        for atom in "abc":
+            cache.put(atom, [atom])
+            self.assertFalse(cache.reused(atom))
+
+        # c changes, but not the cones of a and b
+        cache.update(_graph([(4, "x", [], [])] + self.RULES[:2] + [(3, "c", ["changed"], ["b"])]))
+        self.assertEqual(cache.missing(["a", "b", "c", "x"]), ["c", "x"])
+        self.assertEqual(cache.get("b"), ["b"])
+        self.assertTrue(cache.reused("b"))
+        self.assertIsNone(cache.get("c"))
+
+        cache.put_rendered("b", ["tree of b"])
+        self.assertEqual(cache.get_rendered("b"), ["tree of b"])
+        self.assertIsNone(cache.get_rendered("a"))
+
+    def test_least_recently_used_are_evicted(self):
+        import incremental
+
+        cache = incremental.ExplanationCache(2)
+        cache.update(_graph(self.RULES))
+        cache.put("a", ["a"])
+        cache.put("b", ["b"])
+        self.assertEqual(cache.get("a"), ["a"])  # Now b is the least recently used
+        cache.put("c", ["c"])
+        self.assertEqual(cache.missing(["a", "b", "c"]), ["b"])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), ["c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import instrumentation
+from instrumentation import Stats
+
+# 64 MiB, well above the memory the interpreter allocates while the phases run
+SIZE_KB = 64 * 1024
+
+
+def _touch(size_kb):
+    """
+    Allocates (and writes, so they are resident) size_kb KiB and frees them.
+    """
+    memory = bytearray(size_kb * 1024)
+    for i in range(0, len(memory), 4096):
+        memory[i] = 1
+    del memory
+
+
+@unittest.skipUnless(instrumentation._reset_peak_rss(), "the peak memory of the process can not be reset")
+class PeakMemoryTest(unittest.TestCase):
+
+    def test_peak_of_each_phase(self):
+        stats = Stats()
+        stats.enable()
+        with stats.phase("outer"):
+            _touch(2 * SIZE_KB)
+            with stats.phase("inner"):
+                pass
+            with stats.model(1):
+                _touch(SIZE_KB)
+        with stats.phase("after"):
+            pass
+
+        phases = stats.as_dict()["phases"]
+        # The peak of a phase includes the phases that it contains, but not the ones before it
+        self.assertGreater(phases["outer"]["peak_rss_kb"], 2 * SIZE_KB)
+        self.assertLess(phases["inner"]["peak_rss_kb"], SIZE_KB)
+        self.assertLess(phases["after"]["peak_rss_kb"], SIZE_KB)
+        peak = stats.models[0]["peak_rss_kb"]
+        self.assertGreater(peak, SIZE_KB)
+        self.assertLess(peak, 2 * SIZE_KB)
+        # The peak of the process is kept across the resets
+        self.assertGreaterEqual(phases["after"]["process_peak_rss_kb"], phases["outer"]["peak_rss_kb"])
+
+    def test_reports(self):
+        stats = Stats()
+        stats.enable()
+        with stats.model(1):
+            pass
+        out = io.StringIO()
+        stats.report(out, "json")
+        self.assertIsNotNone(json.loads(out.getvalue())["models"][0]["peak_rss_kb"])
+        out = io.StringIO()
+        stats.report(out)
+        self.assertIn("peak [KiB]", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from magic_comments import translate_magic_comments
+
+
+def _translate(program):
+    """
+    @param str program:
+    @return (str, bool, str): the rewritten program, whether it has %!show_trace annotations and the warnings.
+    """
+    out = io.StringIO()
+    warnings = io.StringIO()
+    have_explain = translate_magic_comments([("test.lp", program.splitlines(True))], out, warnings)
+    return out.getvalue(), have_explain, warnings.getvalue()
+
+
+class TraceRuleTest(unittest.TestCase):
+
+    def test_strings_with_comment_and_period_characters(self):
+        program = '%!trace_rule {"50% of %.", X}\np(X) :- q(X, "a.b % c").\n'
+        self.assertEqual(_translate(program), ('p(X) :- q(X, "a.b % c"), &trace{"50% of %.", X}.\n\n', False, ""))
+
+    def test_multi_line_rule_with_comments(self):
+        program = '%!trace_rule {"r",X}\np(X) :-\n    q(X), % a comment . with a period\n    r(X, "x.y").\nz.\n'
+        self.assertEqual(_translate(program)[0],
+                         'p(X) :- q(X), % a comment . with a period\n    r(X, "x.y"), &trace{"r",X}.\n\nz.\n')
+
+    def test_string_across_lines(self):
+        program = '%!trace_rule {"r"}\np(X) :- q(X, "multi\nline. string").\n'
+        self.assertEqual(_translate(program)[0], 'p(X) :- q(X, "multi\nline. string"), &trace{"r"}.\n\n')
+
+    def test_interval_is_not_the_end_of_the_rule(self):
+        program = '%!trace_rule {"r"}\np(X) :- X = 1..3.\n'
+        self.assertEqual(_translate(program)[0], 'p(X) :- X = 1..3, &trace{"r"}.\n\n')
+
+    def test_long_rule(self):
+        body = ["  q{},\n".format(i) for i in range(5000)]
+        out, _, _ = _translate('%!trace_rule {"r"}\np :-\n' + "".join(body) + "  r.\nz.\n")
+        self.assertTrue(out.startswith("p :- q0,\n"))
+        self.assertTrue(out.endswith("  q4999,\n  r, &trace{\"r\"}.\n\nz.\n"))
+
+    def test_rule_that_does_not_end(self):
+        out, _, warnings = _translate('%!trace_rule {"r"}\np(X) :- q(X)\n%!trace {"x"} a.\n')
+        self.assertTrue(out.startswith('%!trace_rule {"r"}\np(X) :- q(X)\n'))
+        self.assertIn("test.lp:1: malformed %!trace_rule annotation", warnings)
+
+
+class TraceTest(unittest.TestCase):
+
+    def test_trace_with_strings(self):
+        program = '%!trace {"a.b %",X} p(X) : q(X, "1.0").\n'
+        self.assertEqual(_translate(program), ('&trace_all{p(X),"a.b %",X : } :- p(X),q(X, "1.0").\n\n', False, ""))
+
+    def test_show_trace_keeps_the_rest_of_the_line_commented(self):
+        program = '%!show_trace p(X) : q(X, "%."). % note\n'
+        self.assertEqual(_translate(program), ('show_all_p(X):-p(X),q(X, "%."). % note\n', True, ""))
+
+    def test_annotation_inside_a_string_is_not_translated(self):
+        program = 'a("%!trace_rule {x}"). % ok\n'
+        self.assertEqual(_translate(program), (program, False, ""))
+
+
+if __name__ == "__main__":
+    unittest.main()
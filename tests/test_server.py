@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import clingo
+except ImportError:
+    clingo = None
+
+# The translation uses the AST API of clingo 5.4 (clingo.parse_program was removed in 5.5)
+CLINGO_5_4 = clingo is not None and clingo.__version__.startswith("5.4.")
+
+PROGRAM = """
+%!trace_rule {"a, since b"}
+a :- b.
+%!trace {"b was given"} b.
+%!show_trace a.
+"""
+
+
+def _serve_or_die(request):
+    # Runs in the worker instead of server._serve_request
+    if request.get("die"):
+        os._exit(1)
+    import server
+    return server._record({"type": "done", "id": request.get("id")})
+
+
+@unittest.skipUnless(CLINGO_5_4, "clingo 5.4 is not installed")
+class UnixServerTest(unittest.TestCase):
+
+    def setUp(self):
+        import server
+        import xclingo
+
+        self.directory = tempfile.mkdtemp()
+        program = os.path.join(self.directory, "program.lp")
+        with open(program, "w") as program_file:
+            program_file.write(PROGRAM)
+
+        options = xclingo.ExplainOptions("none", "none", 0, 0, 1, "ndjson", None, False, False, None, 1)
+        self.path = os.path.join(self.directory, "xclingo.sock")
+        self.server = server.UnixExplanationServer(self.path, server._RequestHandler)
+        # A single slot, so a slot that is not released rejects the next request
+        self.server.setup_pool(server.load_programs(["p=" + program]), options, 1, 0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.pool.shutdown()
+        shutil.rmtree(self.directory)
+
+    def _ask(self, payload):
+        """
+        @param payload: a request or a list of requests.
+        @return List[Dict]: the records of the responses.
+        """
+        with socket.socket(socket.AF_UNIX) as connection:
+            connection.connect(self.path)
+            connection.sendall((json.dumps(payload) + "\n").encode())
+            connection.shutdown(socket.SHUT_WR)
+            return [json.loads(line) for line in connection.makefile() if line.strip()]
+
+    def test_round_trip(self):
+        records = self._ask({"id": 1, "program": "p", "facts": "b."})
+        self.assertEqual(records[0], {"type": "model", "answer": 1})
+        self.assertEqual([r["atom"] for r in records if r["type"] == "atom"], ["a"])
+        self.assertIn("a, since b", [r["label"] for r in records if r["type"] == "node"])
+        self.assertEqual(records[-1], {"type": "done", "id": 1})
+
+        records = self._ask({"id": 2, "program": "q"})
+        self.assertEqual(records, [{"type": "error", "id": 2, "message": "unknown program: q"}])
+
+    def test_dead_worker(self):
+        with mock.patch("server._serve_request", _serve_or_die):
+            records = self._ask({"id": 1, "die": True})
+            self.assertEqual(len(records), 1)
+            self.assertEqual(records[0]["type"], "error")
+            self.assertTrue(records[0]["message"].startswith("internal error"))
+
+            # The pool is replaced and the slot of the request is released
+            for request_id in range(2, 5):
+                self.assertEqual(self._ask({"id": request_id}), [{"type": "done", "id": request_id}])
+
+
+if __name__ == "__main__":
+    unittest.main()
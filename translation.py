@@ -1,9 +1,16 @@
-from collections import Iterable
+from clingo import Control, Function, Number, parse_program, parse_term, ast
+import io
+from clingo_utilities import add_prefix, body_variables, classify_rule, get_function
+from binding import compile_traces
+from instrumentation import stats
+import translation_cache
+from magic_comments import translate_magic_comments
 
-from clingo import Control, parse_program, ast
-import re
-from more_itertools import unique_everseen
-from clingo_utilities import body_variables
+
+class TranslationError(ValueError):
+    """
+    A rule generated by the translation was not accepted by clingo.
+    """
 
 
 class XClingoProgramControl(Control):
@@ -12,419 +19,560 @@ class XClingoProgramControl(Control):
     """
     _rule_counter = None
     traces = None
+    binding_plans = None
+    fired_names = None
     have_explain = None
+    externals = None
+    translated_rules = None
+    shown_signatures = None
+    body_signatures = None
 
     def __init__(self, *args):
         self.rule_counter = 0
         self.traces = {}
+        self.binding_plans = {}
+        self.fired_names = {}
         self.have_explain = False
+        self.externals = {}  # (name, arity, positive) of the external atoms -> ids of their #external declarations
+        self.translated_rules = None  # List of the generated rules (only recorded if it is a list)
+        self.shown_signatures = set()  # (name, arity) shown in the models (None to show every atom)
+        self.body_signatures = set()  # (name, arity) of the atoms in the bodies of the rules (see translate_part)
         super().__init__(*args)
 
     def count_rule(self):
+        """
+        Returns a new rule id and registers the name of its 'fired' atoms.
+        @return int:
+        """
         current = self.rule_counter
         self.rule_counter += 1
+        self.fired_names["fired_" + str(current)] = current
         return current
 
 
-class XClingoAST():
-    _internal_ast = None  # Type: ast.AST
-    type = None  # Type: ast.AST.ASTType
-    child_keys = None  # Type: List [ str ]
-
-    # l =[method for method in dir(my_ast) if method != 'use_enumeration_assumption' and callable(getattr(my_ast, method))]
-
-    def __init__(self, base_ast):
-        """
-
-        @param ast.AST base_ast:
-        """
-        self._internal_ast = base_ast
-
-        self.type = base_ast.type
-        self.child_keys = base_ast.child_keys
-
-    """ast.AST methods"""
-    def items(self):
-        return self._internal_ast.items()
-
-    def keys(self):
-        return self._internal_ast.keys()
-
-    def values(self):
-        return self._internal_ast.values()
-
-    """container methods and other"""
-    def __contains__(self, item):
-        return self._internal_ast.__contains__(item)
-
-    def __getitem__(self, item):
-        item = self._internal_ast.__getitem__(item)
-        if type(item) == ast.AST:
-            return XClingoAST(item)
-        if type(item) == list:
-            new_list = []
-            for i in item:
-                if type(i) == ast.AST:
-                    new_list.append(XClingoAST(i))
-                else:
-                    new_list.append(i)
-            return new_list
-        else:
-            return item
-
-    def __delattr__(self, item):
-        self._internal_ast.__delattr__(item)
-
-    def __delitem__(self, key):
-        self._internal_ast.__delitem__(key)
-
-    def __eq__(self, other):
-        return self._internal_ast.__eq__(other)
-
-    def __format__(self, format_spec):
-        return self._internal_ast.__format__(format_spec)
-
-    def __ge__(self, other):
-        return self._internal_ast.__ge__(other)
-
-    # def __getattribute__(self, item):
-    #     return self._internal_ast.__getattribute__(item)
-
-    def __gt__(self, other):
-        return self._internal_ast.__gt__(other)
-
-    def __iter__(self):
-        return self._internal_ast.__iter__()
-
-    def __le__(self, other):
-        return self._internal_ast.__le__()
-
-    def __len__(self):
-        return self._internal_ast.__len__()
-
-    def __lt__(self, other):
-        return self._internal_ast.__lt__()
-
-    def __ne__(self, other):
-        return self._internal_ast.__ne__()
-
-    # def __setattr__(self, key, value):
-    #     self._internal_ast.__setattr__(key, value)
-
-    def __setitem__(self, key, value):
-        self._internal_ast.__setitem__(key, value)
-
-    def __str__(self):
-        return self._internal_ast.__str__()
-
-    """XclingoAST methods"""
-
-    def is_constraint(self):
-        """
-        @return bool: True if the rule is a constraint, False if not.
-        """
-        return self['head']['atom'].type == ast.ASTType.BooleanConstant and self['head']['atom']['value'] == False
-
-    def is_trace_all_rule(self):
-        """
-        @return bool: True if the rule is an instance of a xclingo trace_all rule, False if not.
-        """
-        return self['head'].type == ast.ASTType.TheoryAtom and self['head']['term']['name'] == "trace_all"
-
-    def is_show_all_rule(self):
-        """
-        @return bool: True if the rule is an instance of a xclingo show_all rule, False if not.
-        """
-        return str(self['head']).startswith("show_all_") or str(self['head']).startswith("nshow_all_")
-
-    def add_prefix(self, prefix):
-        """
-        It will try to add a prefix to this AST. It can raise an exception if the action has no sense (this depends on
-        the type of the AST). If the ast is Rule type, then the prefix will be added only to the atoms in the body if it
-        has a body, or only to the atom in the head in the other case.
+def _separate_labels_from_body(body_asts):
+    """
+    Divides the given body (list of clingo.rule_ast) into label theory atoms, weight theory atoms and the rest.
+    @param List[clingo.rule_ast.AST] body_asts:
+    @return (label_body, weight_body, rest): tuple containing the list of label (&trace) theory atoms, the list of
+    weight (&trace_weight) theory atoms and the rest (respectively).
+    """
+    label_body = []
+    weight_body = []
+    rest = []
 
-        @param str prefix: the prefix that is intended to be added to the AST.
-        @return None:
-        """
-        # Rules special case
-        if self.type == ast.ASTType.Rule:
-            # Rules with body
-            if self['body']:
-                # Adds the prefix to all the asts in the body but not to the head
-                for b_ast in self['body']:
-                    b_ast.add_prefix(prefix)
-                return
-            # Facts (rules without body)
+    for b_ast in body_asts:
+        if b_ast.type == ast.ASTType.Literal and b_ast['atom'].type == ast.ASTType.TheoryAtom:
+            if b_ast['atom']['term']['name'] == "trace_weight":
+                weight_body.append(b_ast)
             else:
-                # Adds the prefix to the ast of the head
-                self['head'].add_prefix(prefix)
+                label_body.append(b_ast)
         else:
-            fun = self.get_function()
-            if fun:
-                fun['name'] = prefix + fun['name']
-
-    def get_function(self):
-        """
-        If the AST has a unique function inside of it (some types as Comparison can have multiple functions) then it
-        will return it.
-        @return XClingoAST: the function inside of the ast.
-        """
-        if self.type in (ast.ASTType.Function, ast.ASTType.TheoryFunction):
-            return self
-
-        if self.type == ast.ASTType.SymbolicAtom:
-            return self['term'].get_function()
+            rest.append(b_ast)
 
-        if self.type == ast.ASTType.UnaryOperation:
-            return self['argument'].get_function()
+    return label_body, weight_body, rest
 
-        if self.type == ast.ASTType.Literal:
-            return self['atom'].get_function()
 
-        if self.type in (ast.ASTType.Comparison, ast.ASTType.BooleanConstant):
-            return None
-
-        print(self)
-        print(self.type)
-        raise RuntimeError(str(self.type) + "  do not have Function.")
-
-
-def _translate_trace(program):
+def _theory_term(term):
     """
-    Replaces the 'label_rule' magic comments in the given program for a version of the rules labelled with theory atoms.
-    @param str program: the program that is intended to be modified.
-    @return str:
+    Builds the theory term (as the parser would do for a theory atom) of a term.
+    @param ast.AST term:
+    @return ast.AST: the theory term.
     """
-                         # (%!trace \{(.*)\}[ ]*\n[ ]*(\-?[a-z][a-zA-Z]*(?:\((?:[\-a-zA-Z0-9+ \(\)\,\_])+\))?(?:[ ]*:-[ ]*.*)?).)
-    for hit in re.findall("(%!trace_rule \{(.*)\}[ ]*[\n ]*(\-?[_a-z][_a-zA-Z]*(?:\((?:[\-a-zA-Z0-9+ \(\)\,\_])+\))?)(?:[ ]*:-[ ]*(.*))?.)", program):
-        # 0: original match  1: label parameters  2: head of the rule  3: body of the rule
-        program = program.replace(
-            hit[0],
-            "{head} :- {body} &trace{{{label_parameters}}}.\n".format(
-                head=hit[2], label_parameters=hit[1],
-                body=hit[3] + "," if hit[3] else ""
-            )
-        )
+    if term.type in (ast.ASTType.Variable, ast.ASTType.Symbol):
+        return term
 
-    return program
+    location = term['location']
+    if term.type == ast.ASTType.Function:
+        return ast.TheoryFunction(location, term['name'], [_theory_term(a) for a in term['arguments']])
 
+    if term.type == ast.ASTType.UnaryOperation and term['operator'] == ast.UnaryOperator.Minus:
+        return ast.TheoryUnparsedTerm(location, [ast.TheoryUnparsedTermElement(["-"], _theory_term(term['argument']))])
 
-def _translate_trace_all(program):
-    """
-    Replaces the 'label_atoms' magic comments in the given program for label_atoms rule.
-    @param str program: the program that is intended to be modified
-    @return str:
-    """
-    for hit in re.findall("(%!trace \{(.*)\} (\-?[_a-z][_a-zA-Z]*(?:\((?:[\-\+a-zA-Z0-9 \(\)\,\_])+\))?)(?:[ ]*:[ ]*(.*))?\.)", program):
-        # 0: original match 1: "label",v1,v2  2: head  3: body.
-        program = program.replace(
-            hit[0],
-            "&trace_all{{{head},{parameters} : }} :- {head}{rest_body}.\n".format(
-                head=hit[2], parameters=hit[1], rest_body="," + hit[3] if hit[3] else "")
-        )
+    if term.type == ast.ASTType.BinaryOperation:
+        return ast.TheoryUnparsedTerm(location, [
+            ast.TheoryUnparsedTermElement([], _theory_term(term['left'])),
+            ast.TheoryUnparsedTermElement([str(term['operator'])], _theory_term(term['right']))
+        ])
 
-    return program
+    raise RuntimeError(str(term.type) + " can not be used inside a trace.")
 
 
-def _translate_show_all(program):
+def _fired_literal(location, rule_counter, arguments):
     """
-    Replaces 'explain' magic comments in the given program for a rule version of those magic comments.
-    @param str program:
-    @return:
+    @param ast.Location location:
+    @param int rule_counter: the id of the rule.
+    @param List[ast.AST] arguments: the terms of the 'fired' atom.
+    @return ast.AST: the literal fired_<rule_counter>(<arguments>).
     """
-    for hit in re.findall("(%!show_trace ((\-)?([_a-z][_a-zA-Z]*(?:\((?:[\-a-zA-Z0-9 \(\)\,\_])+\))?)(?:[ ]*:[ ]*(.*))?\.))", program):
-        # 0: original match  1: rule  2: negative_sign  3: head of the rule  4: body of the rule
-        program = program.replace(
-            hit[0],
-            "{sign}{prefix}{head}:-{classic_negation}{head}{body}.".format(
-                sign="" if not hit[2] else "n",
-                prefix="show_all_",
-                head=hit[3],
-                classic_negation="" if not hit[2] else "-",
-                body="," + hit[4] if hit[4] else "")
-        )
-
-    return program
+    return ast.Literal(location, ast.Sign.NoSign,
+                       ast.SymbolicAtom(ast.Function(location, "fired_" + str(rule_counter), arguments, False)))
 
 
-def _separate_labels_from_body(body_asts):
+def _show_signature(location, control, name, arity):
     """
-    Divides the given body (list of clingo.rule_ast) into label theory atoms, normal literals and the rest.
-    @param List[clingo.rule_ast.AST] body_asts:
-    @return (label_body, literals, other): tuple containing the list of label theory atoms, the symbolic atoms and
-    the rest (respectively).
+    @param ast.Location location:
+    @param XClingoProgramControl control:
+    @param str name:
+    @param int arity:
+    @return List[ast.AST]: the #show directive of the signature, if the models are projected and it was not shown yet.
     """
-    label_body = []
-    rest = []
+    if control.shown_signatures is None or (name, arity) in control.shown_signatures:
+        return []
+    control.shown_signatures.add((name, arity))
+    return [ast.ShowSignature(location, name, arity, True, False)]
 
-    for b_ast in body_asts:
-        if b_ast['atom'].type == ast.ASTType.TheoryAtom:
-            label_body.append(b_ast)
-        else:
-            rest.append(XClingoAST(b_ast))
-
-    return label_body, rest
 
-
-def _add_to_base(rules_to_add, builder, t_option):
+def _record_body(control, body_asts):
     """
-    @param str rules_to_add: the rules that will be added to the base program.
-    @param clingo.ProgramBuilder builder: builder of the clingo control object that will receive the generated rules.
-    @param bool t_option: if true, the rules will not be added to the program. They will be printed by stdout instead.
+    Records the signatures of the atoms of a body (the ones that get the 'holds_' prefix) in control.body_signatures.
+    @param XClingoProgramControl control:
+    @param List[ast.AST] body_asts:
     @return None:
     """
-    if t_option:
-        print(rules_to_add)
-        return
-
-    # Adds the generated rules to the base program
-    try:
-        parse_program("#program base." + rules_to_add, lambda new_ast: builder.add(new_ast))
-    except RuntimeError as error:
-        if str(error) == "syntax error":
-            print("Translation error:\n\n{0}".format(rules_to_add))
-            exit(0)
+    for b_ast in body_asts:
+        function = get_function(b_ast)
+        if function is not None:
+            control.body_signatures.add((str(function['name']), len(function['arguments'])))
 
 
-def _translate_to_fired_holds(rule_ast, control, builder, t_option):
+def _translate_to_fired_holds(rule_ast, control, generated, t_option):
     """
-    Translate the different possible xclingo rules their clingo version making use of 'fired_' and 'holds_' prefixes,
-    then it adds them to the base program using the given builder object.
+    Translate the different possible xclingo rules their clingo version making use of 'fired_' and 'holds_' prefixes.
+    The generated rules are built directly as ASTs and appended to the given list (so they can be added to the program
+    at once).
     Also it keep trace (inside the given control object) of the rule information that is necessary for computing the
     causes after the solving phase.
 
     @param ast.AST rule_ast: the AST from which the rules will be generated
-    @param clingo.ProgramBuilder builder: builder of the clingo control object that will receive the generated rules.
+    @param XClingoProgramControl control:
+    @param List[ast.AST] generated: list that receives the generated rules.
     @param bool t_option: if enabled, the function will print the translated sentences but they will not be added to the
-    builder.
+    list.
     @return: None
     """
-    rule_ast = XClingoAST(rule_ast)
-
     if rule_ast.type == ast.ASTType.Rule:
+        location = rule_ast['location']
+        head = rule_ast['head']
+        body = rule_ast['body']
 
         # show_all rules, trace_all rules and constraints rules.
-        if rule_ast.is_show_all_rule() or rule_ast.is_trace_all_rule() or rule_ast.is_constraint():
-            if rule_ast['body']:
-                rule_ast.add_prefix("holds_")
-                translated_rule = str(rule_ast)
-            else:
-                translated_rule = str(rule_ast['head']) + "."
-
-            generated_rules = translated_rule + "\n"
+        kind = classify_rule(rule_ast)
+        if kind != "normal":
+            if body:
+                _record_body(control, body)
+                add_prefix("holds_", rule_ast)
+            rules = [rule_ast]
+            if kind == "show_all":
+                show_all = head['atom']['term']
+                rules.extend(_show_signature(location, control, show_all['name'], len(show_all['arguments'])))
+            comment = None
         else:  # Other cases
             rule_counter = control.count_rule()
 
             # Separates the &label literals in the body from the rest
-            label_body, rest_body = _separate_labels_from_body(rule_ast['body'])
+            label_body, weight_body, rest_body = _separate_labels_from_body(body)
             # Binds the function in the head to a variable to simplify following code
-            head_function = rule_ast['head'].get_function()
+            head_function = get_function(head)
+            head_arguments = head_function['arguments']
+            head_term = head['atom']['term']
 
             # Keep trace of head, arguments and body of the rules using rule_counter
-            fired_head_variables = list(map(str, head_function['arguments'])) + \
-                                   list(set(map(str, body_variables(rule_ast['body']))) - set(map(str, head_function['arguments'])))
-
+            fired_head_variables = list(map(str, head_arguments))
+            head_names = set(fired_head_variables)
+            body_variables_asts = {}
+            for v in body_variables(body):
+                name = str(v)
+                if name not in head_names:
+                    body_variables_asts.setdefault(name, v)
+            fired_head_variables += list(body_variables_asts)
+
+            body_functions = []
+            for lit in rest_body:
+                if (lit.type == ast.ASTType.Literal and lit['sign'] == ast.Sign.NoSign
+                        and lit['atom'].type == ast.ASTType.SymbolicAtom):
+                    function = get_function(lit)
+                    body_functions.append((lit['atom']['term'].type != ast.ASTType.UnaryOperation,
+                                           function['name'], function['arguments']))
 
             control.traces[rule_counter] = {
-                'head': (rule_ast['head']['atom']['term'].type != ast.ASTType.UnaryOperation,
-                         str(head_function['name']), head_function['arguments']),
+                'head': (head_term.type != ast.ASTType.UnaryOperation, str(head_function['name']), head_arguments),
                 'arguments': fired_head_variables,
                 # 'body' contains pairs of function names and arguments found in the body
-                'body': [(lit['atom']['term'].type != ast.ASTType.UnaryOperation,
-                          lit.get_function()['name'], lit.get_function()['arguments'])
-                         for lit in rest_body if
-                         lit.type == ast.ASTType.Literal and lit['atom'].type == ast.ASTType.SymbolicAtom and lit[
-                             'sign'] == ast.Sign.NoSign]
+                'body': body_functions
             }
 
             # Generates fired rule
-            fired_head = "fired_{counter}({arguments})".format(
-                counter=str(rule_counter),
-                arguments=",".join(fired_head_variables)
-            )
-
-            if rest_body:
-                for a in rest_body:
-                    a.add_prefix('holds_')
-                fired_rule = "{fired_head} :- {body}.".format(
-                    fired_head=fired_head,
-                    body=",".join(map(str, rest_body)))
-            else:
-                fired_rule = fired_head + "."
-
-            # Generates label rules
-            label_rules = ""
-            for label_ast in label_body:
-                label_rules += "&trace{{{fired_id},{original_head},{label_parameters}}} :- {body}.\n".format(
-                    fired_id=str(rule_counter),
-                    original_head=str(rule_ast['head']),
-                    label_parameters=",".join([str(e) for e in label_ast['atom']['elements']]),
-                    body=fired_head)
+            fired_head = _fired_literal(location, rule_counter, head_arguments + list(body_variables_asts.values()))
+            _record_body(control, rest_body)
+            for a in rest_body:
+                add_prefix('holds_', a)
+            rules = [ast.Rule(location, fired_head, rest_body)]
+
+            # Generates label rules (before the prefix is added to the head)
+            if label_body:
+                original_head = _theory_term(head_term)
+                for label_ast in label_body:
+                    label_parameters = [t for e in label_ast['atom']['elements'] for t in e['tuple']]
+                    element = ast.TheoryAtomElement(
+                        [ast.Symbol(location, Number(rule_counter)), original_head] + label_parameters, [])
+                    label_atom = ast.TheoryAtom(location, ast.Function(location, "trace", [], False), [element], None)
+                    rules.append(ast.Rule(location, label_atom, [fired_head]))
+
+            # Generates weight rules, in the same way as label rules
+            if weight_body:
+                original_head = _theory_term(head_term)
+                for weight_ast in weight_body:
+                    weight_parameters = [t for e in weight_ast['atom']['elements'] for t in e['tuple']]
+                    element = ast.TheoryAtomElement(
+                        [ast.Symbol(location, Number(rule_counter)), original_head] + weight_parameters, [])
+                    weight_atom = ast.TheoryAtom(location, ast.Function(location, "trace_weight", [], False),
+                                                 [element], None)
+                    rules.append(ast.Rule(location, weight_atom, [fired_head]))
 
             # Generates holds rule
-            rule_ast['head'].add_prefix('holds_')
-            head_function['arguments'] = [ast.Variable(v['location'], "Aux" + str(head_function['arguments'].index(v._internal_ast))) for v in head_function['arguments']]
-            holds_rule = "{head} :- fired_{rule_counter}({fired_arguments}).".format(
-                head=rule_ast['head'],
-                rule_counter=rule_counter,
-                fired_arguments=",".join(["Aux" + str(i) for i in range(0,len(fired_head_variables))])
-                )
+            add_prefix('holds_', head)
+            head_function['arguments'] = [ast.Variable(v['location'], "Aux" + str(head_arguments.index(v)))
+                                          for v in head_arguments]
+            holds_body = _fired_literal(location, rule_counter,
+                                        [ast.Variable(location, "Aux" + str(i))
+                                         for i in range(0, len(fired_head_variables))])
+            rules.insert(1, ast.Rule(location, head, [holds_body]))
+            rules.extend(_show_signature(location, control, "fired_" + str(rule_counter), len(fired_head_variables)))
 
             # Generates a comment
             comment = "%" + str(rule_ast)
 
-            generated_rules = comment + "\n" + fired_rule + "\n" + holds_rule + "\n" + label_rules
+    elif rule_ast.type == ast.ASTType.External:
+        rules = _translate_external(rule_ast, control)
+        comment = None
+    else:
+        return
 
-        _add_to_base(generated_rules, builder, t_option)
+    if t_option or control.translated_rules is not None:
+        generated_rules = "\n".join(map(str, rules)) + "\n"
+        if comment is not None:
+            generated_rules = comment + "\n" + generated_rules
+        if t_option:
+            print(generated_rules)
+            return
+        control.translated_rules.append(generated_rules)
 
+    generated.extend(rules)
 
-def prepare_xclingo_program(clingo_arguments, original_program, debug_level):
-    control = XClingoProgramControl(clingo_arguments)
 
-    # Pre-processing original program
-    translated_program = _translate_trace(original_program)
-    translated_program = _translate_trace_all(translated_program)
+def _translate_external(external_ast, control):
+    """
+    Translates an #external declaration. The external atom becomes a 'fired' atom of a new rule id (so a true external
+    atom is explained as a fact) and a holds rule derives the original atom from it.
+    @param ast.AST external_ast: an AST of type External.
+    @param XClingoProgramControl control:
+    @return List[ast.AST]: the generated external declaration and holds rule.
+    """
+    location = external_ast['location']
+    atom = external_ast['atom']
+    # Depending on the version of clingo, the atom of an external is a term or a symbolic atom
+    term = atom['term'] if atom.type == ast.ASTType.SymbolicAtom else atom
+    function = get_function(term)
+    arguments = function['arguments']
+    positive = term.type != ast.ASTType.UnaryOperation
+
+    rule_counter = control.count_rule()
+    control.externals.setdefault((function['name'], len(arguments), positive), []).append(rule_counter)
+    control.traces[rule_counter] = {
+        'head': (positive, str(function['name']), arguments),
+        'arguments': list(map(str, arguments)),
+        'body': []
+    }
+
+    body = external_ast['body']
+    _record_body(control, body)
+    for b_ast in body:
+        add_prefix('holds_', b_ast)
+    fired_term = ast.Function(location, "fired_" + str(rule_counter), arguments, False)
+    external = ast.External(location, fired_term if atom is term else ast.SymbolicAtom(fired_term), body)
+
+    add_prefix('holds_', term)
+    function['arguments'] = [ast.Variable(v['location'], "Aux" + str(arguments.index(v))) for v in arguments]
+    holds_body = _fired_literal(location, rule_counter,
+                                [ast.Variable(location, "Aux" + str(i)) for i in range(0, len(arguments))])
+    holds_rule = ast.Rule(location, ast.Literal(location, ast.Sign.NoSign, ast.SymbolicAtom(term)), [holds_body])
+
+    return [external, holds_rule] + _show_signature(location, control, "fired_" + str(rule_counter), len(arguments))
+
+
+def _external_fact(rule_ast, control):
+    """
+    @param ast.AST rule_ast:
+    @param XClingoProgramControl control:
+    @return clingo.Symbol: the atom of the rule if it is a ground fact over an atom declared with #external, or None.
+    """
+    if rule_ast.type != ast.ASTType.Rule or rule_ast['body']:
+        return None
+    head = rule_ast['head']
+    if (head.type != ast.ASTType.Literal or head['sign'] != ast.Sign.NoSign
+            or head['atom'].type != ast.ASTType.SymbolicAtom):
+        return None
+
+    term = head['atom']['term']
+    if term.type not in (ast.ASTType.Function, ast.ASTType.UnaryOperation):
+        return None
+    function = get_function(term)
+    if (function['name'], len(function['arguments']), term.type != ast.ASTType.UnaryOperation) not in control.externals:
+        return None
+    try:
+        return parse_term(str(term))
+    except RuntimeError:  # It is not ground
+        return None
 
-    aux = translated_program
-    translated_program = _translate_show_all(translated_program)
 
-    control.have_explain = bool(aux != translated_program)
+def _is_external(control, symbol):
+    """
+    @param XClingoProgramControl control: a grounded control.
+    @param clingo.Symbol symbol: an atom of the original program.
+    @return bool: True if the atom is an external atom of the grounded program.
+    """
+    for rule_id in control.externals.get((symbol.name, len(symbol.arguments), symbol.positive), []):
+        symbolic_atom = control.symbolic_atoms[Function("fired_" + str(rule_id), symbol.arguments)]
+        if symbolic_atom is not None and symbolic_atom.is_external:
+            return True
+    return False
 
-    # Prints translated_program and exits
-    if debug_level == "magic-comments":
-        print(translated_program)
-        exit(0)
 
-    # Sets theory atom &label and parses/handles input program
-    with control.builder() as builder:
-        # Adds theories
-        parse_program("""#program base. 
+def assign_external(control, symbol, truth):
+    """
+    Assigns a truth value to an atom declared with #external in the original program.
+    @param XClingoProgramControl control:
+    @param clingo.Symbol symbol: the original atom.
+    @param bool truth: True, False or None (to make the atom free).
+    @return bool: False if the atom is not an external atom of the grounded program.
+    """
+    assigned = False
+    for rule_id in control.externals.get((symbol.name, len(symbol.arguments), symbol.positive), []):
+        fired = Function("fired_" + str(rule_id), symbol.arguments)
+        symbolic_atom = control.symbolic_atoms[fired]
+        if symbolic_atom is not None and symbolic_atom.is_external:
+            control.assign_external(fired, truth)
+            assigned = True
+    return assigned
+
+
+def _add_rules(generated, builder):
+    """
+    @param List[ast.AST] generated: the rules that will be added to the current program part.
+    @param clingo.ProgramBuilder builder: builder of the clingo control object that will receive the generated rules.
+    @return None:
+    @raise TranslationError: if clingo does not accept one of the rules.
+    """
+    for rule in generated:
+        try:
+            builder.add(rule)
+        except RuntimeError:
+            raise TranslationError("Translation error:\n\n{0}".format(rule))
+
+
+_TRACE_THEORY = """#program base. 
                         #theory trace {
                             t { 
                                 - : 7, unary;
                                 + : 6, binary, left; 
                                 - : 6, binary, left 
                             }; 
-                            &trace/0: t, any}.""",
-                      lambda ast_object: builder.add(ast_object))
-        print()
-        parse_program("""#program base. 
+                            &trace/0: t, any;
+                            &trace_weight/0: t, any}."""
+
+_TRACE_ALL_THEORY = """#program base. 
                         #theory trace_all {
                             t { 
                                 - : 7, unary; 
                                 + : 6, binary, left; 
                                 - : 6, binary, left 
                             }; 
-                            &trace_all/0: t, any}.""",
-                      lambda ast_object: builder.add(ast_object))
+                            &trace_all/0: t, any}."""
+
+
+def translated_program_entry(control):
+    """
+    @param XClingoProgramControl control: a control whose translation was recorded (see prepare_xclingo_program).
+    @return Dict: the (picklable) translation of the program, from which new controls can be built with
+    load_translated_program.
+    """
+    return {
+        "program": "\n".join([_TRACE_THEORY, _TRACE_ALL_THEORY, "#program base."] + control.translated_rules),
+        "binding_plans": control.binding_plans,
+        "fired_names": control.fired_names,
+        "have_explain": control.have_explain,
+        "externals": control.externals,
+        "shown_signatures": control.shown_signatures,
+        "body_signatures": control.body_signatures,
+    }
+
+
+def load_translated_program(clingo_arguments, entry):
+    """
+    Builds a new control from the translation of a program, without translating it again.
+    @param List[str] clingo_arguments:
+    @param Dict entry: the translation of the program (see translated_program_entry).
+    @return XClingoProgramControl:
+    """
+    control = XClingoProgramControl(clingo_arguments)
+    control.have_explain = entry["have_explain"]
+    # Copies, since new parts can be added to the control (see translate_part)
+    control.binding_plans = dict(entry["binding_plans"])
+    control.fired_names = dict(entry["fired_names"])
+    control.externals = {k: list(v) for k, v in entry["externals"].items()}
+    shown_signatures = entry["shown_signatures"]
+    control.shown_signatures = None if shown_signatures is None else set(shown_signatures)
+    control.body_signatures = set(entry["body_signatures"])
+    control.rule_counter = len(entry["fired_names"])
+    control.add("base", [], entry["program"])
+    return control
+
+
+def _program_sources(original_program):
+    """
+    @param original_program: the program as a str or as a list of file objects.
+    @return List: the parts of the program as pairs (name, lines).
+    """
+    if isinstance(original_program, str):
+        return [("<string>", original_program.splitlines(True))]
+    return [(getattr(f, "name", "<file>"), f) for f in original_program]
+
+
+def prepare_xclingo_program(clingo_arguments, original_program, debug_level, cache_dir=None, keep_translation=False,
+                            project_models=True):
+    """
+    Translates an xclingo program and adds it to a new control.
+    Unless project_models is False, the models only show the atoms that xclingo reads from them (the 'fired' atoms and
+    the show_all atoms), so the rest of atoms are not transferred from the solver.
+    @param List[str] clingo_arguments:
+    @param original_program: the program as a str or as a list of file objects (that are read line by line).
+    @param str debug_level:
+    @param str cache_dir: if given, the translation is loaded from (or stored in) this directory.
+    @param bool keep_translation: if True, the translation is recorded in the control (see translated_program_entry). The
+    cache is not used in this case.
+    @param bool project_models: if False, every atom is shown in the models (for debugging).
+    @return XClingoProgramControl:
+    """
+    sources = _program_sources(original_program)
+
+    # The debug levels that print the translation always translate the program
+    use_cache = cache_dir is not None and debug_level not in ("magic-comments", "translation") and not keep_translation
+    if use_cache:
+        # The key needs the whole input before translating it
+        sources = [(name, list(lines)) for name, lines in sources]
+        key = translation_cache.cache_key((line for _, lines in sources for line in lines),
+                                          list(clingo_arguments) + [debug_level, project_models])
+        entry = translation_cache.load(cache_dir, key)
+        if entry is not None:
+            stats.count("translation cache hits")
+            print()  # Same output as the translation
+            return load_translated_program(clingo_arguments, entry)
+
+    control = XClingoProgramControl(clingo_arguments)
+    if not project_models:
+        control.shown_signatures = None
+    if use_cache or keep_translation:
+        control.translated_rules = []
+
+    # Pre-processing original program (magic comments)
+    translated_program = io.StringIO()
+    with stats.phase("magic comments"):
+        control.have_explain = translate_magic_comments(sources, translated_program)
+    translated_program = translated_program.getvalue()
+
+    # Prints translated_program and exits
+    if debug_level == "magic-comments":
+        print(translated_program)
+        exit(0)
+
+    # Sets theory atom &label and parses/handles input program
+    with stats.phase("translation"), control.builder() as builder:
+        # Adds theories
+        parse_program(_TRACE_THEORY, lambda ast_object: builder.add(ast_object))
+        print()
+        parse_program(_TRACE_ALL_THEORY, lambda ast_object: builder.add(ast_object))
         # Handle xclingo sentences
+        generated = []
         parse_program(
             "#program base." + translated_program,
-            lambda ast_object: _translate_to_fired_holds(ast_object, control, builder, debug_level == "translation")
+            lambda ast_object: _translate_to_fired_holds(ast_object, control, generated, debug_level == "translation")
         )
+        # Adds the generated rules to the base program
+        _add_rules(generated, builder)
 
     # Translation was printed during _translate_to_fired_holds so we can now exit
     if debug_level == "translation":
         exit(0)
 
+    # Compiles the traces once, so binding each fired instance is cheap
+    with stats.phase("trace compilation"):
+        control.binding_plans = compile_traces(control.traces)
+    stats.count("rules translated", control.rule_counter)
+    stats.count("generated rules", len(generated))
+    stats.count("trace entries", len(control.traces))
+
+    if use_cache:
+        translation_cache.store(cache_dir, key, translated_program_entry(control))
+    if not keep_translation:
+        control.translated_rules = None
+
     return control
+
+
+def translate_part(control, name, program, grounded=False):
+    """
+    Translates a new part of an xclingo program (for example, a batch of facts) and adds it to the control as the
+    program part 'name'. The rules of the part get new rule ids.
+
+    clingo never grounds again the rules of the parts that were already grounded, so if the new part is grounded on its
+    own (grounded=True), these rules only fire for the atoms of the part that were grounded with them: the atoms that
+    were declared with #external. The facts of the part over these atoms are not translated, but returned so they can
+    be assigned (see assign_external), and the part can not derive other atoms that appear in the bodies of those rules.
+    @param XClingoProgramControl control: a control prepared by prepare_xclingo_program.
+    @param str name: the name of the new program part.
+    @param program: the part as a str or as a list of file objects (that are read line by line).
+    @param bool grounded: True if the parts that are already in the control were grounded (and the new part will be
+    grounded on its own).
+    @return List[clingo.Symbol]: the facts over the external atoms of the grounded parts (only if grounded is True).
+    @raise ValueError: if grounded is True and the part derives atoms that appear in the bodies of the grounded parts
+    (other than their external atoms). The part is not added to the control in this case.
+    """
+    first_rule = control.rule_counter
+    grounded_bodies = set(control.body_signatures)
+
+    translated_program = io.StringIO()
+    have_explain = translate_magic_comments(_program_sources(program), translated_program)
+
+    generated = []
+    external_facts = []
+
+    def translate(ast_object):
+        fact = _external_fact(ast_object, control) if grounded else None
+        if fact is None:
+            _translate_to_fired_holds(ast_object, control, generated, False)
+        elif _is_external(control, fact):
+            external_facts.append(fact)
+        else:
+            raise ValueError("{} is not one of the atoms declared with #external in the program, so the rules of the "
+                             "program can not fire for it".format(fact))
+
+    parse_program("#program base." + translated_program.getvalue(), translate)
+
+    if grounded:
+        for rule_id in range(first_rule, control.rule_counter):
+            _, head_name, head_arguments = control.traces[rule_id]['head']
+            if (str(head_name), len(head_arguments)) in grounded_bodies:
+                raise ValueError("{}/{} appears in the bodies of the rules that were already grounded, so they would "
+                                 "not fire for the atoms of '{}' (they must be declared with #external in the "
+                                 "program)".format(head_name, len(head_arguments), name))
+
+    if have_explain:
+        control.have_explain = True
+    if generated:
+        with control.builder() as builder:
+            builder.add(ast.Program(generated[0]['location'], name, []))
+            _add_rules(generated, builder)
+
+    control.binding_plans.update(compile_traces({i: control.traces[i] for i in range(first_rule, control.rule_counter)}))
+    return external_facts
@@ -0,0 +1,68 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+import clingo
+
+# Must change whenever the translation or the format of the entries changes, so old entries are not reused
+CACHE_FORMAT = 7
+
+
+def cache_key(program, options):
+    """
+    @param Iterable[str] program: the original program (the contents of the input files, in any number of chunks).
+    @param Iterable options: the options that affect the translation.
+    @return str: the key of the translation of the program (hex sha256 digest).
+    """
+    digest = hashlib.sha256()
+    digest.update("xclingo-cache {}\nclingo {}\n".format(CACHE_FORMAT, clingo.__version__).encode())
+    digest.update(repr(list(options)).encode())
+    digest.update(b"\n")
+    for chunk in program:
+        digest.update(chunk.encode())
+    return digest.hexdigest()
+
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key + ".pickle")
+
+
+def load(cache_dir, key):
+    """
+    @param str cache_dir: the cache directory.
+    @param str key: the key of the entry (see cache_key).
+    @return Dict: the cached entry, or None if it is missing or unreadable.
+    """
+    try:
+        with open(_entry_path(cache_dir, key), "rb") as entry_file:
+            entry = pickle.load(entry_file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+    if not isinstance(entry, dict) or entry.get("format") != CACHE_FORMAT:
+        return None
+    return entry
+
+
+def store(cache_dir, key, entry):
+    """
+    Writes an entry atomically, so concurrent runs never read a partial entry. Failures are ignored: the cache is only
+    an optimization.
+    @param str cache_dir: the cache directory (it is created if needed).
+    @param str key: the key of the entry (see cache_key).
+    @param Dict entry: the picklable contents of the entry.
+    """
+    entry = dict(entry, format=CACHE_FORMAT)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                pickle.dump(entry, tmp_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, _entry_path(cache_dir, key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass
@@ -1,295 +1,523 @@
 
 
 import sys
-import argparse
-import clingo
+from startup_profiler import StartupProfiler
+
+# The profiler must be installed before the rest of the modules are imported
+startup_profiler = StartupProfiler()
+if "--profile-startup" in sys.argv:
+    startup_profiler.install()
 
-from pandas import DataFrame, option_context
-from clingo_utilities import find_by_prefix, remove_prefix, find_and_remove_by_prefix
-from more_itertools import unique_everseen
+import argparse
+import io
+
+from collections import namedtuple
+from itertools import islice
+from clingo_utilities import partition_model
+from derivation_graph import DerivationGraph
+from explanation import ExplanationCounter, ExplanationEngine, RankedExplanations
+from instrumentation import stats
+from labels import LabelIndex
+from rendering import AsciiTreeRenderer, JsonLinesWriter
+import incremental
 import translation
 
 
-def build_fired_dict(m):
+def build_fired_dict(m, fired_names):
     """
     Build a dictionary containing, for each fired id, the list of the different fired values in that given model.
     @param clingo.Model m: the model that contains the fired atoms.
+    @param Dict fired_names: the id of each rule indexed by the name of its 'fired' atoms.
     @return Dict: a dictionary with the different fired values indexed by fired id.
     """
-    fired_values = dict()
+    fired_values, _, _ = partition_model(m.symbols(shown=True), fired_names)
+    return fired_values
 
-    for f in find_by_prefix(m, "fired_"):
-        fired_id = int(f.name.split("fired_")[1])
-        if fired_id in fired_values:
-            fired_values[fired_id].append(f.arguments)
-        else:
-            fired_values[fired_id] = [f.arguments]
 
-    return fired_values
+def _rule_labels(model_labels, fired_id, head, fired_body, auto_tracing):
+    """
+    @return List[str]: the labels of a fired rule instance (see build_causes).
+    """
+    labels = model_labels.labels(fired_id, head)
+
+    if (auto_tracing == "all" or (auto_tracing == "facts" and fired_body == [])) and labels == []:  # Auto-labelling labels
+        labels.append(str(head))
 
+    return labels
 
-def build_causes(m, traces, fired_values, labels_dict, auto_tracing):
+
+def _reachable_instances(binding_plans, fired_values, targets):
+    """
+    Finds the fired rule instances whose heads are reachable backwards (through the bodies of the instances) from the
+    given atoms. Only the heads of the instances of the rules that can derive a reached atom are built.
+    @param Dict binding_plans: a dictionary (indexed by fired id) containing the BindingPlan of the original rules.
+    @param Dict fired_values: a dictionary (indexed by fired id) that contains the fired values in a model.
+    @param Iterable[clingo.Symbol] targets: the atoms to be explained.
+    @return Dict: for each fired id, the reached instances as a dictionary (index in fired_values -> (head, body)).
+    """
+    # Rules indexed by the signature of their heads
+    rules_by_signature = {}
+    for fired_id in fired_values:
+        rules_by_signature.setdefault(binding_plans[fired_id].head_signature(), []).append(fired_id)
+
+    heads_index = {}  # fired id -> {head: [indexes of the instances]}, built the first time the rule is reached
+    reached = {}
+    visited = set(targets)
+    pending = list(visited)
+
+    while pending:
+        atom = pending.pop()
+        for fired_id in rules_by_signature.get((atom.name, len(atom.arguments), atom.positive), ()):
+            plan = binding_plans[fired_id]
+            index = heads_index.get(fired_id)
+            if index is None:
+                index = heads_index[fired_id] = {}
+                for i, values in enumerate(fired_values[fired_id]):
+                    index.setdefault(plan.bind_head(values), []).append(i)
+
+            for i in index.get(atom, ()):
+                body = plan.bind_body(fired_values[fired_id][i])
+                reached.setdefault(fired_id, {})[i] = (atom, body)
+                for b in body:
+                    if b not in visited:
+                        visited.add(b)
+                        pending.append(b)
+
+    return reached
+
+
+def build_causes(m, binding_plans, fired_values, labels_dict, auto_tracing, targets=None, model_labels=None):
     """
     Builds a dictionary containing, for each fired atom in a model, the atoms (with values) that caused its derivation.
-    It performs this crossing the info in 'traces' and 'fired_values'
+    It performs this crossing the info in 'binding_plans' and 'fired_values'
     @param clingo.Model:
-    @param Dict traces: a dictionary (indexed by fired id) containing the head and the body of the original rules.
+    @param Dict binding_plans: a dictionary (indexed by fired id) containing the BindingPlan of the original rules.
     @param Dict fired_values: a dictionary (indexed by fired id) that contains the fired values in a model.
-    @param Dict labels_dict: a dictionary (indexed by atom with values) that contains their processed labels.
+    @param LabelIndex labels_dict: the processed labels of the program (see build_labels_dict).
     @param str auto_tracing: string constant chosen by the user. Options are:
                 - none : atoms and rules just have the labels found on the original program.
                 - facts : rules with empty body must be additionally labeled with a string version of its head.
                 - all : every rule must be additionally labeled with a string version of its head.
-    @return DataFrame:
+    @param Iterable[clingo.Symbol] targets: if given, only the causes of these atoms (and, recursively, of the atoms in
+    their bodies) are built.
+    @param ModelLabels model_labels: the labels of the model, if they were already resolved (see LabelIndex.resolve).
+    @return DerivationGraph: the causes of the model, indexed by head.
     """
-    causes = []
+    causes = DerivationGraph()
+    if model_labels is None:
+        model_labels = labels_dict.resolve(m)
+
+    if targets is not None:
+        reached = _reachable_instances(binding_plans, fired_values, targets)
+        # Added in the same order as in the complete graph, so the explanations are the same
+        for fired_id in fired_values:
+            instances = reached.get(fired_id)
+            if instances is not None:
+                for i in sorted(instances):
+                    head, fired_body = instances[i]
+                    labels = _rule_labels(model_labels, fired_id, head, fired_body, auto_tracing)
+                    causes.add_cause(fired_id, head, labels, fired_body, model_labels.weight(fired_id, head))
+        return causes
 
     for fired_id, fired_values_list in fired_values.items():
+        plan = binding_plans[fired_id]
         for fired_values in fired_values_list:
             # fired_id -> that 'fired' rule was fired once for each value in fired_values_list
             # fired_values -> the values that were fired
+            head, fired_body = plan.bind(fired_values)
+            labels = _rule_labels(model_labels, fired_id, head, fired_body, auto_tracing)
+            causes.add_cause(fired_id, head, labels, fired_body, model_labels.weight(fired_id, head))
 
-            # Bind variable names and its values (order-based)
-            var_val = dict()
-            for i in range(0, len(fired_values)):
-                var_val[traces[fired_id]['arguments'][i]] = fired_values[i]
-
-            # Build the causes using fired values and the original body
-            (positive, name, variables) = traces[fired_id]['head']
-            head = clingo.Function(name, [var_val[str(v)] for v in variables], positive)
-
-            # Computes fired_body
-            fired_body = []
-            for (positive, name, variables) in traces[fired_id]['body']:
-                values = []
-                for v in variables:
-
-                    if v.type == clingo.ast.ASTType.Variable:
-                        values.append(var_val[str(v)])
-                    elif v.type == clingo.ast.ASTType.Symbol:
-                        if v['symbol'].type == clingo.SymbolType.Number:
-                            values.append(int(str(v)))
-                        else:
-                            values.append(clingo.Function(v['symbol'].name, v['symbol'].arguments, v['symbol'].positive))
-                    elif v.type == clingo.ast.ASTType.Function:
-                        for a in v['arguments']:
-                            values.append(clingo.Function(
-                                v['name'],
-                                [clingo.Function(a['symbol'].name, a['symbol'].arguments) for a in v['arguments']])
-                            )
-                    elif v.type == clingo.ast.ASTType.BinaryOperation:
-                        operators = []
-                        for k in v.child_keys:
-                            if v[k].type == clingo.ast.ASTType.Variable:
-                                operators.append(var_val[str(v[k])])
-                            elif v[k].type == clingo.ast.ASTType.Symbol and v[k]['symbol'].type == clingo.SymbolType.Number:
-                                operators.append(v[k]['symbol'])
-
-                        if v['operator'] == clingo.ast.BinaryOperator.Minus:
-                            values.append(operators[0].number - operators[1].number)
-                        elif v['operator'] == clingo.ast.BinaryOperator.Plus:
-                            values.append(operators[0].number + operators[1].number)
-                        elif v['operator'] == clingo.ast.BinaryOperator.Multiplication:
-                            values.append(operators[0].number * operators[1].number)
-                        elif v['operator'] == clingo.ast.BinaryOperator.Division:
-                            values.append(operators[0].number / operators[1].number)
-
-
-                fired_body.append(clingo.Function(name, values, positive))
-
-            # Labels
-            labels = []
-            if str(head) in labels_dict:  # Label from 'trace_all' sentences
-                labels.extend([label for lit, label in labels_dict[str(head)] if m.is_true(lit)])
-
-            if int(fired_id) in labels_dict and str(head) in labels_dict[int(fired_id)]:
-                lit, label = labels_dict[int(fired_id)][str(head)]
-                if m.is_true(lit):
-                    labels.append(label)
-
-            if (auto_tracing == "all" or (auto_tracing == "facts" and fired_body == [])) and labels == []:  # Auto-labelling labels
-                labels.append(str(head))
-
-            causes.append(
-                {'fired_id': fired_id,
-                 'fired_head': head,
-                 'labels': labels,
-                 'fired_body': fired_body})
-
-    causes_df = DataFrame(causes)
-
-    return causes_df
-
-
-def _fhead_from_theory_term(theory_term):
-
-    is_classic_negation = theory_term.name == "-" and len(theory_term.arguments) == 1
-
-    if is_classic_negation:
-        theory_term = theory_term.arguments[0]
-
-    # Process arguments
-    arguments = []
-    for arg in theory_term.arguments:
-        if arg.type == clingo.TheoryTermType.Function:
-            if arg.name == "+" and len(arg.arguments) == 2:
-                arguments.append(str(arg.arguments[0].number + arg.arguments[1].number))
-            elif arg.name == "-" and len(arg.arguments) == 2:
-                arguments.append(str(arg.arguments[0].number - arg.arguments[1].number))
-            else:
-                arguments.append(str(arg))
-        else:
-            arguments.append(str(arg))
+    return causes
 
-    fired_head = "{sign}{name}{arguments}".format(
-        sign="-" if is_classic_negation else "",
-        name=theory_term.name,
-        arguments="({})".format(",".join(arguments)) if arguments else ""
-    )
 
-    return fired_head
+def _derived_atoms(binding_plans, fired_values, atoms=None):
+    """
+    @param Dict binding_plans: a dictionary (indexed by fired id) containing the BindingPlan of the original rules.
+    @param Dict fired_values: a dictionary (indexed by fired id) that contains the fired values in a model.
+    @param Set[clingo.Symbol] atoms: if given, only these atoms are considered.
+    @return List[clingo.Symbol]: the atoms derived in the model, in the order of the heads of its causes (see
+    build_causes), without building them.
+    """
+    signatures = None if atoms is None else {(a.name, len(a.arguments), a.positive) for a in atoms}
+    derived = []
+    seen = set()
+    for fired_id, fired_values_list in fired_values.items():
+        plan = binding_plans[fired_id]
+        if signatures is not None and plan.head_signature() not in signatures:
+            continue
+        for values in fired_values_list:
+            head = plan.bind_head(values)
+            if head not in seen and (atoms is None or head in atoms):
+                seen.add(head)
+                derived.append(head)
+    return derived
 
 
 def build_labels_dict(c_control):
     """
-    Constructs a dictionary with the processed labels for the program indexed by fired_id or the str version of an atom.
+    Constructs the index of the processed labels of the program (by atom and by fired id and atom).
     Must be called after grounding.
     @param c_control: clingo.Control object containing the theory atoms after grounding.
-    @return dict:
+    @return LabelIndex:
     """
-    labels_dict = {}
-    for atom in c_control.theory_atoms:
-        name = atom.term.name
-        if name == "trace_all":
-            terms = atom.elements[0].terms
-            # Replace label % placeholders by the values.
-            label = str(terms[1])
-            for value in terms[2:]:
-                if value.type == clingo.TheoryTermType.Function:
-                    if value.name == "+" and len(value.arguments) == 2:
-                        value = value.arguments[0].number + value.arguments[1].number
-                    elif value.name == "-" and len(value.arguments) == 2:
-                        value = value.arguments[0].number - value.arguments[1].number
-                label = label.replace("%", str(value), 1)
-
-            index = _fhead_from_theory_term(terms[0])
-
-            if index in labels_dict:
-                labels_dict[index].append((atom.literal, label))
-            else:
-                labels_dict[index] = [(atom.literal, label)]
-        elif name == "trace":
-            terms = atom.elements[0].terms
+    return LabelIndex.from_theory_atoms(c_control.theory_atoms)
+
+
+def iter_explanations(atom, causes, engine=None):
+    """
+    @param clingo.Symbol atom: the atom to be explained.
+    @param DerivationGraph causes: the causes of the model.
+    @param ExplanationEngine engine: engine that shares the already computed explanations of the model. If None, a new
+    one is created.
+    @return Iterator[ExplanationNode]: generator that computes the explanations of the atom one by one.
+    """
+    atom_id = causes.id_of(atom)
+    if atom_id is None:
+        return iter([])
+    if engine is None:
+        engine = ExplanationEngine(causes)
+    return engine.iter_explanations(atom_id)
 
-            # Replace label % placeholders by the values.
-            label = str(terms[2])
-            for value in terms[3:]:
-                if value.type == clingo.TheoryTermType.Function:
-                    if value.name == "+" and len(value.arguments) == 2:
-                        value = value.arguments[0].number + value.arguments[1].number
-                    elif value.name == "-" and len(value.arguments) == 2:
-                        value = value.arguments[0].number - value.arguments[1].number
 
-                label = label.replace("%", str(value), 1)
+def build_explanations(atom, causes, engine=None, limit=None):
+    """
+    @param clingo.Symbol atom: the atom to be explained.
+    @param DerivationGraph causes: the causes of the model.
+    @param ExplanationEngine engine: engine that shares the already computed explanations of the model. If None, a new
+    one is created.
+    @param int limit: maximum number of explanations to be computed. If None, all of them are computed.
+    @return List[ExplanationNode]: the explanations of the atom.
+    """
+    return list(islice(iter_explanations(atom, causes, engine), limit))
 
-            index = int(str(terms[0]))
-            fired_head = _fhead_from_theory_term(terms[1])
 
-            if index not in labels_dict:
-                labels_dict[index] = {}
+def ascii_tree_explanation(explanation):
+    """
+    @param ExplanationNode explanation: an explanation
+    @return str: an str containing the ascii tree explanation.
+    """
+    return AsciiTreeRenderer().render(explanation)
 
-            labels_dict[index][fired_head] = (atom.literal, label)
 
-    return labels_dict
+# Options that control the output of explain_model
+ExplainOptions = namedtuple('ExplainOptions', ['auto_tracing', 'debug_level', 'max_atom_explanations',
+                                               'max_explanations', 'atom_jobs', 'output_format', 'atoms',
+                                               'mark_reused', 'count_only', 'rank_by', 'top_k'])
 
 
-def _build_explanations(atom, causes, stack):
+def explain_model(sol_n, m, fired_values, fired_show_all, binding_plans, labels_dict, have_explain, options):
     """
-    Returns a list containing all the possibles explanations for the given atom based on the given 'causes' dict.
-    @param clingo.Symbol atom: the atom to be explained.
-    @param Dict causes: dict containing all the possible causes for each atom in a model.
-    @param List stack: the stack of calls to _build_explanations done so far at this point.
-    @return List[Dict]: list of dictionaries in where each dict is an explanation for the atom.
+    Builds the causes of a model and explains its atoms (see write_model).
+    @return str: the output of xclingo for the model.
     """
-    explanations = []
-
-    # Each alt_rule is a list of derived atoms (can be empty)
-    for index, alt_rule in causes[causes.fired_head == atom][['labels', 'fired_body']].iterrows():
-
-        if alt_rule['fired_body']:
-            alt_rule_explanations = []  # Explanations of the current alt_rule.
-            # Each atom in 'alt_rule' can have multiple explanations. Each combination is an atom explanation.
-            for a in alt_rule['fired_body']:
-                # This prevents the function to fall in an infinite loop of calls
-                if a in stack:
-                    continue
-
-                a_explanations = _build_explanations(a, causes, stack + [a])
-
-                # Initialize with empty explanation if there is nothing yet
-                if not alt_rule_explanations:
-                    alt_rule_explanations.append({})
-
-                if a_explanations != [{}]:  # If a is not fact
-                    for i in range(len(alt_rule_explanations)):
-                        not_empty_expls = [a_e for a_e in a_explanations if a_e != {}]
-                        # The atom explanations (e) are merged directly with the rest of the current alt_rule.
-                        if not_empty_expls:
-                            alt_rule_e = alt_rule_explanations.pop()
-                            for e in not_empty_expls:
-                                copy = alt_rule_e.copy()
-                                copy.update(e)
-                                alt_rule_explanations.insert(0, copy)
+    out = io.StringIO()
+    write_model(out, sol_n, m, fired_values, fired_show_all, binding_plans, labels_dict, have_explain, options)
+    return out.getvalue()
 
-        else:
-            # alt_rule == [] (empty list), then one explanation is that the atom is fact.
-            alt_rule_explanations = [{}]
 
-        if alt_rule['labels']:
-            for label in alt_rule['labels']:
-                for e in alt_rule_explanations:
-                    explanations.append({label: e})
+def write_model(out, sol_n, m, fired_values, fired_show_all, binding_plans, labels_dict, have_explain, options,
+                reuse=None):
+    """
+    Builds the causes of a model and writes the explanations of its atoms.
+    @param out: file object where the output is written.
+    @param int sol_n: the number of the answer set.
+    @param clingo.Model m: the model (or any object with the is_true method of clingo.Model).
+    @param Dict fired_values: a dictionary (indexed by fired id) that contains the fired values in the model.
+    @param List[clingo.Symbol] fired_show_all: the show_all atoms of the model.
+    @param Dict binding_plans: a dictionary (indexed by fired id) containing the BindingPlan of the original rules.
+    @param LabelIndex labels_dict: the processed labels of the program (see build_labels_dict).
+    @param bool have_explain: True if the program has show_all rules.
+    @param ExplainOptions options:
+    @param reuse: if given (an incremental.ExplanationReuse or incremental.ExplanationCache), the explanations of the
+    atoms whose derivations did not change since a previous model are reused (only when they are enumerated).
+    """
+    # Only the causes of the atoms to be explained are built (all of them are printed when debugging causes)
+    if options.debug_level == "causes":
+        targets = None
+    elif options.atoms is not None:  # Only the requested atoms (the ones that are in the model)
+        targets = options.atoms
+    elif have_explain:
+        targets = set(fired_show_all)
+    else:
+        targets = None
+    if options.debug_level == "causes" or options.count_only or options.rank_by is not None:
+        reuse = None
+
+    model_labels = labels_dict.resolve(m)
+    causes_targets = targets
+    derived = None
+    if reuse is not None:
+        reuse.begin(fired_values, binding_plans, labels_dict, model_labels)
+        if reuse.partial_causes:
+            # Only the causes of the atoms whose explanations can not be reused are built
+            derived = _derived_atoms(binding_plans, fired_values, targets)
+            missing = reuse.missing(derived)
+            if len(missing) < len(derived):
+                causes_targets = missing
+            else:
+                derived = None
+
+    with stats.phase("causes"):
+        causes = build_causes(m, binding_plans, fired_values, labels_dict, options.auto_tracing, causes_targets,
+                              model_labels)
+    stats.count_model(causes=len(causes))
+
+    if options.debug_level == "causes":
+        print("Answer: " + str(sol_n), file=out)
+        print(labels_dict, file=out)
+        print(causes.to_dataframe().to_string(), end="\n\n", file=out)
+        return
+
+    # atoms_to_explain stores the atom that have to be explained for the current model.
+    message = None
+    if options.atoms is not None or (have_explain and fired_show_all):
+        atoms_to_explain = [a for a in map(causes.symbol, causes.heads()) if a in targets]
+    elif have_explain:
+        message = "Any show_all rule was activated."
+        atoms_to_explain = []
+    else:   # If there is not show_all rules then explain everything in the model.
+        atoms_to_explain = [causes.symbol(a) for a in causes.heads()]
+    if derived is not None and message is None:  # Some of them are not in the causes
+        atoms_to_explain = derived
+
+    engine = ExplanationEngine(causes)
+    if options.count_only:
+        _write_counts(out, sol_n, causes, engine, atoms_to_explain, message, options)
+        return
+    if options.rank_by is not None:
+        _write_ranked(out, sol_n, causes, engine, atoms_to_explain, message, options)
+        return
+
+    if reuse is not None:
+        reuse.update(causes)
+    in_parallel = options.atom_jobs > 1 and len(atoms_to_explain) > 1
+
+    if options.output_format == "ndjson":
+        writer = JsonLinesWriter(out)
+        if message is None:
+            writer.write_model(sol_n)
         else:
-            explanations.extend(alt_rule_explanations)
+            writer.write_model(sol_n, message=message)
+        # The explanations are written as they are produced (the workers send back the nodes themselves)
+        for a, explanations in _explained_atoms(causes, engine, atoms_to_explain, options, None, reuse):
+            if stats.enabled:
+                explanations = list(explanations)
+                stats.count_model(atom=a, explanations=len(explanations))
+            if options.mark_reused and reuse is not None:
+                writer.write_atom(a, explanations, reused=reuse.reused(a))
+            else:
+                writer.write_atom(a, explanations)
+        stats.count("cycle cut-offs", engine.cycle_cutoffs)
+        return
+
+    renderer = AsciiTreeRenderer()
+    print("Answer: " + str(sol_n), file=out)
+    if message is not None:
+        print(message, file=out)
+
+    # The workers render the trees, so they only send back strings. The explanations that are reused are always kept as
+    # nodes (their rendered trees are kept apart, see put_rendered), so in that case the workers send back the nodes
+    render = renderer.render if in_parallel and reuse is None else None
+    for a, explanations in _explained_atoms(causes, engine, atoms_to_explain, options, render, reuse):
+        explanations = list(explanations)
+        stats.count_model(atom=a, explanations=len(explanations))
+        mark = "\t(reused)" if options.mark_reused and reuse is not None and reuse.reused(a) else ""
+        out.write(">> {}\t[{}]{}\n".format(a, len(explanations), mark))
+
+        # The rendered trees are reused along with the explanations
+        rendered = render is not None
+        if reuse is not None:
+            trees = reuse.get_rendered(a)
+            if trees is None or len(trees) < len(explanations):
+                trees = [renderer.render(e) for e in explanations]
+                reuse.put_rendered(a, trees)
+            explanations = trees[:len(explanations)]
+            rendered = True
+
+        for e in explanations:
+            if rendered:
+                out.write(e)
+            else:
+                renderer.write(e, out)
+            out.write("\n")
 
-    return list(unique_everseen(explanations))
+    out.write("\n")
+    stats.count("cycle cut-offs", engine.cycle_cutoffs)
 
 
-def build_explanations(atom, causes):
-    return _build_explanations(atom, causes, [atom])
+def _write_counts(out, sol_n, causes, engine, atoms_to_explain, message, options):
+    """
+    Writes the number of explanations of each atom, without enumerating them (see ExplanationCounter). The limits of
+    the options do not apply.
+    """
+    counter = ExplanationCounter(engine)
+    if options.output_format == "ndjson":
+        writer = JsonLinesWriter(out)
+        if message is None:
+            writer.write_model(sol_n)
+        else:
+            writer.write_model(sol_n, message=message)
+        for a in atoms_to_explain:
+            writer.write_count(a, counter.count(causes.id_of(a)))
+        return
 
+    print("Answer: " + str(sol_n), file=out)
+    if message is not None:
+        print(message, file=out)
+    for a in atoms_to_explain:
+        out.write(">> {}\t[{}]\n".format(a, counter.count(causes.id_of(a))))
+    out.write("\n")
 
-def _ascii_tree_explanation(explanation, level):
+
+def _write_ranked(out, sol_n, causes, engine, atoms_to_explain, message, options):
     """
-    @param Dict explanation: dict representing the explanation of an atom.
-    @param int level: depth level used to correctly draw the branch of the tree.
-    @return str: an str containing the ascii tree explanation.
+    Writes the options.top_k explanations of lowest cost (see RankedExplanations) of each atom, together with their
+    costs. The explanations are not reused and the atoms are explained serially.
     """
+    ranked = RankedExplanations(engine, options.rank_by)
+    remaining = options.max_explanations if options.max_explanations > 0 else None
+
+    writer = None
+    renderer = AsciiTreeRenderer()
+    if options.output_format == "ndjson":
+        writer = JsonLinesWriter(out)
+        if message is None:
+            writer.write_model(sol_n)
+        else:
+            writer.write_model(sol_n, message=message)
+    else:
+        print("Answer: " + str(sol_n), file=out)
+        if message is not None:
+            print(message, file=out)
+
+    for a in atoms_to_explain:
+        if remaining == 0:
+            break
+
+        k = options.top_k if remaining is None else min(options.top_k, remaining)
+        best = ranked.best(causes.id_of(a), k)
+        if remaining is not None:
+            remaining -= len(best)
+        stats.count_model(atom=a, explanations=len(best))
+
+        if writer is not None:
+            writer.write_atom(a, [e for _, e in best], costs=[cost for cost, _ in best])
+            continue
+
+        out.write(">> {}\t[{}]\n".format(a, len(best)))
+        for cost, e in best:
+            out.write("  cost: {}\n".format(cost))
+            renderer.write(e, out)
+            out.write("\n")
+
+    if writer is None:
+        out.write("\n")
+    stats.count("cycle cut-offs", engine.cycle_cutoffs)
+
+
+def _explained_atoms(causes, engine, atoms_to_explain, options, render, reuse=None):
+    """
+    Explains the given atoms of a model, respecting the limits of the options.
+    @param DerivationGraph causes: the causes of the model.
+    @param ExplanationEngine engine: the explanation engine of the model.
+    @param List[clingo.Symbol] atoms_to_explain:
+    @param ExplainOptions options:
+    @param function render: function applied to the explanations by the workers when the atoms are explained in
+    parallel (None to receive the explanations themselves). It must be None if reuse is given.
+    @param reuse: if given (an incremental.ExplanationReuse or incremental.ExplanationCache), the explanations that can
+    be reused are taken from it (and the new ones are stored in it). Only explanations are stored in it, never rendered
+    trees (see put_rendered).
+    @return Iterator[(clingo.Symbol, Iterable)]: each atom with its explanations. In the serial case, the explanations
+    are computed while the iterable is consumed, so it must be consumed before advancing to the next atom.
+    """
+    if reuse is not None and render is not None:
+        raise ValueError("the reused explanations can not be rendered by the workers")
 
-    tree = ""
-    branch = "  |" * (level + 1) + "__"
-
-    # Builds the tree
-    if explanation:
-        # Adds the root of the explanation
-        if level == 0:
-            tree += "  *\n"
-        # One pair per child   {child1: child_e1, child2: child_e2}
-        for child, chidl_e in explanation.items():
-            tree += "{branch}{node}\n{subtree}".format(branch=branch, node=str(child),
-                                                       subtree=_ascii_tree_explanation(chidl_e, level+1))
-    elif level == 0:
-        tree += "\t1\n"
+    remaining = options.max_explanations if options.max_explanations > 0 else None
+    atom_limit = options.max_atom_explanations if options.max_atom_explanations > 0 else None
 
-    return tree
+    if options.atom_jobs > 1 and len(atoms_to_explain) > 1:
+        # Only imported when needed, since it loads multiprocessing (see --profile-startup)
+        import parallel
 
+        if remaining is not None:
+            atom_limit = remaining if atom_limit is None else min(atom_limit, remaining)
 
-def ascii_tree_explanation(explanation):
+        if reuse is None:
+            atoms_explanations = parallel.explain_atoms(engine, [causes.id_of(a) for a in atoms_to_explain],
+                                                        atom_limit, options.atom_jobs, render)
+        else:
+            missing = reuse.missing(atoms_to_explain)
+            # The reused explanations are taken before storing the new ones, which may evict them from a bounded cache
+            missing_set = set(missing)
+            known = {a: reuse.get(a) for a in atoms_to_explain if a not in missing_set}
+            for a, explanations in zip(missing, parallel.explain_atoms(engine, [causes.id_of(a) for a in missing],
+                                                                       atom_limit, options.atom_jobs, render)):
+                reuse.put(a, explanations)
+                known[a] = explanations
+            atoms_explanations = map(known.get, atoms_to_explain)
+
+        for a, explanations in zip(atoms_to_explain, atoms_explanations):
+            if remaining == 0:
+                break
+            if remaining is not None:
+                explanations = explanations[:remaining]
+                remaining -= len(explanations)
+            yield a, explanations
+    elif reuse is not None:
+        # The whole list of each atom is computed so it can be reused even if it is not completely printed
+        for a in atoms_to_explain:
+            if remaining == 0:
+                break
+
+            explanations = reuse.get(a)
+            if explanations is None:
+                explanations = build_explanations(a, causes, engine, atom_limit)
+                reuse.put(a, explanations)
+            if remaining is not None:
+                explanations = explanations[:remaining]
+                remaining -= len(explanations)
+            yield a, explanations
+    else:
+        def counted(explanations):
+            nonlocal remaining
+            for e in explanations:
+                if remaining is not None:
+                    remaining -= 1
+                yield e
+
+        for a in atoms_to_explain:
+            if remaining == 0:
+                break
+
+            limit = atom_limit
+            if remaining is not None:
+                limit = remaining if limit is None else min(limit, remaining)
+
+            yield a, counted(islice(iter_explanations(a, causes, engine), limit))
+
+
+def explain_answer_sets(control, labels_dict, options, out, reuse=None):
     """
-    @param Dict explanation: an explanation
-    @return str: an str containing the ascii tree explanation.
+    Solves the grounded program and writes the explanations of its answer sets.
+    @param XClingoProgramControl control: the grounded control.
+    @param LabelIndex labels_dict: the processed labels of the program (see build_labels_dict).
+    @param ExplainOptions options:
+    @param out: file object where the output is written.
+    @param reuse: if given (an incremental.ExplanationReuse or incremental.ExplanationCache), the explanations of the
+    atoms whose derivations did not change are reused from previous answer sets (also from previous calls).
     """
-    return _ascii_tree_explanation(explanation, 0)
+    with control.solve(yield_=True) as it:
+        sol_n = 0
+        for m in it:
+            sol_n += 1
+            with stats.model(sol_n):
+                with stats.phase("fired atoms"):
+                    fired_values, fired_show_all, _ = partition_model(m.symbols(shown=True), control.fired_names)
+                stats.count_fired(fired_values)
+                write_model(out, sol_n, m, fired_values, fired_show_all, control.binding_plans, labels_dict,
+                            control.have_explain, options, reuse)
 
 
 def main():
@@ -299,59 +527,135 @@ def main():
                         help="Points out the debugging level. Default: none.")
     parser.add_argument('--auto-tracing', type=str, choices=["none", "facts", "all"], default="none",
                         help="Automatically creates traces for the rules of the program. Default: none.")
+    parser.add_argument('--max-atom-explanations', type=int, default=0,
+                        help="Maximum number of explanations printed for each atom (0 = all). Default: 0.")
+    parser.add_argument('--max-explanations', type=int, default=0,
+                        help="Maximum number of explanations printed for each answer set (0 = all). Default: 0.")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Number of worker processes that explain the answer sets while the main process keeps "
+                             "solving (not with --batch or --explanation-cache). Default: 1 (no workers).")
+    parser.add_argument('--atom-jobs', type=int, default=1,
+                        help="Number of worker processes that explain the atoms of each answer set in parallel. "
+                             "Default: 1 (no workers).")
+    parser.add_argument('--output-format', type=str, choices=["ascii", "ndjson"], default="ascii",
+                        help="Format of the explanations: ascii trees or JSON Lines (one record per model, atom and "
+                             "distinct explanation node). Default: ascii.")
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help="Directory where the translations of the programs are cached, so later runs on the same "
+                             "input go straight to grounding. Default: no cache.")
+    parser.add_argument('--batch', action='append', type=argparse.FileType('r'), default=[], metavar='FILE',
+                        help="Batch of facts that is added to the program after explaining it (can be repeated). The "
+                             "facts over atoms declared with #external in the program are assigned and the rest of the "
+                             "batch is grounded on its own, so the program is not grounded again, and only the atoms "
+                             "whose derivations changed are explained again.")
+    parser.add_argument('--explanation-cache', type=int, default=0, metavar='SIZE',
+                        help="Keeps the explanations of up to SIZE atoms across answer sets (and batches), indexed by "
+                             "their derivations, so an atom derived in the same way as in a previous answer set is not "
+                             "explained again. Least recently used atoms are evicted first. Default: 0 (disabled).")
+    parser.add_argument('--mark-reused', action='store_true',
+                        help="Marks the atoms whose explanations were reused from a previous answer set (with "
+                             "--explanation-cache or --batch).")
+    parser.add_argument('--count-only', action='store_true',
+                        help="Prints only the number of explanations of each atom, computed without enumerating them "
+                             "(the limits on the number of explanations do not apply).")
+    parser.add_argument('--rank-by', type=str, choices=list(RankedExplanations.COSTS), default=None,
+                        help="Prints only the explanations of lowest cost of each atom (see --top-k), found without "
+                             "enumerating the rest: the ones with fewer labels (size), with fewer levels (depth) or "
+                             "with the lowest sum of the weights given to the trace_rule sentences with @W (weight).")
+    parser.add_argument('--top-k', type=int, default=None, metavar='K',
+                        help="Number of explanations of lowest cost printed for each atom, with their costs. Implies "
+                             "--rank-by size if it is not given. Default: 1.")
+    parser.add_argument('--keep-all-atoms', action='store_true',
+                        help="Shows every atom in the models instead of only the ones needed to explain them (for "
+                             "debugging, it transfers more atoms from the solver).")
+    parser.add_argument('--stats', type=str, nargs='?', choices=["text", "json"], const="text", default=None,
+                        help="Prints (to stderr) the time, CPU time and peak memory of each phase and model (with "
+                             "the peak memory of the process when they end), some counters and the statistics of "
+                             "clingo, as text or JSON. With --jobs, the models are explained by the workers and are not "
+                             "included. Default format: text.")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="Prints (to stderr) the time spent importing each module and in each initialisation step.")
     #parser.add_argument('n_sol', nargs='?', type=int, default=0, help="Number of solutions")
     parser.add_argument('infile', nargs='+', type=argparse.FileType('r'), default=sys.stdin, help="ASP program")
-    args = parser.parse_args()
-
-    # Reads input files
-    original_program = ""
-    for file in args.infile:
-        original_program += file.read()
+    with startup_profiler.step("argument parsing"):
+        args = parser.parse_args()
+        if args.jobs > 1 and args.atom_jobs > 1:
+            parser.error("--jobs and --atom-jobs cannot be used together.")
+        # The workers explain each answer set on their own, so they can not reuse explanations between them
+        if args.jobs > 1 and (args.batch or args.explanation_cache > 0):
+            parser.error("--jobs cannot be used with --batch or --explanation-cache.")
+        if args.top_k is not None and args.rank_by is None:
+            args.rank_by = "size"
+        if args.rank_by is not None and args.count_only:
+            parser.error("--count-only cannot be used with --rank-by or --top-k.")
+        if args.top_k is not None and args.top_k < 1:
+            parser.error("--top-k must be at least 1.")
+    if args.stats is not None:
+        stats.enable()
 
     # Prepares the original program and obtain an XClingoControl
     # TODO: why some trace_alls are duplicating answer sets? patch: --project
-    control = translation.prepare_xclingo_program(['-n 0', "--project"], original_program, args.debug_level)
-
-    control.ground([("base", [])])
+    with startup_profiler.step("translation"), stats.phase("program preparation"):
+        # The input files are read line by line while their magic comments are translated
+        try:
+            control = translation.prepare_xclingo_program(['-n 0', "--project"], args.infile, args.debug_level,
+                                                          args.cache_dir, project_models=not args.keep_all_atoms)
+        except translation.TranslationError as error:
+            print(error)
+            exit(0)
+
+    with startup_profiler.step("grounding"), stats.phase("grounding"):
+        control.ground([("base", [])])
 
     # Constructs labels
-    general_labels_dict = build_labels_dict(control)
+    with startup_profiler.step("labels"), stats.phase("labels"):
+        general_labels_dict = build_labels_dict(control)
+
+    startup_profiler.report()
+
+    options = ExplainOptions(args.auto_tracing, args.debug_level, args.max_atom_explanations, args.max_explanations,
+                             args.atom_jobs, args.output_format, None, args.mark_reused, args.count_only,
+                             args.rank_by, args.top_k or 1)
 
     # Solves and prints explanations
-    with control.solve(yield_=True) as it:
-        sol_n = 0
-        for m in it:
-            sol_n += 1
-            print("Answer: " + str(sol_n))
-
-            causes = build_causes(m, control.traces, build_fired_dict(m), general_labels_dict, args.auto_tracing)
-
-            if args.debug_level == "causes":
-                print(general_labels_dict)
-                print(causes.to_string(), end="\n\n")
-                continue
-
-            # atoms_to_explain stores the atom that have to be explained for the current model.
-            fired_show_all = [remove_prefix("show_all_", a) for a in find_and_remove_by_prefix(m, 'show_all_')]
-            for s in [remove_prefix("nshow_all_", a) for a in find_and_remove_by_prefix(m, 'nshow_all_')]:
-                fired_show_all.append(clingo.Function(s.name, s.arguments, False))
-
-            if control.have_explain and fired_show_all:
-                atoms_to_explain = [a for a in causes['fired_head'].unique() if a in fired_show_all]
-            elif control.have_explain and not fired_show_all:
-                print("Any show_all rule was activated.")
-                atoms_to_explain = []
-            else:   # If there is not show_all rules then explain everything in the model.
-                atoms_to_explain = causes['fired_head'].unique()
-
-            for a in atoms_to_explain:
-                print(">> {}".format(a), end='')
-                a_explanations = build_explanations(a, causes)
-                print("\t[{}]".format(len(a_explanations)))
-                for e in a_explanations:
-                    print(ascii_tree_explanation(e))
-
-            print()
+    if args.explanation_cache > 0:
+        reuse = incremental.ExplanationCache(args.explanation_cache)
+    elif args.batch:
+        reuse = incremental.ExplanationReuse()
+    else:
+        reuse = None
+    _explain(control, general_labels_dict, options, args.jobs, reuse)
+
+    for i, batch in enumerate(args.batch, 1):
+        if args.output_format == "ndjson":
+            JsonLinesWriter(sys.stdout).write_batch(i, batch.name)
+        else:
+            print("Batch {}: {}".format(i, batch.name))
+
+        with stats.phase("batch grounding"):
+            try:
+                incremental.add_batch(control, "xclingo_batch_{}".format(i), [batch])
+            except ValueError as error:  # Also a TranslationError
+                print(error)
+                exit(0)
+        with stats.phase("labels"):
+            general_labels_dict = build_labels_dict(control)
+        _explain(control, general_labels_dict, options, args.jobs, reuse)
+
+    if stats.enabled:
+        stats.merge_clingo(control.statistics)
+        sys.stdout.flush()
+        stats.report(sys.stderr, args.stats)
+
+
+def _explain(control, labels_dict, options, jobs, reuse):
+    with stats.phase("solving and explaining"):
+        if jobs > 1:
+            import parallel
+            parallel.solve_and_explain(control, labels_dict, options, jobs, explain_model, sys.stdout.write)
+        else:
+            explain_answer_sets(control, labels_dict, options, sys.stdout, reuse)
+
 
 if __name__ == "__main__":
     main()